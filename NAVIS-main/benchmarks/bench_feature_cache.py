@@ -0,0 +1,108 @@
+"""
+Speed / quality of cross-step UNet feature caching (`UNetFeatureCache`, DeepCache-style) on CPU.
+
+Builds a reduced-size SDXL-shaped UNet (same block layout and text-time conditioning as SDXL, narrower
+channels, random weights) with the Story IP attention processors on its cross-attention layers, and runs
+the CFG denoising loop of `StableDiffusionXLCustomPipeline` once at every `--intervals` entry (1 = the full
+UNet at every step). For each run it reports the wall time per step, the speedup and the agreement of the
+final latents with the full run (PSNR over the latent range and cosine similarity). Random weights make
+the quality columns a proxy for how far the cached features drift, not an image-quality score; check
+real outputs with `cache_interval` on the custom pipeline:
+
+    python benchmarks/bench_feature_cache.py --intervals 1 2 3 5 --depth 1 2
+"""
+import argparse
+import os
+import sys
+import time
+
+import torch
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, "ip_adapter")]
+
+from diffusers import DDIMScheduler, UNet2DConditionModel  # noqa: E402
+from ip_adapter.attention_processor import set_story_attn_processors  # noqa: E402
+from ip_adapter.feature_cache import UNetFeatureCache  # noqa: E402
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--intervals', default=[1, 2, 3, 5], type=int, nargs="+", help="1 = no caching (reference)")
+parser.add_argument('--depth', default=[1, 2], type=int, nargs="+", help="shallow block levels recomputed")
+parser.add_argument('--resolution', default=512, type=int)
+parser.add_argument('--batch', default=1, type=int, help="frames (the UNet batch is twice this, for CFG)")
+parser.add_argument('--steps', default=20, type=int)
+parser.add_argument('--num_ref', default=3, type=int)
+parser.add_argument('--threads', default=None, type=int)
+args = parser.parse_args()
+if args.threads:
+    torch.set_num_threads(args.threads)
+
+torch.manual_seed(0)
+context_dim, num_tokens, text_dim = 256, 4, 128
+unet = UNet2DConditionModel(
+    block_out_channels=(64, 128, 256),
+    layers_per_block=2,
+    down_block_types=("DownBlock2D", "CrossAttnDownBlock2D", "CrossAttnDownBlock2D"),
+    up_block_types=("CrossAttnUpBlock2D", "CrossAttnUpBlock2D", "UpBlock2D"),
+    attention_head_dim=(2, 4, 8),
+    transformer_layers_per_block=(1, 1, 2),
+    use_linear_projection=True,
+    cross_attention_dim=context_dim,
+    addition_embed_type="text_time",
+    addition_time_embed_dim=32,
+    projection_class_embeddings_input_dim=text_dim + 6 * 32,
+    sample_size=args.resolution // 8,
+).eval()
+set_story_attn_processors(unet, num_ref=args.num_ref, scale=0.5, num_tokens=num_tokens)
+
+scheduler = DDIMScheduler(num_train_timesteps=1000, beta_start=0.00085, beta_end=0.012,
+                          beta_schedule="scaled_linear", clip_sample=False, set_alpha_to_one=False, steps_offset=1)
+n = 2 * args.batch
+size = args.resolution // 8
+initial_latents = torch.randn(args.batch, 4, size, size)
+prompt_embeds = torch.randn(n, 77 + num_tokens * args.num_ref, context_dim)
+added_cond_kwargs = {
+    "text_embeds": torch.randn(n, text_dim),
+    "time_ids": torch.tensor([[args.resolution, args.resolution, 0, 0, args.resolution, args.resolution]] * n,
+                             dtype=torch.float32),
+}
+
+
+@torch.inference_mode()
+def denoise(interval, depth):
+    scheduler.set_timesteps(args.steps)
+    cache = UNetFeatureCache(unet, interval, depth)
+    latents = initial_latents * scheduler.init_noise_sigma
+    for t in scheduler.timesteps:
+        latent_model_input = scheduler.scale_model_input(torch.cat([latents] * 2), t)
+        noise_pred = cache(latent_model_input, t, encoder_hidden_states=prompt_embeds,
+                           added_cond_kwargs=added_cond_kwargs, cross_attention_kwargs={"ip_scale": 0.5})
+        noise_pred_uncond, noise_pred_text = noise_pred.chunk(2)
+        noise_pred = noise_pred_uncond + 5.0 * (noise_pred_text - noise_pred_uncond)
+        latents = scheduler.step(noise_pred, t, latents, return_dict=False)[0]
+    return latents, cache
+
+
+denoise(1, 1)  # warm-up
+start = time.perf_counter()
+reference, _ = denoise(1, 1)
+reference_ms = (time.perf_counter() - start) * 1000 / args.steps
+latent_range = (reference.max() - reference.min()).item()
+
+print(f"{args.resolution}px, UNet batch {n}, {args.steps} DDIM steps, num_ref={args.num_ref}, "
+      f"{torch.get_num_threads()} threads")
+print("| interval | depth | full / cached steps | ms / step | speedup | latent PSNR dB | cosine |")
+print("|---:|---:|---:|---:|---:|---:|---:|")
+print(f"| 1 | - | {args.steps} / 0 | {reference_ms:.1f} | 1.00x | inf | 1.0000 |")
+for depth in args.depth:
+    for interval in args.intervals:
+        if interval == 1:
+            continue
+        start = time.perf_counter()
+        latents, cache = denoise(interval, depth)
+        ms = (time.perf_counter() - start) * 1000 / args.steps
+        mse = torch.mean((latents - reference) ** 2).item()
+        psnr = 10 * torch.log10(torch.tensor(latent_range ** 2 / mse)).item()
+        cosine = torch.nn.functional.cosine_similarity(latents.flatten(), reference.flatten(), dim=0).item()
+        print(f"| {interval} | {depth} | {cache.full_steps} / {cache.cached_steps} | {ms:.1f} | "
+              f"{reference_ms / ms:.2f}x | {psnr:.1f} | {cosine:.4f} |")
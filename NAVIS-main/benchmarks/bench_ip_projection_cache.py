@@ -0,0 +1,71 @@
+"""
+Per-step cost of the IP-Adapter cross-attention with and without the to_k_ip / to_v_ip
+projection cache, as the number of reference images grows.
+
+Runs a single SDXL-sized cross-attention layer (hidden 1280, 20 heads, 2048-d context) on
+random weights, so it needs neither checkpoints nor a GPU:
+
+    python benchmarks/bench_ip_projection_cache.py --device cpu --tokens 1024
+"""
+import argparse
+import os
+import sys
+import time
+
+import torch
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, "ip_adapter")]
+
+from diffusers.models.attention_processor import Attention  # noqa: E402
+from ip_adapter.attention_processor import IPAttnProcessor  # noqa: E402
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--device', default="cuda" if torch.cuda.is_available() else "cpu", type=str)
+parser.add_argument('--tokens', default=1024, type=int, help="latent tokens per sample (32x32 block at 1024px)")
+parser.add_argument('--batch', default=2, type=int, help="UNet batch (2 = one frame with CFG)")
+parser.add_argument('--steps', default=20, type=int)
+parser.add_argument('--num_refs', default="1,5,15,30,60", type=str)
+args = parser.parse_args()
+
+dtype = torch.float16 if args.device == "cuda" else torch.float32
+hidden_size, context_dim, heads, num_tokens = 1280, 2048, 20, 4
+
+
+def sync():
+    if args.device == "cuda":
+        torch.cuda.synchronize()
+
+
+def per_step_ms(processor, hidden_states, encoder_hidden_states):
+    attn = Attention(query_dim=hidden_size, cross_attention_dim=context_dim, heads=heads, dim_head=hidden_size // heads)
+    attn = attn.to(args.device, dtype)
+    attn.set_processor(processor)
+    processor.clear_ip_cache()
+    with torch.no_grad():
+        attn(hidden_states, encoder_hidden_states)  # warm-up, also fills the cache
+        sync()
+        start = time.perf_counter()
+        for _ in range(args.steps):
+            attn(hidden_states, encoder_hidden_states)
+        sync()
+    return (time.perf_counter() - start) * 1000 / args.steps
+
+
+print(f"device={args.device} dtype={dtype} tokens={args.tokens} batch={args.batch} steps={args.steps}")
+print(f"{'num_ref':>8} {'ip tokens':>10} {'uncached ms':>12} {'cached ms':>10} {'saved ms':>9} {'saved %':>8}")
+for num_ref in [int(n) for n in args.num_refs.split(",")]:
+    torch.manual_seed(0)
+    hidden_states = torch.randn(args.batch, args.tokens, hidden_size, device=args.device, dtype=dtype)
+    encoder_hidden_states = torch.randn(
+        args.batch, 77 + num_tokens * num_ref, context_dim, device=args.device, dtype=dtype
+    )
+    processor = IPAttnProcessor(hidden_size, context_dim, num_ref=num_ref, scale=0.5, num_tokens=num_tokens)
+    processor = processor.to(args.device, dtype)
+
+    processor.cache_ip_projection = False
+    uncached = per_step_ms(processor, hidden_states, encoder_hidden_states)
+    processor.cache_ip_projection = True
+    cached = per_step_ms(processor, hidden_states, encoder_hidden_states)
+    print(f"{num_ref:>8} {num_tokens * num_ref:>10} {uncached:>12.3f} {cached:>10.3f} "
+          f"{uncached - cached:>9.3f} {100 * (uncached - cached) / uncached:>7.1f}%")
@@ -0,0 +1,94 @@
+"""
+Per-frame decode time of the full SDXL VAE vs. the fast preview decoders, on CPU by default.
+
+Every intermediate Story-Iter pass used to end with a full VAE decode to 1024px, only for the frames to be
+shrunk to 256px thumbnails. This times, for a batch of `--frames` latents at `--resolution`:
+
+  * full VAE    — what the pipeline runs for output frames (decode at full resolution),
+  * vae         — the same VAE on latents area-downsampled to the `--size` preview,
+  * taesd       — TAESD-XL (tiny convolutional decoder) at the preview size,
+  * latent_rgb  — the linear latent -> RGB projection.
+
+Decode time does not depend on the weights, so both VAEs are built from their configs with random weights
+unless `--vae_path` / `--taesd_path` point at real ones:
+
+    python benchmarks/bench_preview_decoder.py --frames 4
+    python benchmarks/bench_preview_decoder.py --vae_path ckpt/story-ad/RealVisXL_V4/vae --taesd_path madebyollin/taesdxl
+"""
+import argparse
+import os
+import sys
+import time
+from types import SimpleNamespace
+
+import torch
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, "ip_adapter")]
+
+from diffusers import AutoencoderKL, AutoencoderTiny  # noqa: E402
+from ip_adapter.preview_decoder import PREVIEW_DECODERS, TinyVAEDecoder, _to_pil, _vae_decode  # noqa: E402
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--device', default="cpu", type=str)
+parser.add_argument('--frames', default=4, type=int, help="latents decoded per batch")
+parser.add_argument('--resolution', default=1024, type=int, help="frame resolution the latents belong to")
+parser.add_argument('--size', default=256, type=int, help="preview / thumbnail size")
+parser.add_argument('--repeats', default=3, type=int)
+parser.add_argument('--vae_path', default=None, type=str)
+parser.add_argument('--taesd_path', default=None, type=str)
+args = parser.parse_args()
+
+dtype = torch.float16 if args.device == "cuda" else torch.float32
+torch.manual_seed(0)
+if args.vae_path:
+    vae = AutoencoderKL.from_pretrained(args.vae_path, torch_dtype=dtype)
+else:
+    vae = AutoencoderKL(
+        down_block_types=["DownEncoderBlock2D"] * 4,
+        up_block_types=["UpDecoderBlock2D"] * 4,
+        block_out_channels=[128, 256, 512, 512],
+        layers_per_block=2,
+        latent_channels=4,
+        sample_size=1024,
+        scaling_factor=0.13025,
+        force_upcast=True,
+    ).to(dtype)
+vae = vae.to(args.device).eval()
+tiny_vae = AutoencoderTiny.from_pretrained(args.taesd_path, torch_dtype=dtype) if args.taesd_path else AutoencoderTiny().to(dtype)
+pipe = SimpleNamespace(vae=vae, upcast_vae=lambda: vae.to(torch.float32))
+
+latents = torch.randn(args.frames, 4, args.resolution // 8, args.resolution // 8, device=args.device, dtype=dtype)
+
+
+def full_vae(pipe, latents, size):
+    with torch.inference_mode():
+        return _to_pil(_vae_decode(pipe, latents), args.resolution)
+
+
+decoders = {
+    "full VAE": full_vae,
+    "vae": PREVIEW_DECODERS["vae"],
+    "taesd": TinyVAEDecoder(tiny_vae=tiny_vae.to(args.device).eval()),
+    "latent_rgb": PREVIEW_DECODERS["latent_rgb"],
+}
+
+
+def sync():
+    if args.device == "cuda":
+        torch.cuda.synchronize()
+
+
+print(f"device={args.device} dtype={dtype}: {args.frames} latents of {args.resolution}px frames -> {args.size}px previews")
+print(f"{'decoder':>12} {'output px':>10} {'ms / frame':>11} {'vs full VAE':>12}")
+full_ms = None
+for name, decoder in decoders.items():
+    decoder(pipe, latents[:1], args.size)  # warm-up
+    sync()
+    start = time.perf_counter()
+    for _ in range(args.repeats):
+        images = decoder(pipe, latents, args.size)
+    sync()
+    ms = (time.perf_counter() - start) * 1000 / (args.repeats * args.frames)
+    full_ms = full_ms or ms
+    print(f"{name:>12} {images[0].size[0]:>10} {ms:>11.1f} {full_ms / ms:>11.1f}x")
@@ -0,0 +1,77 @@
+"""
+Memory/latency of the SDPA Story processor (`StoryAttnProcessor2_0`) against the bmm `IPAttnProcessor`
+on the SDXL cross-attention shapes of a 1024x1024 generation. The max |diff| column is informational;
+numerical equivalence is tested in `tests/test_sdpa_attention.py`.
+
+    python benchmarks/bench_sdpa_attention.py --device cuda
+"""
+import argparse
+import os
+import sys
+import time
+
+import torch
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, "ip_adapter")]
+
+from diffusers.models.attention_processor import Attention  # noqa: E402
+from ip_adapter.attention_processor import IPAttnProcessor, StoryAttnProcessor2_0  # noqa: E402
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--device', default="cuda" if torch.cuda.is_available() else "cpu", type=str)
+parser.add_argument('--num_ref', default=15, type=int)
+parser.add_argument('--batch', default=2, type=int, help="UNet batch (2 = one frame with CFG)")
+parser.add_argument('--steps', default=10, type=int)
+args = parser.parse_args()
+
+dtype = torch.float16 if args.device == "cuda" else torch.float32
+context_dim, num_tokens = 2048, 4
+# SDXL cross-attention layers at 1024x1024: 64x64 latents in down_blocks.1 / up_blocks.1, 32x32 in the rest
+layers = [("64x64 / 640 ch", 64 * 64, 640, 10), ("32x32 / 1280 ch", 32 * 32, 1280, 20)]
+
+
+def sync():
+    if args.device == "cuda":
+        torch.cuda.synchronize()
+
+
+def run(processor, attn, hidden_states, encoder_hidden_states):
+    attn.set_processor(processor)
+    if args.device == "cuda":
+        torch.cuda.empty_cache()
+        torch.cuda.reset_peak_memory_stats()
+    base = torch.cuda.memory_allocated() if args.device == "cuda" else 0
+    with torch.no_grad():
+        out = attn(hidden_states, encoder_hidden_states)
+        sync()
+        start = time.perf_counter()
+        for _ in range(args.steps):
+            attn(hidden_states, encoder_hidden_states)
+        sync()
+    ms = (time.perf_counter() - start) * 1000 / args.steps
+    peak_mb = (torch.cuda.max_memory_allocated() - base) / 2**20 if args.device == "cuda" else float("nan")
+    return out, ms, peak_mb
+
+
+print(f"device={args.device} dtype={dtype} batch={args.batch} num_ref={args.num_ref}")
+print(f"{'layer':>16} {'context':>8} {'max |diff|':>11} {'bmm ms':>8} {'sdpa ms':>8} {'bmm MB':>8} {'sdpa MB':>8}")
+for label, tokens, hidden_size, heads in layers:
+    for context in ("text", "text+ip"):
+        torch.manual_seed(0)
+        attn = Attention(query_dim=hidden_size, cross_attention_dim=context_dim, heads=heads,
+                         dim_head=hidden_size // heads).to(args.device, dtype)
+        bmm = IPAttnProcessor(hidden_size, context_dim, num_ref=args.num_ref, scale=0.5, num_tokens=num_tokens)
+        bmm = bmm.to(args.device, dtype)
+        sdpa = StoryAttnProcessor2_0(hidden_size, context_dim, num_ref=args.num_ref, scale=0.5, num_tokens=num_tokens)
+        sdpa.load_state_dict(bmm.state_dict())
+        sdpa = sdpa.to(args.device, dtype)
+
+        context_len = 77 if context == "text" else 77 + num_tokens * args.num_ref
+        hidden_states = torch.randn(args.batch, tokens, hidden_size, device=args.device, dtype=dtype)
+        encoder_hidden_states = torch.randn(args.batch, context_len, context_dim, device=args.device, dtype=dtype)
+
+        ref, bmm_ms, bmm_mb = run(bmm, attn, hidden_states, encoder_hidden_states)
+        out, sdpa_ms, sdpa_mb = run(sdpa, attn, hidden_states, encoder_hidden_states)
+        diff = (ref.float() - out.float()).abs().max().item()
+        print(f"{label:>16} {context:>8} {diff:>11.2e} {bmm_ms:>8.2f} {sdpa_ms:>8.2f} {bmm_mb:>8.1f} {sdpa_mb:>8.1f}")
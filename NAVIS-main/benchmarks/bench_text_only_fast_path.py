@@ -0,0 +1,71 @@
+"""
+Pass 0 (text-only) cost of the SDXL cross-attention layers with the image-prompt fast path.
+
+Before the fast path, a 77-token text-only context still ran `to_k_ip` / `to_v_ip` and a second
+attention over the same 77 tokens, then multiplied the result by zero. That cost is reproduced
+here by feeding a 77 + 77 token context, which runs exactly the same amount of image-branch work.
+Per-layer timings are weighted by the number of SDXL cross-attention layers at each resolution
+to give a per-UNet-call estimate:
+
+    python benchmarks/bench_text_only_fast_path.py --device cuda
+"""
+import argparse
+import os
+import sys
+import time
+
+import torch
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, "ip_adapter")]
+
+from diffusers.models.attention_processor import Attention  # noqa: E402
+from ip_adapter.attention_processor import IPAttnProcessor, StoryAttnProcessor2_0  # noqa: E402
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--device', default="cuda" if torch.cuda.is_available() else "cpu", type=str)
+parser.add_argument('--batch', default=2, type=int, help="UNet batch (2 = one frame with CFG)")
+parser.add_argument('--steps', default=10, type=int)
+args = parser.parse_args()
+
+dtype = torch.float16 if args.device == "cuda" else torch.float32
+context_dim = 2048
+# (label, latent tokens at 1024px, hidden size, heads, cross-attention layers of this shape in the SDXL UNet)
+layers = [("64x64 / 640 ch", 64 * 64, 640, 10, 10), ("32x32 / 1280 ch", 32 * 32, 1280, 20, 60)]
+
+
+def sync():
+    if args.device == "cuda":
+        torch.cuda.synchronize()
+
+
+def per_call_ms(attn, hidden_states, encoder_hidden_states):
+    with torch.no_grad():
+        attn(hidden_states, encoder_hidden_states)
+        sync()
+        start = time.perf_counter()
+        for _ in range(args.steps):
+            attn(hidden_states, encoder_hidden_states)
+        sync()
+    return (time.perf_counter() - start) * 1000 / args.steps
+
+
+print(f"device={args.device} dtype={dtype} batch={args.batch}")
+print(f"{'processor':>22} {'layer':>16} {'before ms':>10} {'fast ms':>8} {'speedup':>8}")
+for processor_cls in (IPAttnProcessor, StoryAttnProcessor2_0):
+    unet_before = unet_fast = 0.0
+    for label, tokens, hidden_size, heads, count in layers:
+        torch.manual_seed(0)
+        attn = Attention(query_dim=hidden_size, cross_attention_dim=context_dim, heads=heads,
+                         dim_head=hidden_size // heads).to(args.device, dtype)
+        attn.set_processor(processor_cls(hidden_size, context_dim, scale=0.3).to(args.device, dtype))
+        hidden_states = torch.randn(args.batch, tokens, hidden_size, device=args.device, dtype=dtype)
+        text = torch.randn(args.batch, 77, context_dim, device=args.device, dtype=dtype)
+
+        before = per_call_ms(attn, hidden_states, torch.cat([text, text], dim=1))
+        fast = per_call_ms(attn, hidden_states, text)
+        unet_before += count * before
+        unet_fast += count * fast
+        print(f"{processor_cls.__name__:>22} {label:>16} {before:>10.2f} {fast:>8.2f} {before / fast:>7.2f}x")
+    print(f"{processor_cls.__name__:>22} {'per UNet call':>16} {unet_before:>10.1f} {unet_fast:>8.1f} "
+          f"{unet_before / unet_fast:>7.2f}x")
@@ -0,0 +1,80 @@
+"""
+Throughput / quality report for dropping classifier-free guidance late in denoising.
+
+Runs a schedule (`--schedule`, default the server's) on a story once per CFG cutoff. The first entry of
+`--cutoffs` is the reference: `none` = guidance at every step (the old loop). For the other entries every
+pass runs only the conditional branch, at half the UNet batch, for the steps past that fraction of its
+schedule. `--pipeline custom` runs the same comparison through `StableDiffusionXLCustomPipeline`'s own loop.
+For each run it reports:
+
+  * wall time of the whole schedule, frames per second and the speedup over the reference,
+  * CLIP consistency of the final frames (see `report_common`),
+  * similarity to reference: mean per-frame CLIP cosine similarity to the reference run's final frame,
+  * PSNR of the final frames against the reference run's.
+
+The final frames of every run are saved under `--out_dir` for side-by-side inspection:
+
+    python benchmarks/report_cfg_cutoff.py --cutoffs none 0.9 0.7 0.5
+"""
+import argparse
+import dataclasses
+import os
+import time
+
+import numpy as np
+
+from report_common import (add_model_args, clip_embeds, consistency, load_prompts, load_storyadapter, save_frames,
+                           similarity, sync)
+from diffusers import StableDiffusionXLPipeline
+from ip_adapter import StoryIterSchedule, run_story_iter
+from ip_adapter.custom_pipelines import StableDiffusionXLCustomPipeline
+
+parser = add_model_args(argparse.ArgumentParser())
+parser.add_argument('--pipeline', default="sdxl", choices=["sdxl", "custom"], type=str)
+parser.add_argument('--schedule', default="default", type=str, help="Story-Iter schedule name or file")
+parser.add_argument('--cutoffs', default=["none", "0.9", "0.7", "0.5"], type=str, nargs="+",
+                    help="CFG cutoffs to compare ('none' = guidance at every step); the first one is the reference")
+parser.add_argument('--out_dir', default="story_test/cfg_cutoff", type=str)
+args = parser.parse_args()
+
+
+def psnr(images, reference_images):
+    values = []
+    for image, reference in zip(images, reference_images):
+        mse = np.mean((np.asarray(image, dtype=np.float64) - np.asarray(reference, dtype=np.float64)) ** 2)
+        values.append(float("inf") if mse == 0 else 10 * np.log10(255 ** 2 / mse))
+    return float(np.mean(values))
+
+
+pipeline_cls = StableDiffusionXLCustomPipeline if args.pipeline == "custom" else StableDiffusionXLPipeline
+storyadapter = load_storyadapter(args, pipeline_cls)
+prompts = load_prompts(args.story)
+base_schedule = StoryIterSchedule.load(args.schedule)
+
+rows = []
+reference_images = reference_embeds = reference_seconds = None
+for label in args.cutoffs:
+    cutoff = None if label == "none" else float(label)
+    schedule = dataclasses.replace(
+        base_schedule, passes=[dataclasses.replace(config, cfg_cutoff=cutoff) for config in base_schedule.passes]
+    )
+    sync(args.device)
+    start = time.perf_counter()
+    images = run_story_iter(storyadapter, prompts, schedule, style=args.style, memory_budget_gb=args.memory_budget_gb)
+    sync(args.device)
+    seconds = time.perf_counter() - start
+
+    embeds = clip_embeds(storyadapter, images)
+    if reference_images is None:
+        reference_images, reference_embeds, reference_seconds = images, embeds, seconds
+    rows.append((label, seconds, len(prompts) * len(schedule.passes) / seconds, reference_seconds / seconds,
+                 consistency(embeds), similarity(embeds, reference_embeds), psnr(images, reference_images)))
+    save_frames(images, os.path.join(args.out_dir, f"cutoff_{label}"))
+
+print(f"{len(prompts)} frames, schedule '{base_schedule.name}' ({len(base_schedule.passes)} passes), "
+      f"{pipeline_cls.__name__}")
+print("| CFG cutoff | wall s | frames/s | speedup | CLIP consistency | similarity to reference | PSNR dB |")
+print("|---:|---:|---:|---:|---:|---:|---:|")
+for label, seconds, fps, speedup, frame_consistency, to_reference, frame_psnr in rows:
+    print(f"| {label} | {seconds:.1f} | {fps:.2f} | {speedup:.2f}x | {frame_consistency:.4f} | "
+          f"{to_reference:.4f} | {frame_psnr:.1f} |")
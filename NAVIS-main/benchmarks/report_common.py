@@ -0,0 +1,94 @@
+"""
+Setup and metrics shared by the Story-Iter quality / latency reports (`report_*.py`).
+
+`add_model_args` adds the checkpoint, story and device flags every report takes and `load_storyadapter`
+builds the fp16 StoryAdapterXL they run (with one short warm-up generation, so the first configuration
+doesn't pay for CUDA / cuDNN initialization). The reports compare the final frames of their runs with:
+
+  * `consistency` — CLIP consistency: mean pairwise cosine similarity of the frames' CLIP image embeddings
+    (the same ViT-H encoder the IP-Adapter uses), i.e. how alike the frames of one story look,
+  * `similarity` — mean per-frame cosine similarity between two runs of the same story.
+"""
+import json
+import os
+import sys
+
+import torch
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, "ip_adapter")]
+
+from diffusers import DDIMScheduler, StableDiffusionXLPipeline  # noqa: E402
+from ip_adapter import StoryAdapterXL  # noqa: E402
+
+
+def add_model_args(parser):
+    parser.add_argument('--base_model_path', default=r"ckpt/story-ad/RealVisXL_V4", type=str)
+    parser.add_argument('--image_encoder_path', type=str, default=r"ckpt/ipa/sdxl_models/image_encoder")
+    parser.add_argument('--ip_ckpt', default=r"ckpt/ip-adapter_sdxl.bin", type=str)
+    parser.add_argument('--story', default=os.path.join(ROOT, "story_json", "story_1.json"), type=str)
+    parser.add_argument('--style', default="storybook", type=str)
+    parser.add_argument('--device', default="cuda", type=str)
+    parser.add_argument('--memory_budget_gb', default=24, type=float)
+    return parser
+
+
+def load_prompts(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        story = json.load(f)
+    prompts = []
+    for shot in story["Shots"]:
+        description = shot["Static Shot Description"]
+        for name, char in story["Characters"].items():
+            description = description.replace(name, char['prompt'])
+        prompts.append(description)
+    return prompts
+
+
+def load_storyadapter(args, pipeline_cls=StableDiffusionXLPipeline):
+    noise_scheduler = DDIMScheduler(
+        num_train_timesteps=1000,
+        beta_start=0.00085,
+        beta_end=0.012,
+        beta_schedule="scaled_linear",
+        clip_sample=False,
+        set_alpha_to_one=False,
+        steps_offset=1,
+    )
+    pipe = pipeline_cls.from_pretrained(
+        args.base_model_path,
+        torch_dtype=torch.float16,
+        scheduler=noise_scheduler,
+        feature_extractor=None,
+        safety_checker=None,
+    )
+    pipe.set_progress_bar_config(disable=True)
+    storyadapter = StoryAdapterXL(pipe, args.image_encoder_path, args.ip_ckpt, args.device)
+    storyadapter.generate_batch(["a warm-up frame"], num_inference_steps=2, style=args.style, height=512, width=512)
+    return storyadapter
+
+
+def sync(device):
+    if device == "cuda":
+        torch.cuda.synchronize()
+
+
+def clip_embeds(storyadapter, images):
+    embeds = storyadapter.get_reference_embeds(images).clip_image_embeds.float()
+    return torch.nn.functional.normalize(embeds, dim=-1)
+
+
+def consistency(embeds):
+    n = embeds.shape[0]
+    similarity = embeds @ embeds.T
+    return ((similarity.sum() - similarity.diagonal().sum()) / (n * (n - 1))).item()
+
+
+def similarity(embeds, reference_embeds):
+    return (embeds * reference_embeds).sum(dim=-1).mean().item()
+
+
+def save_frames(images, directory):
+    os.makedirs(directory, exist_ok=True)
+    for i, image in enumerate(images):
+        image.save(os.path.join(directory, f"img_{i}.png"))
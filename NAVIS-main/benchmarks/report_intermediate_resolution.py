@@ -0,0 +1,72 @@
+"""
+Quality / latency report for rendering the intermediate Story-Iter passes at reduced resolution.
+
+Runs the server's schedule (pass 0 at scale 0.3, refinement passes over linspace(0.3, 0.5), a final pass
+at 0.5, fixed seed) on a story once per intermediate resolution. The final pass always renders at
+`--resolution`, and the first entry of `--intermediate` is the reference (1024 = the old behavior). For
+each run it reports:
+
+  * wall time of the whole schedule and the speedup over the reference,
+  * CLIP consistency of the final frames (see `report_common`),
+  * similarity to reference: mean per-frame CLIP cosine similarity to the reference run's final frame.
+
+The final frames of every run are saved under `--out_dir` for side-by-side inspection:
+
+    python benchmarks/report_intermediate_resolution.py --intermediate 1024 768 640 512
+"""
+import argparse
+import os
+import time
+
+import numpy as np
+
+from report_common import (add_model_args, clip_embeds, consistency, load_prompts, load_storyadapter, save_frames,
+                           similarity, sync)
+
+parser = add_model_args(argparse.ArgumentParser())
+parser.add_argument('--resolution', default=1024, type=int, help="render size of the final pass")
+parser.add_argument('--intermediate', default=[1024, 768, 640, 512], type=int, nargs="+",
+                    help="intermediate-pass render sizes to compare; the first one is the reference")
+parser.add_argument('--refine_passes', default=3, type=int)
+parser.add_argument('--steps', default=20, type=int)
+parser.add_argument('--seed', default=42, type=int)
+parser.add_argument('--out_dir', default="story_test/intermediate_resolution", type=str)
+args = parser.parse_args()
+
+
+def run_schedule(storyadapter, prompts, intermediate):
+    common = dict(seeds=args.seed, num_inference_steps=args.steps, style=args.style,
+                  memory_budget_gb=args.memory_budget_gb)
+    passes = [(0.3, intermediate)] + [(scale, intermediate) for scale in np.linspace(0.3, 0.5, args.refine_passes)]
+    passes.append((0.5, args.resolution))
+
+    sync(args.device)
+    start = time.perf_counter()
+    reference = None
+    for scale, resolution in passes:
+        images = storyadapter.generate_batch(prompts, reference_embeds=reference, scale=scale,
+                                             height=resolution, width=resolution, **common)
+        reference = storyadapter.get_reference_embeds([img.resize((256, 256)) for img in images])
+    sync(args.device)
+    return images, time.perf_counter() - start
+
+
+storyadapter = load_storyadapter(args)
+prompts = load_prompts(args.story)
+
+rows = []
+reference_embeds = reference_seconds = None
+for intermediate in args.intermediate:
+    images, seconds = run_schedule(storyadapter, prompts, intermediate)
+    embeds = clip_embeds(storyadapter, images)
+    if reference_embeds is None:
+        reference_embeds, reference_seconds = embeds, seconds
+    rows.append((intermediate, seconds, reference_seconds / seconds, consistency(embeds),
+                 similarity(embeds, reference_embeds)))
+    save_frames(images, os.path.join(args.out_dir, f"intermediate_{intermediate}"))
+
+print(f"{len(prompts)} frames, {args.refine_passes + 2} passes x {args.steps} steps, final pass {args.resolution}px")
+print("| intermediate px | wall s | speedup | CLIP consistency | similarity to reference |")
+print("|---:|---:|---:|---:|---:|")
+for intermediate, seconds, speedup, frame_consistency, to_reference in rows:
+    print(f"| {intermediate} | {seconds:.1f} | {speedup:.2f}x | {frame_consistency:.4f} | {to_reference:.4f} |")
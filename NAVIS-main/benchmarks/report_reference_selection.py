@@ -0,0 +1,65 @@
+"""
+Latency / consistency report for the Story-Iter reference-selection policies on long stories.
+
+The shots of `--story` are repeated until the story has `--frames` frames (the frame index is appended to
+each prompt). The schedule (`--schedule`) then runs once per policy in `--policies`, with `--k` references
+per frame for every policy but "all". For each run it reports:
+
+  * image tokens per frame in the refinement passes (4 per reference), which every cross-attention layer
+    attends to at every step,
+  * wall time of the whole schedule and the speedup over "all",
+  * CLIP consistency of the final frames (see `report_common`),
+  * neighbor consistency: mean CLIP cosine similarity of adjacent frames only.
+
+The final frames of every run are saved under `--out_dir`:
+
+    python benchmarks/report_reference_selection.py --frames 50 --policies all topk window pooled --k 8
+"""
+import argparse
+import dataclasses
+import os
+import time
+
+from report_common import add_model_args, clip_embeds, consistency, load_prompts, load_storyadapter, save_frames, sync
+from ip_adapter import StoryIterSchedule, run_story_iter
+
+parser = add_model_args(argparse.ArgumentParser())
+parser.add_argument('--frames', default=50, type=int, help="story length; shots are repeated to reach it")
+parser.add_argument('--schedule', default="default", type=str, help="Story-Iter schedule name or file")
+parser.add_argument('--policies', default=["all", "topk", "window", "pooled"], type=str, nargs="+",
+                    help="reference policies to compare; the first one is the reference")
+parser.add_argument('--k', default=8, type=int, help="references per frame for topk / window / pooled")
+parser.add_argument('--out_dir', default="story_test/reference_selection", type=str)
+args = parser.parse_args()
+
+
+def neighbor_consistency(embeds):
+    return (embeds[1:] * embeds[:-1]).sum(dim=-1).mean().item()
+
+
+storyadapter = load_storyadapter(args)
+shots = load_prompts(args.story)
+prompts = [f"{shots[i % len(shots)]}, scene {i + 1}" for i in range(args.frames)]
+base_schedule = StoryIterSchedule.load(args.schedule)
+
+rows = []
+reference_seconds = None
+for policy in args.policies:
+    schedule = dataclasses.replace(base_schedule, reference_policy=policy, max_references=args.k)
+    sync(args.device)
+    start = time.perf_counter()
+    images = run_story_iter(storyadapter, prompts, schedule, style=args.style, memory_budget_gb=args.memory_budget_gb)
+    sync(args.device)
+    seconds = time.perf_counter() - start
+    reference_seconds = reference_seconds or seconds
+
+    embeds = clip_embeds(storyadapter, images)
+    tokens = 4 * (len(prompts) if policy == "all" else min(args.k, len(prompts)))
+    rows.append((policy, tokens, seconds, reference_seconds / seconds, consistency(embeds), neighbor_consistency(embeds)))
+    save_frames(images, os.path.join(args.out_dir, f"{policy}_{args.frames}"))
+
+print(f"{len(prompts)} frames, schedule '{base_schedule.name}' ({len(base_schedule.passes)} passes), k={args.k}")
+print("| policy | image tokens / frame | wall s | speedup | CLIP consistency | neighbor consistency |")
+print("|---|---:|---:|---:|---:|---:|")
+for policy, tokens, seconds, speedup, frame_consistency, neighbors in rows:
+    print(f"| {policy} | {tokens} | {seconds:.1f} | {speedup:.2f}x | {frame_consistency:.4f} | {neighbors:.4f} |")
@@ -0,0 +1,77 @@
+"""
+Quality / latency report for warm-starting Story-Iter refinement passes from the previous pass's frames.
+
+Runs a schedule (`--schedule`, default the server's) on a story once per warm-start strength. The first
+entry of `--strengths` is the reference: `none` = every pass starts from pure noise (the old loop). For the
+other entries every refinement pass starts from the previous pass's frame noised to that strength, so it
+runs only that fraction of its steps; pass 0 always starts from noise, and the final pass does too unless
+`--warm_final` is given. For each run it reports:
+
+  * wall time of the whole schedule and the speedup over the reference,
+  * CLIP consistency of the final frames (see `report_common`),
+  * similarity to reference: mean per-frame CLIP cosine similarity to the reference run's final frame.
+
+The final frames of every run are saved under `--out_dir` for side-by-side inspection:
+
+    python benchmarks/report_warm_start.py --strengths none 0.8 0.6 0.4
+"""
+import argparse
+import dataclasses
+import os
+import time
+
+from report_common import (add_model_args, clip_embeds, consistency, load_prompts, load_storyadapter, save_frames,
+                           similarity, sync)
+from ip_adapter import StoryIterSchedule, run_story_iter
+
+parser = add_model_args(argparse.ArgumentParser())
+parser.add_argument('--schedule', default="default", type=str, help="Story-Iter schedule name or file")
+parser.add_argument('--strengths', default=["none", "0.8", "0.6", "0.4"], type=str, nargs="+",
+                    help="warm-start strengths to compare ('none' = from noise); the first one is the reference")
+parser.add_argument('--warm_final', action="store_true", help="warm-start the final pass as well")
+parser.add_argument('--out_dir', default="story_test/warm_start", type=str)
+args = parser.parse_args()
+
+
+def with_strength(schedule, strength):
+    last = len(schedule.passes) - 1
+    passes = [
+        dataclasses.replace(config, strength=strength if 0 < i < last or (i == last and args.warm_final) else None)
+        for i, config in enumerate(schedule.passes)
+    ]
+    return dataclasses.replace(schedule, passes=passes)
+
+
+storyadapter = load_storyadapter(args)
+prompts = load_prompts(args.story)
+base_schedule = StoryIterSchedule.load(args.schedule)
+
+# one warm-started generation too, so the first strength doesn't pay for building the img2img view
+warmup = storyadapter.generate_batch(prompts[:1], num_inference_steps=2, style=args.style, height=512, width=512)
+storyadapter.generate_batch(prompts[:1], num_inference_steps=2, style=args.style, height=512, width=512,
+                            init_images=warmup, strength=0.5)
+
+rows = []
+reference_embeds = reference_seconds = None
+for label in args.strengths:
+    strength = None if label == "none" else float(label)
+    schedule = with_strength(base_schedule, strength)
+    sync(args.device)
+    start = time.perf_counter()
+    images = run_story_iter(storyadapter, prompts, schedule, style=args.style, memory_budget_gb=args.memory_budget_gb)
+    sync(args.device)
+    seconds = time.perf_counter() - start
+
+    embeds = clip_embeds(storyadapter, images)
+    if reference_embeds is None:
+        reference_embeds, reference_seconds = embeds, seconds
+    rows.append((label, schedule.megapixel_steps(len(prompts)), seconds, reference_seconds / seconds,
+                 consistency(embeds), similarity(embeds, reference_embeds)))
+    save_frames(images, os.path.join(args.out_dir, f"strength_{label}"))
+
+print(f"{len(prompts)} frames, schedule '{base_schedule.name}' ({len(base_schedule.passes)} passes), "
+      f"final pass {'warm' if args.warm_final else 'from noise'}")
+print("| strength | megapixel-steps | wall s | speedup | CLIP consistency | similarity to reference |")
+print("|---:|---:|---:|---:|---:|---:|")
+for label, work, seconds, speedup, frame_consistency, to_reference in rows:
+    print(f"| {label} | {work:.0f} | {seconds:.1f} | {speedup:.2f}x | {frame_consistency:.4f} | {to_reference:.4f} |")
@@ -1,4 +1,5 @@
-from .ip_adapter import IPAdapter, IPAdapterPlus, IPAdapterPlusXL, StoryAdapterXL, IPAdapterFull
+from .ip_adapter import IPAdapter, IPAdapterPlus, IPAdapterPlusXL, StoryAdapterXL, IPAdapterFull, ReferenceEmbeds
+from .story_iter import PassConfig, StoryIterSchedule, run_story_iter
 
 __all__ = [
     "IPAdapter",
@@ -6,4 +7,8 @@ __all__ = [
     "IPAdapterPlusXL",
     "StoryAdapterXL",
     "IPAdapterFull",
+    "ReferenceEmbeds",
+    "PassConfig",
+    "StoryIterSchedule",
+    "run_story_iter",
 ]
@@ -3,6 +3,8 @@ import torch
 import torch.nn as nn
 import torch.nn.functional as F
 
+from .utils import downsample_attn_map
+
 
 class AttnProcessor(nn.Module):
     r"""
@@ -23,6 +25,7 @@ class AttnProcessor(nn.Module):
         encoder_hidden_states=None,
         attention_mask=None,
         temb=None,
+        ip_scale=None,
         *args,
         **kwargs,
     ):
@@ -88,12 +91,16 @@ class IPAttnProcessor(nn.Module):
         cross_attention_dim (`int`):
             The number of channels in the `encoder_hidden_states`.
         scale (`float`, defaults to 1.0):
-            the weight scale of image prompt.
+            the default weight scale of image prompt. Callers pass `cross_attention_kwargs={"ip_scale": ...}`
+            to override it per call, as a float or a 1-D tensor with one scale per prompt in the batch.
         num_tokens (`int`, defaults to 4 when do ip_adapter_plus it should be 16):
             The context length of the image features.
+        cache_ip_projection (`bool`, defaults to True):
+            Reuse the `to_k_ip` / `to_v_ip` projections of the image tokens across denoising steps.
     """
 
-    def __init__(self, hidden_size, cross_attention_dim=None, num_ref=0, scale=1.0, num_tokens=4):
+    def __init__(self, hidden_size, cross_attention_dim=None, num_ref=0, scale=1.0, num_tokens=4,
+                 cache_ip_projection=True):
         super().__init__()
 
         self.hidden_size = hidden_size
@@ -101,10 +108,63 @@ class IPAttnProcessor(nn.Module):
         self.num_ref = num_ref
         self.scale = scale
         self.num_tokens = num_tokens
+        self.cache_ip_projection = cache_ip_projection
+        self._ip_cache = None
+        # attention-map recording, switched on per call by utils.register_cross_attention_hook
+        self.record_attn_map = False
+        self.attn_map_size = 16
+        self.attn_map_aspect = 1.0
+        self.attn_map = None
 
         self.to_k_ip = nn.Linear(cross_attention_dim or hidden_size, hidden_size, bias=False)
         self.to_v_ip = nn.Linear(cross_attention_dim or hidden_size, hidden_size, bias=False)
 
+    def clear_ip_cache(self):
+        self._ip_cache = None
+
+    def resolve_scale(self, ip_scale, batch_size, like):
+        """
+        The image-prompt scale for this call: the per-call `ip_scale` from `cross_attention_kwargs`,
+        falling back to `self.scale`. Returns a float, or a `(batch, 1, 1)` tensor for per-sample
+        scales; those hold one entry per prompt and are tiled to the UNet batch, which
+        classifier-free guidance lays out as [uncond; cond].
+        """
+        scale = self.scale if ip_scale is None else ip_scale
+        if not torch.is_tensor(scale):
+            return scale
+        scale = scale.to(like.device, like.dtype)
+        return scale.repeat(batch_size // scale.shape[0]).view(batch_size, 1, 1)
+
+    def store_attn_map(self, attn_probs):
+        """Keep a head-averaged, downsampled CPU copy of `(batch, heads, query, ip_tokens)` attention probabilities."""
+        attn_map = downsample_attn_map(attn_probs.mean(dim=1), self.attn_map_size, self.attn_map_aspect)
+        self.attn_map = attn_map.to("cpu", torch.float16)
+
+    def project_ip(self, ip_hidden_states):
+        """
+        Return `(to_k_ip(x), to_v_ip(x))` for the image tokens.
+
+        The pipeline feeds the same `encoder_hidden_states` tensor to every denoising step, so the
+        projections are computed on the first step and reused until the token tensor (i.e. the
+        reference set) changes; its shape already covers the number of references. The cache holds
+        a reference to the source tensor, so its storage cannot be recycled by another tensor while
+        cached, and is swapped as a single tuple so concurrent callers never see a half-updated entry.
+        """
+        if not self.cache_ip_projection:
+            return self.to_k_ip(ip_hidden_states), self.to_v_ip(ip_hidden_states)
+
+        key = (
+            ip_hidden_states.data_ptr(),
+            tuple(ip_hidden_states.shape),
+            ip_hidden_states.stride(),
+            ip_hidden_states.dtype,
+        )
+        entry = self._ip_cache
+        if entry is None or entry[0] != key:
+            entry = (key, ip_hidden_states, self.to_k_ip(ip_hidden_states), self.to_v_ip(ip_hidden_states))
+            self._ip_cache = entry
+        return entry[2], entry[3]
+
     def __call__(
         self,
         attn,
@@ -112,6 +172,7 @@ class IPAttnProcessor(nn.Module):
         encoder_hidden_states=None,
         attention_mask=None,
         temb=None,
+        ip_scale=None,
         *args,
         **kwargs,
     ):
@@ -137,7 +198,7 @@ class IPAttnProcessor(nn.Module):
 
         query = attn.to_q(hidden_states)
 
-        scale = self.scale
+        scale = self.resolve_scale(ip_scale, batch_size, hidden_states)
         txt_scale = 1.
         if encoder_hidden_states is None:
             encoder_hidden_states = hidden_states
@@ -154,7 +215,6 @@ class IPAttnProcessor(nn.Module):
                     encoder_hidden_states[:, :end_pos, :],
                     encoder_hidden_states[:, end_pos:, :],
                 )
-                scale = self.scale
                 txt_scale = 1
             if attn.norm_cross:
                 encoder_hidden_states = attn.norm_encoder_hidden_states(encoder_hidden_states)
@@ -170,19 +230,22 @@ class IPAttnProcessor(nn.Module):
         hidden_states = torch.bmm(attention_probs, value)
         hidden_states = attn.batch_to_head_dim(hidden_states)
 
-        # for ip-adapter
-        ip_key = self.to_k_ip(ip_hidden_states)
-        ip_value = self.to_v_ip(ip_hidden_states)
+        # for ip-adapter; text-only contexts and a zero scale skip the image branch entirely
+        if torch.is_tensor(scale) or scale != 0:
+            ip_key, ip_value = self.project_ip(ip_hidden_states)
 
-        ip_key = attn.head_to_batch_dim(ip_key)
-        ip_value = attn.head_to_batch_dim(ip_value)
+            ip_key = attn.head_to_batch_dim(ip_key)
+            ip_value = attn.head_to_batch_dim(ip_value)
 
-        ip_attention_probs = attn.get_attention_scores(query, ip_key, None)
-        self.attn_map = ip_attention_probs
-        ip_hidden_states = torch.bmm(ip_attention_probs, ip_value)
-        ip_hidden_states = attn.batch_to_head_dim(ip_hidden_states)
+            ip_attention_probs = attn.get_attention_scores(query, ip_key, None)
+            if self.record_attn_map:
+                self.store_attn_map(ip_attention_probs.view(batch_size, attn.heads, *ip_attention_probs.shape[1:]))
+            ip_hidden_states = torch.bmm(ip_attention_probs, ip_value)
+            ip_hidden_states = attn.batch_to_head_dim(ip_hidden_states)
 
-        hidden_states = txt_scale * hidden_states + scale * ip_hidden_states
+            hidden_states = txt_scale * hidden_states + scale * ip_hidden_states
+        else:
+            hidden_states = txt_scale * hidden_states
 
         # linear proj
         hidden_states = attn.to_out[0](hidden_states)
@@ -221,6 +284,7 @@ class AttnProcessor2_0(torch.nn.Module):
         encoder_hidden_states=None,
         attention_mask=None,
         temb=None,
+        ip_scale=None,
         *args,
         **kwargs,
     ):
@@ -315,6 +379,11 @@ class IPAttnProcessor2_0(torch.nn.Module):
         self.cross_attention_dim = cross_attention_dim
         self.scale = scale
         self.num_tokens = num_tokens
+        # attention-map recording, switched on per call by utils.register_cross_attention_hook
+        self.record_attn_map = False
+        self.attn_map_size = 16
+        self.attn_map_aspect = 1.0
+        self.attn_map = None
 
         self.to_k_ip = nn.Linear(cross_attention_dim or hidden_size, hidden_size, bias=False)
         self.to_v_ip = nn.Linear(cross_attention_dim or hidden_size, hidden_size, bias=False)
@@ -326,6 +395,7 @@ class IPAttnProcessor2_0(torch.nn.Module):
         encoder_hidden_states=None,
         attention_mask=None,
         temb=None,
+        ip_scale=None,
         *args,
         **kwargs,
     ):
@@ -399,14 +469,144 @@ class IPAttnProcessor2_0(torch.nn.Module):
         ip_hidden_states = F.scaled_dot_product_attention(
             query, ip_key, ip_value, attn_mask=None, dropout_p=0.0, is_causal=False
         )
-        with torch.no_grad():
-            self.attn_map = query @ ip_key.transpose(-2, -1).softmax(dim=-1)
-            #print(self.attn_map.shape)
+        if self.record_attn_map:
+            with torch.no_grad():
+                attn_probs = (query @ ip_key.transpose(-2, -1) * attn.scale).softmax(dim=-1)
+                attn_map = downsample_attn_map(attn_probs.mean(dim=1), self.attn_map_size, self.attn_map_aspect)
+                self.attn_map = attn_map.to("cpu", torch.float16)
 
         ip_hidden_states = ip_hidden_states.transpose(1, 2).reshape(batch_size, -1, attn.heads * head_dim)
         ip_hidden_states = ip_hidden_states.to(query.dtype)
 
-        hidden_states = hidden_states + self.scale * ip_hidden_states
+        hidden_states = hidden_states + (self.scale if ip_scale is None else ip_scale) * ip_hidden_states
+
+        # linear proj
+        hidden_states = attn.to_out[0](hidden_states)
+        # dropout
+        hidden_states = attn.to_out[1](hidden_states)
+
+        if input_ndim == 4:
+            hidden_states = hidden_states.transpose(-1, -2).reshape(batch_size, channel, height, width)
+
+        if attn.residual_connection:
+            hidden_states = hidden_states + residual
+
+        hidden_states = hidden_states / attn.rescale_output_factor
+
+        return hidden_states
+
+
+class StoryAttnProcessor2_0(IPAttnProcessor):
+    r"""
+    Multi-reference Story-Iter attention processor for PyTorch 2.0.
+
+    Same arguments, weights and semantics as `IPAttnProcessor` (the first 77 context tokens are text,
+    everything after them is `num_tokens` image tokens per reference; a text-only context runs with
+    an image scale of 0), but both the text and the image branch use the fused
+    `F.scaled_dot_product_attention` kernel instead of materializing attention-probability matrices.
+    """
+
+    def __init__(self, hidden_size, cross_attention_dim=None, num_ref=0, scale=1.0, num_tokens=4,
+                 cache_ip_projection=True):
+        super().__init__(hidden_size, cross_attention_dim, num_ref, scale, num_tokens, cache_ip_projection)
+
+        if not hasattr(F, "scaled_dot_product_attention"):
+            raise ImportError("AttnProcessor2_0 requires PyTorch 2.0, to use it, please upgrade PyTorch to 2.0.")
+
+    def __call__(
+        self,
+        attn,
+        hidden_states,
+        encoder_hidden_states=None,
+        attention_mask=None,
+        temb=None,
+        ip_scale=None,
+        *args,
+        **kwargs,
+    ):
+        residual = hidden_states
+
+        if attn.spatial_norm is not None:
+            hidden_states = attn.spatial_norm(hidden_states, temb)
+
+        input_ndim = hidden_states.ndim
+
+        if input_ndim == 4:
+            batch_size, channel, height, width = hidden_states.shape
+            hidden_states = hidden_states.view(batch_size, channel, height * width).transpose(1, 2)
+
+        batch_size, sequence_length, _ = (
+            hidden_states.shape if encoder_hidden_states is None else encoder_hidden_states.shape
+        )
+
+        if attention_mask is not None:
+            attention_mask = attn.prepare_attention_mask(attention_mask, sequence_length, batch_size)
+            # scaled_dot_product_attention expects attention_mask shape to be
+            # (batch, heads, source_length, target_length)
+            attention_mask = attention_mask.view(batch_size, attn.heads, -1, attention_mask.shape[-1])
+
+        if attn.group_norm is not None:
+            hidden_states = attn.group_norm(hidden_states.transpose(1, 2)).transpose(1, 2)
+
+        query = attn.to_q(hidden_states)
+
+        scale = self.resolve_scale(ip_scale, batch_size, hidden_states)
+        if encoder_hidden_states is None:
+            encoder_hidden_states = hidden_states
+            ip_hidden_states = encoder_hidden_states
+            scale = 0
+        else:
+            # get encoder_hidden_states, ip_hidden_states
+            end_pos = 77
+            if encoder_hidden_states.shape[1] == end_pos:
+                ip_hidden_states = encoder_hidden_states
+                scale = 0
+            else:
+                encoder_hidden_states, ip_hidden_states = (
+                    encoder_hidden_states[:, :end_pos, :],
+                    encoder_hidden_states[:, end_pos:, :],
+                )
+            if attn.norm_cross:
+                encoder_hidden_states = attn.norm_encoder_hidden_states(encoder_hidden_states)
+
+        key = attn.to_k(encoder_hidden_states)
+        value = attn.to_v(encoder_hidden_states)
+
+        inner_dim = key.shape[-1]
+        head_dim = inner_dim // attn.heads
+
+        query = query.view(batch_size, -1, attn.heads, head_dim).transpose(1, 2)
+
+        key = key.view(batch_size, -1, attn.heads, head_dim).transpose(1, 2)
+        value = value.view(batch_size, -1, attn.heads, head_dim).transpose(1, 2)
+
+        # the output of sdp = (batch, num_heads, seq_len, head_dim)
+        hidden_states = F.scaled_dot_product_attention(
+            query, key, value, attn_mask=attention_mask, dropout_p=0.0, is_causal=False
+        )
+
+        hidden_states = hidden_states.transpose(1, 2).reshape(batch_size, -1, attn.heads * head_dim)
+        hidden_states = hidden_states.to(query.dtype)
+
+        # for ip-adapter; text-only contexts and a zero scale skip the image branch entirely
+        if torch.is_tensor(scale) or scale != 0:
+            ip_key, ip_value = self.project_ip(ip_hidden_states)
+
+            ip_key = ip_key.view(batch_size, -1, attn.heads, head_dim).transpose(1, 2)
+            ip_value = ip_value.view(batch_size, -1, attn.heads, head_dim).transpose(1, 2)
+
+            ip_hidden_states = F.scaled_dot_product_attention(
+                query, ip_key, ip_value, attn_mask=None, dropout_p=0.0, is_causal=False
+            )
+            if self.record_attn_map:
+                # SDPA never materializes the probabilities, so recompute them only while recording
+                with torch.no_grad():
+                    self.store_attn_map((query @ ip_key.transpose(-2, -1) * attn.scale).softmax(dim=-1))
+
+            ip_hidden_states = ip_hidden_states.transpose(1, 2).reshape(batch_size, -1, attn.heads * head_dim)
+            ip_hidden_states = ip_hidden_states.to(query.dtype)
+
+            hidden_states = hidden_states + scale * ip_hidden_states
 
         # linear proj
         hidden_states = attn.to_out[0](hidden_states)
@@ -433,7 +633,8 @@ class CNAttnProcessor:
     def __init__(self, num_tokens=4):
         self.num_tokens = num_tokens
 
-    def __call__(self, attn, hidden_states, encoder_hidden_states=None, attention_mask=None, temb=None, *args, **kwargs,):
+    def __call__(self, attn, hidden_states, encoder_hidden_states=None, attention_mask=None, temb=None, ip_scale=None,
+                 *args, **kwargs,):
         residual = hidden_states
 
         if attn.spatial_norm is not None:
@@ -507,6 +708,7 @@ class CNAttnProcessor2_0:
         encoder_hidden_states=None,
         attention_mask=None,
         temb=None,
+        ip_scale=None,
         *args,
         **kwargs,
     ):
@@ -578,3 +780,26 @@ class CNAttnProcessor2_0:
         hidden_states = hidden_states / attn.rescale_output_factor
 
         return hidden_states
+
+
+def set_story_attn_processors(unet, num_ref=0, scale=1.0, num_tokens=4):
+    """
+    Put `StoryAttnProcessor2_0` on every cross-attention layer of `unet` and `AttnProcessor2_0` on the
+    self-attention ones; the layout `IPAdapter.set_ip_adapter` builds, for UNets without a checkpoint
+    (tests and CPU benchmarks on reduced SDXL-shaped UNets with random weights).
+    """
+    processors = {}
+    for name in unet.attn_processors.keys():
+        if name.endswith("attn1.processor"):
+            processors[name] = AttnProcessor2_0()
+            continue
+        if name.startswith("mid_block"):
+            hidden_size = unet.config.block_out_channels[-1]
+        elif name.startswith("up_blocks"):
+            hidden_size = list(reversed(unet.config.block_out_channels))[int(name[len("up_blocks.")])]
+        else:
+            hidden_size = unet.config.block_out_channels[int(name[len("down_blocks.")])]
+        processors[name] = StoryAttnProcessor2_0(hidden_size, unet.config.cross_attention_dim, num_ref=num_ref,
+                                                 scale=scale, num_tokens=num_tokens)
+    unet.set_attn_processor(processors)
+    return unet
@@ -5,6 +5,8 @@ import torch.nn.functional as F
 
 from diffusers.models.lora import LoRALinearLayer
 
+from .utils import downsample_attn_map
+
 
 class LoRAAttnProcessor(nn.Module):
     r"""
@@ -192,7 +194,10 @@ class LoRAIPAttnProcessor(nn.Module):
         ip_value = attn.head_to_batch_dim(ip_value)
 
         ip_attention_probs = attn.get_attention_scores(query, ip_key, None)
-        self.attn_map = ip_attention_probs
+        if getattr(self, "record_attn_map", False):
+            attn_map = ip_attention_probs.view(batch_size, attn.heads, *ip_attention_probs.shape[1:]).mean(dim=1)
+            attn_map = downsample_attn_map(attn_map, getattr(self, "attn_map_size", 16), getattr(self, "attn_map_aspect", 1.0))
+            self.attn_map = attn_map.to("cpu", torch.float16)
         ip_hidden_states = torch.bmm(ip_attention_probs, ip_value)
         ip_hidden_states = attn.batch_to_head_dim(ip_hidden_states)
 
@@ -5,10 +5,11 @@ from diffusers import StableDiffusionXLPipeline
 from diffusers.pipelines.stable_diffusion_xl import StableDiffusionXLPipelineOutput
 from diffusers.pipelines.stable_diffusion_xl.pipeline_stable_diffusion_xl import rescale_noise_cfg
 
+from .feature_cache import UNetFeatureCache
 from .utils import is_torch2_available
 
 if is_torch2_available():
-    from .attention_processor import IPAttnProcessor2_0 as IPAttnProcessor
+    from .attention_processor import StoryAttnProcessor2_0 as IPAttnProcessor
 else:
     from .attention_processor import IPAttnProcessor
 
@@ -53,6 +54,11 @@ class StableDiffusionXLCustomPipeline(StableDiffusionXLPipeline):
         negative_target_size: Optional[Tuple[int, int]] = None,
         control_guidance_start: float = 0.0,
         control_guidance_end: float = 1.0,
+        cfg_cutoff: Optional[float] = None,
+        cache_interval: Optional[int] = None,
+        cache_depth: int = 1,
+        callback_on_step_end: Optional[Callable[[Any, int, int, Dict], Dict]] = None,
+        callback_on_step_end_tensor_inputs: List[str] = ["latents"],
     ):
         r"""
         Function invoked when calling the pipeline for generation.
@@ -177,6 +183,22 @@ class StableDiffusionXLCustomPipeline(StableDiffusionXLPipeline):
                 The percentage of total steps at which the ControlNet starts applying.
             control_guidance_end (`float`, *optional*, defaults to 1.0):
                 The percentage of total steps at which the ControlNet stops applying.
+            cfg_cutoff (`float`, *optional*):
+                The percentage of total steps after which classifier-free guidance is dropped: the remaining steps
+                run only the conditional branch, at half the UNet batch. `None` keeps guidance for every step.
+            cache_interval (`int`, *optional*):
+                Run the full UNet only every `cache_interval` steps and reuse its deep features in between, updating
+                only the `cache_depth` shallowest down / up blocks (see `UNetFeatureCache`). `None` runs the full UNet
+                at every step.
+            cache_depth (`int`, *optional*, defaults to 1):
+                The number of shallow UNet block levels recomputed on the cached steps.
+            callback_on_step_end (`Callable`, *optional*):
+                A function called at the end of each denoising step as `callback_on_step_end(self, step, timestep,
+                callback_kwargs)`, as in [`StableDiffusionXLPipeline`]; it may replace the tensors it was given and
+                set `self._interrupt` to skip the remaining steps.
+            callback_on_step_end_tensor_inputs (`List`, *optional*):
+                The tensors passed in `callback_kwargs`, from `latents`, `prompt_embeds`, `add_text_embeds` and
+                `add_time_ids`.
 
         Examples:
 
@@ -205,7 +227,14 @@ class StableDiffusionXLCustomPipeline(StableDiffusionXLPipeline):
             negative_prompt_embeds,
             pooled_prompt_embeds,
             negative_pooled_prompt_embeds,
+            callback_on_step_end_tensor_inputs=callback_on_step_end_tensor_inputs,
         )
+        unsupported = set(callback_on_step_end_tensor_inputs) - {"latents", "prompt_embeds", "add_text_embeds", "add_time_ids"}
+        if unsupported:
+            raise ValueError(f"callback_on_step_end_tensor_inputs {sorted(unsupported)} are not available in this pipeline")
+
+        self._guidance_scale = guidance_scale
+        self._interrupt = False
 
         # 2. Define call parameters
         if prompt is not None and isinstance(prompt, str):
@@ -315,18 +344,35 @@ class StableDiffusionXLCustomPipeline(StableDiffusionXLPipeline):
             num_inference_steps = len(list(filter(lambda ts: ts >= discrete_timestep_cutoff, timesteps)))
             timesteps = timesteps[:num_inference_steps]
 
-        # get init conditioning scale
-        for attn_processor in self.unet.attn_processors.values():
-            if isinstance(attn_processor, IPAttnProcessor):
-                conditioning_scale = attn_processor.scale
-                break
+        # get init conditioning scale: the per-call `ip_scale`, else the processors' default
+        cross_attention_kwargs = dict(cross_attention_kwargs or {})
+        conditioning_scale = cross_attention_kwargs.get("ip_scale")
+        if conditioning_scale is None:
+            for attn_processor in self.unet.attn_processors.values():
+                if isinstance(attn_processor, IPAttnProcessor):
+                    conditioning_scale = attn_processor.scale
+                    break
+
+        feature_cache = UNetFeatureCache(self.unet, cache_interval, cache_depth) if cache_interval else None
+        self._num_timesteps = len(timesteps)
 
         with self.progress_bar(total=num_inference_steps) as progress_bar:
             for i, t in enumerate(timesteps):
+                if self.interrupt:
+                    continue
+
+                # late steps barely change with guidance: keep only the conditional half of the batch from here on
+                if do_classifier_free_guidance and cfg_cutoff is not None and i >= cfg_cutoff * len(timesteps):
+                    do_classifier_free_guidance = False
+                    prompt_embeds = prompt_embeds.chunk(2)[1]
+                    add_text_embeds = add_text_embeds.chunk(2)[1]
+                    add_time_ids = add_time_ids.chunk(2)[1]
+
+                # image-prompt guidance window, passed per call so the shared processors are never mutated
                 if (i / len(timesteps) < control_guidance_start) or ((i + 1) / len(timesteps) > control_guidance_end):
-                    self.set_scale(0.0)
+                    cross_attention_kwargs["ip_scale"] = 0.0
                 else:
-                    self.set_scale(conditioning_scale)
+                    cross_attention_kwargs["ip_scale"] = conditioning_scale
 
                 # expand the latents if we are doing classifier free guidance
                 latent_model_input = torch.cat([latents] * 2) if do_classifier_free_guidance else latents
@@ -335,14 +381,23 @@ class StableDiffusionXLCustomPipeline(StableDiffusionXLPipeline):
 
                 # predict the noise residual
                 added_cond_kwargs = {"text_embeds": add_text_embeds, "time_ids": add_time_ids}
-                noise_pred = self.unet(
-                    latent_model_input,
-                    t,
-                    encoder_hidden_states=prompt_embeds,
-                    cross_attention_kwargs=cross_attention_kwargs,
-                    added_cond_kwargs=added_cond_kwargs,
-                    return_dict=False,
-                )[0]
+                if feature_cache is not None:
+                    noise_pred = feature_cache(
+                        latent_model_input,
+                        t,
+                        encoder_hidden_states=prompt_embeds,
+                        added_cond_kwargs=added_cond_kwargs,
+                        cross_attention_kwargs=cross_attention_kwargs,
+                    )
+                else:
+                    noise_pred = self.unet(
+                        latent_model_input,
+                        t,
+                        encoder_hidden_states=prompt_embeds,
+                        cross_attention_kwargs=cross_attention_kwargs,
+                        added_cond_kwargs=added_cond_kwargs,
+                        return_dict=False,
+                    )[0]
 
                 # perform guidance
                 if do_classifier_free_guidance:
@@ -356,6 +411,19 @@ class StableDiffusionXLCustomPipeline(StableDiffusionXLPipeline):
                 # compute the previous noisy sample x_t -> x_t-1
                 latents = self.scheduler.step(noise_pred, t, latents, **extra_step_kwargs, return_dict=False)[0]
 
+                if callback_on_step_end is not None:
+                    callback_kwargs = {}
+                    for k in callback_on_step_end_tensor_inputs:
+                        callback_kwargs[k] = locals()[k]
+                    callback_outputs = callback_on_step_end(self, i, t, callback_kwargs)
+                    latents = callback_outputs.pop("latents", latents)
+                    prompt_embeds = callback_outputs.pop("prompt_embeds", prompt_embeds)
+                    add_text_embeds = callback_outputs.pop("add_text_embeds", add_text_embeds)
+                    add_time_ids = callback_outputs.pop("add_time_ids", add_time_ids)
+                    # a callback that turned guidance off has already dropped the unconditional half of the inputs
+                    guidance_scale = self._guidance_scale
+                    do_classifier_free_guidance = do_classifier_free_guidance and guidance_scale > 1.0
+
                 # call the callback, if provided
                 if i == len(timesteps) - 1 or ((i + 1) > num_warmup_steps and (i + 1) % self.scheduler.order == 0):
                     progress_bar.update()
@@ -0,0 +1,114 @@
+"""
+Cross-step reuse of deep UNet features (DeepCache, https://arxiv.org/abs/2312.00858).
+
+Adjacent denoising steps produce nearly the same high-level features, so `UNetFeatureCache` runs the
+full UNet only every `interval` steps and remembers the hidden states entering its `depth` shallowest
+up blocks. The steps in between run just `conv_in`, the `depth` shallowest down blocks (for fresh skip
+connections), those up blocks on the cached features and the output head; everything deeper, including
+the mid block, is skipped.
+
+The blocks that do run get the same `encoder_hidden_states` and `cross_attention_kwargs` as a full
+forward, so the IP attention processors see their image tokens and per-call `ip_scale` either way.
+A change of batch size (e.g. a CFG cutoff dropping the unconditional half) or of `ip_scale` forces a
+full step, since the cached features no longer match the call.
+"""
+import torch
+
+
+def _scale_key(scale):
+    # per-sample scales come as tensors, which can't be compared with `!=` inside a tuple
+    return tuple(scale.flatten().tolist()) if torch.is_tensor(scale) else scale
+
+
+class UNetFeatureCache:
+    """Drop-in for `unet(...)[0]` inside one denoising loop; create a new one per generation."""
+
+    def __init__(self, unet, interval=3, depth=1):
+        if interval < 1:
+            raise ValueError(f"cache interval must be positive, got {interval}")
+        if not 1 <= depth < len(unet.up_blocks):
+            raise ValueError(f"cache depth must be in [1, {len(unet.up_blocks) - 1}], got {depth}")
+        self.unet = unet
+        self.interval = interval
+        self.depth = depth
+        self.full_steps = 0
+        self.cached_steps = 0
+        self._features = None
+        self._key = None
+        self._age = 0
+
+    def __call__(self, sample, timestep, encoder_hidden_states, added_cond_kwargs, cross_attention_kwargs=None):
+        key = (tuple(sample.shape), _scale_key((cross_attention_kwargs or {}).get("ip_scale")))
+        if self._features is None or key != self._key or self._age >= self.interval - 1:
+            self._key, self._age = key, 0
+            self.full_steps += 1
+            return self._full_step(sample, timestep, encoder_hidden_states, added_cond_kwargs, cross_attention_kwargs)
+        self._age += 1
+        self.cached_steps += 1
+        return self._cached_step(sample, timestep, encoder_hidden_states, added_cond_kwargs, cross_attention_kwargs)
+
+    def _capture(self, module, args, kwargs):
+        self._features = kwargs["hidden_states"]
+
+    def _full_step(self, sample, timestep, encoder_hidden_states, added_cond_kwargs, cross_attention_kwargs):
+        handle = self.unet.up_blocks[-self.depth].register_forward_pre_hook(self._capture, with_kwargs=True)
+        try:
+            return self.unet(
+                sample,
+                timestep,
+                encoder_hidden_states=encoder_hidden_states,
+                cross_attention_kwargs=cross_attention_kwargs,
+                added_cond_kwargs=added_cond_kwargs,
+                return_dict=False,
+            )[0]
+        finally:
+            handle.remove()
+
+    def _cached_step(self, sample, timestep, encoder_hidden_states, added_cond_kwargs, cross_attention_kwargs):
+        # the shallow half of UNet2DConditionModel.forward (SDXL: no class labels, ControlNet or adapters)
+        unet = self.unet
+        forward_upsample_size = any(s % 2**unet.num_upsamplers for s in sample.shape[-2:])
+
+        emb = unet.time_embedding(unet.get_time_embed(sample=sample, timestep=timestep), None)
+        aug_emb = unet.get_aug_embed(
+            emb=emb, encoder_hidden_states=encoder_hidden_states, added_cond_kwargs=added_cond_kwargs
+        )
+        emb = emb + aug_emb if aug_emb is not None else emb
+        if unet.time_embed_act is not None:
+            emb = unet.time_embed_act(emb)
+        encoder_hidden_states = unet.process_encoder_hidden_states(
+            encoder_hidden_states=encoder_hidden_states, added_cond_kwargs=added_cond_kwargs
+        )
+        attention_kwargs = dict(
+            encoder_hidden_states=encoder_hidden_states, cross_attention_kwargs=cross_attention_kwargs
+        )
+
+        hidden_states = unet.conv_in(sample)
+        res_samples = (hidden_states,)
+        for block in unet.down_blocks[: self.depth]:
+            extra = attention_kwargs if getattr(block, "has_cross_attention", False) else {}
+            hidden_states, block_res_samples = block(hidden_states=hidden_states, temb=emb, **extra)
+            res_samples += block_res_samples
+
+        up_blocks = unet.up_blocks[-self.depth:]
+        # the deepest fresh skip connection feeds a cached up block, not one of ours
+        res_samples = res_samples[: sum(len(block.resnets) for block in up_blocks)]
+        hidden_states = self._features
+        upsample_size = None
+        for i, block in enumerate(up_blocks):
+            block_res_samples = res_samples[-len(block.resnets):]
+            res_samples = res_samples[: -len(block.resnets)]
+            if i < len(up_blocks) - 1 and forward_upsample_size:
+                upsample_size = res_samples[-1].shape[2:]
+            extra = attention_kwargs if getattr(block, "has_cross_attention", False) else {}
+            hidden_states = block(
+                hidden_states=hidden_states,
+                temb=emb,
+                res_hidden_states_tuple=block_res_samples,
+                upsample_size=upsample_size,
+                **extra,
+            )
+
+        if unet.conv_norm_out:
+            hidden_states = unet.conv_act(unet.conv_norm_out(hidden_states))
+        return unet.conv_out(hidden_states)
@@ -1,14 +1,19 @@
+import inspect
 import os
-from typing import List
+import threading
+from collections import OrderedDict
+from typing import List, NamedTuple
 
 import torch
-from diffusers import StableDiffusionPipeline
+from diffusers import StableDiffusionPipeline, StableDiffusionXLImg2ImgPipeline
 # from diffusers.pipelines.controlnet import MultiControlNetModel
 from PIL import Image
 from safetensors import safe_open
 from transformers import CLIPImageProcessor, CLIPVisionModelWithProjection
 from sd_embed.embedding_funcs import get_weighted_text_embeddings_sdxl
-from .utils import is_torch2_available, get_generator
+from .utils import is_torch2_available, get_generator, PredictedX0Recorder
+from .preview_decoder import decode_preview
+from .story_iter import SCHEDULERS
 
 if is_torch2_available():
     from .attention_processor import (
@@ -18,7 +23,7 @@ if is_torch2_available():
         CNAttnProcessor2_0 as CNAttnProcessor,
     )
     from .attention_processor import (
-        IPAttnProcessor as IPAttnProcessor,
+        StoryAttnProcessor2_0 as IPAttnProcessor,
     )
 else:
     from .attention_processor import AttnProcessor, CNAttnProcessor, IPAttnProcessor
@@ -63,6 +68,73 @@ class MLPProjModel(torch.nn.Module):
         return clip_extra_context_tokens
 
 
+class ReferenceEmbeds(NamedTuple):
+    """Image-prompt tokens for a reference set, encoded once and shared by every frame of a pass."""
+
+    image_prompt_embeds: torch.Tensor
+    uncond_image_prompt_embeds: torch.Tensor
+    clip_image_embeds: torch.Tensor
+    num_ref: int
+
+    def select(self, indices):
+        """The reference set restricted to the references at `indices`, in that order."""
+        tokens = self.image_prompt_embeds.shape[1] // self.num_ref
+        index = torch.as_tensor(list(indices), device=self.clip_image_embeds.device)
+
+        def pick(embeds):
+            return embeds.view(self.num_ref, tokens, -1)[index].reshape(1, len(index) * tokens, -1)
+
+        return ReferenceEmbeds(
+            image_prompt_embeds=pick(self.image_prompt_embeds),
+            uncond_image_prompt_embeds=pick(self.uncond_image_prompt_embeds),
+            clip_image_embeds=self.clip_image_embeds[index],
+            num_ref=len(index),
+        )
+
+
+class PromptEmbedsCache:
+    """
+    Bounded LRU cache of SDXL text-encoder outputs.
+
+    Entries are keyed by (text, device, dtype) and hold `(prompt_embeds, pooled_prompt_embeds)`
+    for a single prompt. Positive and negative prompts are looked up independently, so the
+    constant negative prompts are shared by every frame, pass and request.
+    """
+
+    def __init__(self, max_size=256):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        return {"size": len(self._entries), "max_size": self.max_size, "hits": self.hits, "misses": self.misses}
+
+
 class IPAdapter:
     def __init__(self, sd_pipe, image_encoder_path, ip_ckpt, device, num_tokens=4):
         self.device = device
@@ -159,15 +231,34 @@ class IPAdapter:
         return image_prompt_embeds, uncond_image_prompt_embeds
 
     def set_scale(self, scale):
+        """Set the default image-prompt scale of every processor (calls that pass `ip_scale` override it)."""
         for attn_processor in self.pipe.unet.attn_processors.values():
             if isinstance(attn_processor, IPAttnProcessor):
                 attn_processor.scale = scale
 
+    def ip_attention_kwargs(self, scale, cross_attention_kwargs=None):
+        """
+        The caller's `cross_attention_kwargs` plus the image-prompt scale for this call, so generating
+        never mutates the shared attention processors. `scale` is a float for the whole batch, or a
+        list with one scale per prompt.
+        """
+        cross_attention_kwargs = dict(cross_attention_kwargs or {})
+        if isinstance(scale, (list, tuple)):
+            scale = torch.tensor(scale, dtype=torch.float32, device=self.device)
+        cross_attention_kwargs["ip_scale"] = scale
+        return cross_attention_kwargs
+
     def set_num_ref(self, num_ref):
         for attn_processor in self.pipe.unet.attn_processors.values():
             if isinstance(attn_processor, IPAttnProcessor):
                 attn_processor.num_ref = num_ref
 
+    def clear_ip_cache(self):
+        """Release the image-token projections the attention processors kept for the last generation."""
+        for attn_processor in self.pipe.unet.attn_processors.values():
+            if isinstance(attn_processor, IPAttnProcessor):
+                attn_processor.clear_ip_cache()
+
     def generate(
         self,
         pil_image=None,
@@ -183,7 +274,7 @@ class IPAdapter:
         style='cartoon',
         **kwargs,
     ):
-        self.set_scale(scale)
+        cross_attention_kwargs = self.ip_attention_kwargs(scale, kwargs.pop("cross_attention_kwargs", None))
 
         if use_image:
             if pil_image is not None:
@@ -244,6 +335,7 @@ class IPAdapter:
             guidance_scale=guidance_scale,
             num_inference_steps=num_inference_steps,
             generator=generator,
+            cross_attention_kwargs=cross_attention_kwargs,
             **kwargs,
         ).images
 
@@ -252,33 +344,72 @@ class IPAdapter:
 class StoryAdapterXL(IPAdapter):
     """SDXL"""
 
-    def generate(
-        self,
-        pil_image=None,
-        clip_image_embeds=None,
-        prompt=None,
-        negative_prompt=None,
-        scale=1.0,
-        num_samples=4,
-        seed=None,
-        guidance_scale=7.5,
-        num_inference_steps=30,
-        use_image=True,
-        style="comic",
-        **kwargs,
-    ):
-        self.set_scale(scale)
-        
-        if use_image:
-            if pil_image is not None:
-                self.set_num_ref(len(pil_image))
-                print("len", len(pil_image))
-                num_prompts = 1
-            else:
-                num_prompts = clip_image_embeds.size(0)
-        else:
-            num_prompts = 1
+    # rough peak activation memory of one CFG sample (UNet + fp32 VAE decode) at 1024x1024
+    sample_memory_gb = 3.0
+
+    def __init__(self, sd_pipe, image_encoder_path, ip_ckpt, device, num_tokens=4, prompt_cache_size=256):
+        super().__init__(sd_pipe, image_encoder_path, ip_ckpt, device, num_tokens=num_tokens)
+        self.prompt_cache = PromptEmbedsCache(max_size=prompt_cache_size)
+        self._scheduler_config = self.pipe.scheduler.config
+        self._schedulers = {}
+        self._img2img_pipe = None
+
+    def scheduler_for(self, name):
+        """The pipeline's noise scheduler re-created as `SCHEDULERS[name]` (see `story_iter.py`), cached per name."""
+        if name not in self._schedulers:
+            self._schedulers[name] = SCHEDULERS[name].from_config(self._scheduler_config)
+        return self._schedulers[name]
+
+    def _step_end_callback(self, recorder=None, stop_after=None, on_progress=None, progress_every=5,
+                           progress_decoder="latent_rgb", preview_size=256, offset=0, cfg_cutoff=None):
+        """
+        `callback_on_step_end` that hands x0 previews of the chunk to `on_progress(step_index, indices, images)`
+        every `progress_every` steps, skips every denoising step after the first `stop_after`, and drops the
+        unconditional branch for the steps past `cfg_cutoff` (a fraction of the schedule).
+        """
+
+        def callback(pipe, step_index, timestep, callback_kwargs):
+            if (cfg_cutoff is not None and pipe.do_classifier_free_guidance
+                    and step_index + 1 >= cfg_cutoff * pipe.num_timesteps):
+                # guidance 0 turns CFG off for the next steps; keep the conditional half of the batch inputs
+                pipe._guidance_scale = 0.0
+                for name in ("prompt_embeds", "add_text_embeds", "add_time_ids"):
+                    callback_kwargs[name] = callback_kwargs[name].chunk(2)[1]
+            if on_progress is not None and (step_index + 1) % progress_every == 0:
+                previews = decode_preview(self.pipe, recorder.pred_original_sample, preview_size, progress_decoder)
+                on_progress(step_index, list(range(offset, offset + len(previews))), previews)
+            if stop_after is not None and step_index + 1 >= stop_after:
+                pipe._interrupt = True
+            return callback_kwargs
+
+        return callback
+
+    def img2img_pipe(self):
+        """Image-to-image view of `self.pipe` (same modules, so the same attention processors), built on first use."""
+        if self._img2img_pipe is None:
+            self._img2img_pipe = StableDiffusionXLImg2ImgPipeline(**self.pipe.components)
+            self._img2img_pipe.set_progress_bar_config(**getattr(self.pipe, "_progress_bar_config", {}))
+        self._img2img_pipe.scheduler = self.pipe.scheduler
+        return self._img2img_pipe
+
+    @torch.inference_mode()
+    def encode_text(self, text):
+        """Return `(prompt_embeds, pooled_prompt_embeds)` for one prompt, served from the LRU cache when possible."""
+        key = (text, str(self.device), self.pipe.text_encoder_2.dtype)
+        entry = self.prompt_cache.get(key)
+        if entry is None:
+            prompt_embeds, _, pooled_prompt_embeds, _ = self.pipe.encode_prompt(
+                text,
+                device=self.device,
+                num_images_per_prompt=1,
+                do_classifier_free_guidance=False,
+            )
+            entry = (prompt_embeds, pooled_prompt_embeds)
+            self.prompt_cache.put(key, entry)
+        return entry
 
+    def style_prompt(self, prompt, style, negative_prompt=None):
+        """Wrap a frame prompt in the style template and pick the matching negative prompt."""
         if prompt is None:
             prompt = "best quality, high quality"
         # prompt有添加内容
@@ -302,15 +433,263 @@ class StoryAdapterXL(IPAdapter):
             # negative_prompt = "anime, cartoon, graphic, text, painting, crayon, graphite, abstract, glitch, deformed, mutated, ugly, disfigured"  # film style
             # negative_prompt = "bad anatomy, bad hands, missing fingers, extra fingers, three hands, three legs, bad arms, missing legs, missing arms, poorly drawn face, bad face, fused face, cloned face, three crus, fused feet, fused thigh, extra crus, ugly fingers, horn, cartoon, cg, 3d, unreal, animate, amputation, disconnected limbs"
 
+        return prompt, negative_prompt
+
+    def encode_prompt_cached(self, prompt, negative_prompt, num_samples=1):
+        """Drop-in for `pipe.encode_prompt(..., do_classifier_free_guidance=True)` backed by `encode_text`."""
+        positive = [self.encode_text(text) for text in prompt]
+        negative = [self.encode_text(text) for text in negative_prompt]
+        prompt_embeds = torch.cat([e for e, _ in positive]).repeat_interleave(num_samples, dim=0)
+        pooled_prompt_embeds = torch.cat([p for _, p in positive]).repeat_interleave(num_samples, dim=0)
+        negative_prompt_embeds = torch.cat([e for e, _ in negative]).repeat_interleave(num_samples, dim=0)
+        negative_pooled_prompt_embeds = torch.cat([p for _, p in negative]).repeat_interleave(num_samples, dim=0)
+        return prompt_embeds, negative_prompt_embeds, pooled_prompt_embeds, negative_pooled_prompt_embeds
+
+    @torch.inference_mode()
+    def get_reference_embeds(self, pil_image=None, clip_image_embeds=None):
+        """
+        Encode a reference set (e.g. the previous pass's thumbnails) through CLIP and the
+        image projection once. Pass the result to `generate(reference_embeds=...)` for every
+        frame of a Story-Iter pass instead of re-encoding the same images per frame.
+        """
+        if pil_image is not None:
+            if isinstance(pil_image, Image.Image):
+                pil_image = [pil_image]
+            clip_image = self.clip_image_processor(images=pil_image, return_tensors="pt").pixel_values
+            clip_image_embeds = self.image_encoder(clip_image.to(self.device, dtype=torch.float16)).image_embeds
+        else:
+            clip_image_embeds = clip_image_embeds.to(self.device, dtype=torch.float16)
+        image_prompt_embeds, uncond_image_prompt_embeds = self.get_image_embeds(clip_image_embeds=clip_image_embeds)
+        return ReferenceEmbeds(
+            image_prompt_embeds=image_prompt_embeds,
+            uncond_image_prompt_embeds=uncond_image_prompt_embeds,
+            clip_image_embeds=clip_image_embeds,
+            num_ref=clip_image_embeds.shape[0],
+        )
+
+    def micro_batch_size(self, height=1024, width=1024, max_batch_size=None, memory_budget_gb=None):
+        """Frames denoised together, bounded by `max_batch_size` and an activation-memory budget (None = unbounded)."""
+        batch_size = max_batch_size
+        if memory_budget_gb is not None:
+            per_sample_gb = self.sample_memory_gb * (height * width) / (1024 * 1024)
+            fits = max(1, int(memory_budget_gb // per_sample_gb))
+            batch_size = fits if batch_size is None else min(batch_size, fits)
+        return batch_size
+
+    def generate_batch(
+        self,
+        prompts,
+        reference_embeds=None,
+        negative_prompt=None,
+        scale=1.0,
+        seeds=None,
+        guidance_scale=5.0,
+        num_inference_steps=30,
+        style="comic",
+        height=1024,
+        width=1024,
+        max_batch_size=None,
+        memory_budget_gb=None,
+        scheduler=None,
+        init_images=None,
+        strength=None,
+        preview_steps=None,
+        preview_decoder=None,
+        preview_size=256,
+        on_progress=None,
+        progress_every=5,
+        progress_decoder="latent_rgb",
+        cfg_cutoff=None,
+        **kwargs,
+    ):
+        """
+        Generate one image per prompt in a single batched denoising loop, split into
+        micro-batches that fit `max_batch_size` / `memory_budget_gb`. `scheduler` names a noise
+        scheduler from `SCHEDULERS` to use for this call (None = the pipeline's current one).
+
+        With `strength`, each prompt warm-starts from its entry in `init_images` (e.g. the previous
+        Story-Iter pass's frame, resized to `height` x `width`): the image's latent is noised to
+        `strength` and only the last `strength` fraction of the `num_inference_steps` schedule runs.
+
+        With `preview_decoder` (see `PREVIEW_DECODERS` in `preview_decoder.py`), the result is
+        decoded by that fast decoder into `preview_size` thumbnails instead of by the full VAE at
+        full resolution; intermediate Story-Iter passes only need those. With `preview_steps`,
+        denoising also stops after that many steps and the scheduler's predicted x0 is decoded
+        (by the low-resolution VAE unless `preview_decoder` says otherwise).
+
+        `on_progress(step_index, prompt_indices, images)` receives `preview_size` x0 previews, decoded
+        by `progress_decoder`, every `progress_every` steps (e.g. for live progress images).
+
+        With `cfg_cutoff`, the steps past that fraction of the schedule run only the conditional
+        branch (half the UNet batch); late steps gain little from guidance.
+
+        `reference_embeds`, `scale` and `style` are either shared by every prompt or lists with
+        one entry per prompt, so frames from different Story-Iter passes or requests can share a
+        batch; per-prompt references must all have the same `num_ref` (the image tokens are
+        concatenated to the text context). `seeds` is an int applied to every prompt, or a list
+        with one seed per prompt; each sample gets its own generator, so a frame's output does
+        not depend on how it was batched. Returns a list of PIL images in prompt order.
+        """
+        if isinstance(prompts, str):
+            prompts = [prompts]
+        num_prompts = len(prompts)
+        if num_prompts == 0:
+            return []
+        if seeds is None or isinstance(seeds, int):
+            seeds = [seeds] * num_prompts
+        if not isinstance(reference_embeds, list):  # ReferenceEmbeds is itself a tuple
+            reference_embeds = [reference_embeds] * num_prompts
+        if not isinstance(scale, (list, tuple)):
+            scale = [scale] * num_prompts
+        if isinstance(style, str):
+            style = [style] * num_prompts
+        if strength is not None and (init_images is None or len(init_images) != num_prompts):
+            raise ValueError("a warm start (strength) needs one init image per prompt")
+        if preview_steps is not None and preview_decoder is None:
+            preview_decoder = "vae"
+
+        num_refs = {None if ref is None else ref.num_ref for ref in reference_embeds}
+        if len(num_refs) > 1:
+            raise ValueError(f"all prompts in a batch need the same number of references, got {num_refs}")
+        num_ref = num_refs.pop()
+
+        attention_kwargs = kwargs.pop("cross_attention_kwargs", None)
+        styled = [self.style_prompt(text, s, negative_prompt) for text, s in zip(prompts, style)]
+        batch_size = self.micro_batch_size(height, width, max_batch_size, memory_budget_gb) or num_prompts
+
+        images = []
+        pipe_scheduler = self.pipe.scheduler
+        if scheduler is not None:
+            self.pipe.scheduler = self.scheduler_for(scheduler)
+        try:
+            for start in range(0, num_prompts, batch_size):
+                chunk = slice(start, start + batch_size)
+                chunk_scales = scale[chunk]
+                # a shared scale keeps the scalar fast path in the attention processors
+                cross_attention_kwargs = self.ip_attention_kwargs(
+                    chunk_scales[0] if len(set(chunk_scales)) == 1 else list(chunk_scales), attention_kwargs
+                )
+                with torch.inference_mode():
+                    (
+                        prompt_embeds,
+                        negative_prompt_embeds,
+                        pooled_prompt_embeds,
+                        negative_pooled_prompt_embeds,
+                    ) = self.encode_prompt_cached([p for p, _ in styled[chunk]], [n for _, n in styled[chunk]])
+                    if num_ref is not None:
+                        chunk_refs = reference_embeds[chunk]
+                        n = prompt_embeds.shape[0]
+                        if all(ref is chunk_refs[0] for ref in chunk_refs):
+                            image_prompt_embeds = chunk_refs[0].image_prompt_embeds.expand(n, -1, -1)
+                            uncond_image_prompt_embeds = chunk_refs[0].uncond_image_prompt_embeds.expand(n, -1, -1)
+                        else:
+                            image_prompt_embeds = torch.cat([ref.image_prompt_embeds for ref in chunk_refs])
+                            uncond_image_prompt_embeds = torch.cat([ref.uncond_image_prompt_embeds for ref in chunk_refs])
+                        prompt_embeds = torch.cat([prompt_embeds, image_prompt_embeds], dim=1)
+                        negative_prompt_embeds = torch.cat([negative_prompt_embeds, uncond_image_prompt_embeds], dim=1)
+
+                chunk_seeds = seeds[chunk]
+                generator = None if None in chunk_seeds else get_generator(chunk_seeds, self.device)
+
+                if strength is None:
+                    pipe, pipe_kwargs = self.pipe, dict(height=height, width=width)
+                else:
+                    pipe = self.img2img_pipe()
+                    pipe_kwargs = dict(image=[image.resize((width, height)) for image in init_images[chunk]],
+                                       strength=strength)
+                pipe_parameters = inspect.signature(pipe.__call__).parameters
+                recorder = None
+                if preview_steps is not None or on_progress is not None:
+                    if "callback_on_step_end" not in pipe_parameters:
+                        raise ValueError(f"{type(pipe).__name__} has no callback_on_step_end, so it cannot produce "
+                                         "x0 previews or progress images")
+                    recorder = PredictedX0Recorder(pipe.scheduler)
+                    pipe.scheduler = recorder
+                native_cfg_cutoff = "cfg_cutoff" in pipe_parameters
+                if native_cfg_cutoff:
+                    pipe_kwargs["cfg_cutoff"] = cfg_cutoff  # StableDiffusionXLCustomPipeline's own loop
+                if recorder is not None or (cfg_cutoff is not None and not native_cfg_cutoff):
+                    pipe_kwargs["callback_on_step_end"] = self._step_end_callback(
+                        recorder, preview_steps, on_progress, progress_every, progress_decoder, preview_size, start,
+                        cfg_cutoff=None if native_cfg_cutoff else cfg_cutoff,
+                    )
+                    pipe_kwargs["callback_on_step_end_tensor_inputs"] = [
+                        "latents", "prompt_embeds", "add_text_embeds", "add_time_ids"
+                    ]
+                if preview_decoder is not None:
+                    pipe_kwargs["output_type"] = "latent"
+
+                output = pipe(
+                    prompt_embeds=prompt_embeds,
+                    negative_prompt_embeds=negative_prompt_embeds,
+                    pooled_prompt_embeds=pooled_prompt_embeds,
+                    negative_pooled_prompt_embeds=negative_pooled_prompt_embeds,
+                    guidance_scale=guidance_scale,
+                    **pipe_kwargs,
+                    num_inference_steps=num_inference_steps,
+                    generator=generator,
+                    cross_attention_kwargs=cross_attention_kwargs,
+                    **kwargs,
+                ).images
+                if recorder is not None:
+                    pipe.scheduler = recorder.scheduler
+                if preview_decoder is not None:
+                    # an early stop leaves noisy latents behind, so decode the predicted x0 instead
+                    latents = recorder.pred_original_sample if preview_steps is not None else output
+                    output = decode_preview(self.pipe, latents, preview_size, preview_decoder)
+                images += output
+        finally:
+            self.pipe.scheduler = pipe_scheduler
+
+        self.clear_ip_cache()
+        return images
+
+    def generate(
+        self,
+        pil_image=None,
+        clip_image_embeds=None,
+        prompt=None,
+        negative_prompt=None,
+        scale=1.0,
+        num_samples=4,
+        seed=None,
+        guidance_scale=7.5,
+        num_inference_steps=30,
+        use_image=True,
+        style="comic",
+        reference_embeds=None,
+        height=1024,
+        width=1024,
+        **kwargs,
+    ):
+        cross_attention_kwargs = self.ip_attention_kwargs(scale, kwargs.pop("cross_attention_kwargs", None))
+
+        if use_image:
+            if reference_embeds is not None:
+                num_prompts = 1
+            elif pil_image is not None:
+                print("len", len(pil_image))
+                num_prompts = 1
+            else:
+                num_prompts = clip_image_embeds.size(0)
+        else:
+            num_prompts = 1
+
+        prompt, negative_prompt = self.style_prompt(prompt, style, negative_prompt)
+
         if not isinstance(prompt, List):
             prompt = [prompt] * num_prompts
         if not isinstance(negative_prompt, List):
             negative_prompt = [negative_prompt] * num_prompts
 
         if use_image:
-            image_prompt_embeds, uncond_image_prompt_embeds = self.get_image_embeds(
-                pil_image=pil_image, clip_image_embeds=clip_image_embeds
-            )
+            if reference_embeds is not None:
+                image_prompt_embeds = reference_embeds.image_prompt_embeds
+                uncond_image_prompt_embeds = reference_embeds.uncond_image_prompt_embeds
+            else:
+                image_prompt_embeds, uncond_image_prompt_embeds = self.get_image_embeds(
+                    pil_image=pil_image, clip_image_embeds=clip_image_embeds
+                )
             print(f'image_prompt_embeds:{image_prompt_embeds.shape}')
             # 为了得到num_samples张图片
             bs_embed, seq_len, _ = image_prompt_embeds.shape
@@ -353,12 +732,7 @@ class StoryAdapterXL(IPAdapter):
                 negative_prompt_embeds_,
                 pooled_prompt_embeds,
                 negative_pooled_prompt_embeds,
-            ) = self.pipe.encode_prompt(
-                prompt,
-                num_images_per_prompt=num_samples,
-                do_classifier_free_guidance=True,
-                negative_prompt=negative_prompt,
-            )
+            ) = self.encode_prompt_cached(prompt, negative_prompt, num_samples=num_samples)
             print(f'prompt_embeds:{prompt_embeds_.shape}')
             if use_image:
                 prompt_embeds = torch.cat([prompt_embeds_, image_prompt_embeds], dim=1)
@@ -367,20 +741,22 @@ class StoryAdapterXL(IPAdapter):
                 prompt_embeds = prompt_embeds_
                 negative_prompt_embeds = negative_prompt_embeds_
 
-        self.generator = get_generator(seed, self.device)
-        
+        generator = get_generator(seed, self.device)
+
         images = self.pipe(
             prompt_embeds=prompt_embeds,
             negative_prompt_embeds=negative_prompt_embeds,
             pooled_prompt_embeds=pooled_prompt_embeds,
             negative_pooled_prompt_embeds=negative_pooled_prompt_embeds,
-            height=1024,
-            width=1024,
+            height=height,
+            width=width,
             num_inference_steps=num_inference_steps,
-            generator=self.generator,
+            generator=generator,
+            cross_attention_kwargs=cross_attention_kwargs,
             **kwargs,
         ).images
 
+        self.clear_ip_cache()
         return images
 
 
@@ -467,7 +843,7 @@ class IPAdapterPlusXL(IPAdapter):
         num_inference_steps=30,
         **kwargs,
     ):
-        self.set_scale(scale)
+        cross_attention_kwargs = self.ip_attention_kwargs(scale, kwargs.pop("cross_attention_kwargs", None))
 
         num_prompts = 1 if isinstance(pil_image, Image.Image) else len(pil_image)
 
@@ -512,6 +888,7 @@ class IPAdapterPlusXL(IPAdapter):
             negative_pooled_prompt_embeds=negative_pooled_prompt_embeds,
             num_inference_steps=num_inference_steps,
             generator=generator,
+            cross_attention_kwargs=cross_attention_kwargs,
             **kwargs,
         ).images
 
@@ -0,0 +1,142 @@
+"""
+Cheap decoders for thumbnail and progress previews of SDXL latents.
+
+Intermediate Story-Iter passes only need `thumbnail_size` images for the next pass's CLIP references, and
+live progress images only need to be recognizable, so neither has to pay for a full-resolution SDXL VAE
+decode. `StoryAdapterXL.generate_batch(preview_decoder=...)` decodes with one of `PREVIEW_DECODERS` instead
+(the full VAE stays on the final pass):
+
+  * "vae"        — the SDXL VAE on latents area-downsampled to the preview size (1/16 of the pixels at 1024px),
+  * "taesd"      — TAESD-XL, a tiny convolutional distillation of the SDXL VAE decoder (`TAESD_PATH`),
+  * "latent_rgb" — a linear latent -> RGB projection at latent resolution, no network at all.
+
+A decoder is any callable `(pipe, latents, size) -> list of size x size PIL images`, batched over frames,
+with `latents` in the pipeline's (scaled) latent space; add more with `register_preview_decoder`.
+`LatentRGBDecoder.fit` refits the linear projection for a fine-tuned VAE.
+"""
+import os
+import threading
+
+import torch
+import torch.nn.functional as F
+from PIL import Image
+
+# linear approximation of the SDXL VAE decoder on scaled latents (per latent channel: R, G, B), plus bias
+SDXL_LATENT_RGB_FACTORS = [
+    [0.3651, 0.4232, 0.4341],
+    [-0.2533, -0.0042, 0.1068],
+    [0.1076, 0.1111, -0.0362],
+    [-0.3165, -0.2492, -0.2188],
+]
+SDXL_LATENT_RGB_BIAS = [0.1084, -0.0175, -0.0011]
+
+# TAESD-XL weights (diffusers AutoencoderTiny layout): a hub id or a local directory
+TAESD_PATH = os.getenv("TAESD_PATH", "madebyollin/taesdxl")
+
+
+def _to_pil(rgb, size):
+    """`rgb` in [-1, 1], shape (batch, 3, h, w) -> list of `size` x `size` PIL images."""
+    rgb = ((rgb.float() + 1) / 2).clamp(0, 1).mul(255).round().to(torch.uint8)
+    return [
+        Image.fromarray(frame.permute(1, 2, 0).cpu().numpy()).resize((size, size), Image.BILINEAR)
+        for frame in rgb
+    ]
+
+
+def _downsample(latents, size):
+    """Area-downsample latents so they decode to about `size` px; never upsamples."""
+    target = size // 8
+    if latents.shape[-1] <= target and latents.shape[-2] <= target:
+        return latents
+    return F.interpolate(latents.float(), size=(target, target), mode="area").to(latents.dtype)
+
+
+class LatentRGBDecoder:
+    """Per-pixel linear map from the 4 latent channels to RGB in [-1, 1]."""
+
+    def __init__(self, factors=SDXL_LATENT_RGB_FACTORS, bias=SDXL_LATENT_RGB_BIAS):
+        self.factors = torch.tensor(factors, dtype=torch.float32)
+        self.bias = torch.tensor(bias, dtype=torch.float32)
+
+    @torch.inference_mode()
+    def __call__(self, pipe, latents, size=256):
+        factors = self.factors.to(latents.device)
+        bias = self.bias.to(latents.device)
+        rgb = torch.einsum("bchw,cr->brhw", latents.float(), factors) + bias[:, None, None]
+        return _to_pil(rgb, size)
+
+    @classmethod
+    @torch.inference_mode()
+    def fit(cls, pipe, latents):
+        """Least-squares fit against the full VAE's decode of `latents`, average-pooled to latent resolution."""
+        rgb = F.avg_pool2d(_vae_decode(pipe, latents).float(), 8)
+        x = latents.float().permute(0, 2, 3, 1).reshape(-1, latents.shape[1])
+        x = torch.cat([x, torch.ones_like(x[:, :1])], dim=1)
+        y = rgb.permute(0, 2, 3, 1).reshape(-1, 3)
+        solution = torch.linalg.lstsq(x.cpu(), y.cpu()).solution
+        return cls(solution[:-1].tolist(), solution[-1].tolist())
+
+
+def _vae_decode(pipe, latents):
+    vae = pipe.vae
+    # the SDXL VAE overflows in fp16, so decode in fp32 like the pipeline does
+    needs_upcasting = vae.dtype == torch.float16 and vae.config.force_upcast
+    if needs_upcasting:
+        pipe.upcast_vae()
+    latents = latents.to(next(iter(vae.post_quant_conv.parameters())).dtype)
+    try:
+        return vae.decode(latents / vae.config.scaling_factor, return_dict=False)[0]
+    finally:
+        if needs_upcasting:
+            vae.to(dtype=torch.float16)
+
+
+@torch.inference_mode()
+def decode_vae_low_res(pipe, latents, size=256):
+    return _to_pil(_vae_decode(pipe, _downsample(latents, size)), size)
+
+
+class TinyVAEDecoder:
+    """TAESD-XL decoder; the weights load from `path` (default `TAESD_PATH`) on first use per device / dtype."""
+
+    def __init__(self, path=None, tiny_vae=None):
+        self.path = path or TAESD_PATH
+        self._models = {}
+        self._lock = threading.Lock()
+        if tiny_vae is not None:
+            self._models[(str(tiny_vae.device), tiny_vae.dtype)] = tiny_vae
+
+    def load(self, device, dtype):
+        key = (str(device), dtype)
+        with self._lock:
+            if key not in self._models:
+                from diffusers import AutoencoderTiny
+
+                self._models[key] = AutoencoderTiny.from_pretrained(self.path, torch_dtype=dtype).to(device).eval()
+            return self._models[key]
+
+    @torch.inference_mode()
+    def __call__(self, pipe, latents, size=256):
+        tiny_vae = self.load(latents.device, pipe.vae.dtype)
+        # TAESD-XL takes the pipeline's scaled latents as they are (its scaling_factor is 1.0)
+        image = tiny_vae.decode(_downsample(latents, size).to(tiny_vae.dtype), return_dict=False)[0]
+        return _to_pil(image, size)
+
+
+PREVIEW_DECODERS = {
+    "vae": decode_vae_low_res,
+    "taesd": TinyVAEDecoder(),
+    "latent_rgb": LatentRGBDecoder(),
+}
+
+
+def register_preview_decoder(name, decoder):
+    """Make `decoder(pipe, latents, size)` available as `preview_decoder=name`."""
+    PREVIEW_DECODERS[name] = decoder
+
+
+def decode_preview(pipe, latents, size=256, decoder="vae"):
+    """Decode scaled SDXL `latents` to `size` x `size` previews with one of `PREVIEW_DECODERS`."""
+    if decoder not in PREVIEW_DECODERS:
+        raise ValueError(f"unknown preview decoder {decoder!r}, expected one of {sorted(PREVIEW_DECODERS)}")
+    return PREVIEW_DECODERS[decoder](pipe, latents, size)
@@ -0,0 +1,51 @@
+"""
+Reference-selection policies for Story-Iter refinement passes.
+
+By default every frame of a refinement pass attends to the thumbnails of *all* frames of the previous pass,
+so each frame carries `4 x num_frames` image tokens and the cost of every cross-attention layer grows with
+story length. A policy caps each frame at `k` references:
+
+  * "all"    — every previous-pass thumbnail (the original Story-Iter behavior),
+  * "topk"   — the `k` thumbnails most CLIP-similar to the frame's own previous-pass thumbnail (itself included),
+  * "window" — the `k` frames around the frame in story order,
+  * "pooled" — `k` global tokens shared by every frame: the CLIP embeddings of `k` consecutive groups of
+               frames, averaged and projected again.
+
+Stories with at most `k` frames are unaffected by any policy.
+"""
+import torch
+
+REFERENCE_POLICIES = ("all", "topk", "window", "pooled")
+
+
+def select_references(adapter, reference, policy="all", k=8):
+    """
+    Apply `policy` to `reference` (one reference per frame, as built from the previous pass's thumbnails).
+
+    Returns a single `ReferenceEmbeds` shared by every frame, or a list with one per frame; frames that
+    end up with the same references share one object, so `generate_batch` can keep its shared fast path.
+    """
+    if policy not in REFERENCE_POLICIES:
+        raise ValueError(f"unknown reference policy {policy!r}, expected one of {REFERENCE_POLICIES}")
+    n = reference.num_ref
+    if policy == "all" or n <= k:
+        return reference
+    if policy == "pooled":
+        groups = torch.arange(n).tensor_split(k)
+        clip_image_embeds = reference.clip_image_embeds.float()
+        pooled = torch.stack([clip_image_embeds[group.to(clip_image_embeds.device)].mean(0) for group in groups])
+        return adapter.get_reference_embeds(clip_image_embeds=pooled)
+
+    if policy == "window":
+        starts = [min(max(i - k // 2, 0), n - k) for i in range(n)]
+        per_frame = [tuple(range(start, start + k)) for start in starts]
+    else:  # topk
+        embeds = torch.nn.functional.normalize(reference.clip_image_embeds.float(), dim=-1)
+        top = (embeds @ embeds.T).topk(k, dim=-1).indices
+        per_frame = [tuple(sorted(row.tolist())) for row in top]
+
+    selected = {}
+    for indices in per_frame:
+        if indices not in selected:
+            selected[indices] = reference.select(indices)
+    return [selected[indices] for indices in per_frame]
@@ -0,0 +1,274 @@
+"""
+Declarative Story-Iter pass schedules.
+
+A `StoryIterSchedule` lists the passes of one Story-Iter run. Each `PassConfig` sets the step count,
+IP-Adapter scale, render resolution, guidance and noise scheduler of that pass. Pass 0 is conditioned on
+the optional character image (text-only without one). Every later pass uses the previous pass's
+thumbnails as references, and the last pass produces the output frames. Schedules load from JSON or
+YAML, and the ones shipped in `NAVIS-main/schedules/` can be loaded by name:
+
+    schedule = StoryIterSchedule.load("draft")              # schedules/draft.yaml
+    schedule = StoryIterSchedule.load("my_schedule.json")   # any file
+    images = run_story_iter(storyadapter, prompts, schedule, style="storybook")
+
+With a `convergence_threshold`, refinement passes stop early: after each one, every frame's thumbnail CLIP
+embedding (already computed as the next pass's reference) is compared with the previous pass's. Frames whose
+drift (1 - cosine similarity) is under the threshold keep their image, only the drifting ones are regenerated,
+and once no frame drifts the remaining refinement passes are skipped. The last pass always runs on every frame.
+
+A pass with a `strength` warm-starts every frame from the previous pass's image instead of pure noise: the
+frame is encoded at the pass's resolution, noised to `strength`, and only that fraction of the pass's steps
+runs, so refinement costs roughly `strength` of a full pass.
+
+A non-final pass with a `preview_decoder` decodes its frames straight to `thumbnail_size` previews with that
+fast decoder (low-resolution VAE, TAESD-XL or a linear latent -> RGB projection) instead of the full VAE,
+which is all the next pass's references need. With `preview_steps` it also stops after that many denoising
+steps and decodes the scheduler's predicted x0 (by the low-resolution VAE unless a decoder is set).
+
+`reference_policy` / `max_references` bound how many previous-pass thumbnails each frame of a refinement
+pass attends to (see `reference_selection.py`), so long stories keep a flat attention cost per frame.
+"""
+import json
+import os
+from dataclasses import asdict, dataclass, fields
+from typing import List, Optional
+
+import torch
+from diffusers import (
+    DDIMScheduler,
+    DPMSolverMultistepScheduler,
+    EulerAncestralDiscreteScheduler,
+    EulerDiscreteScheduler,
+    UniPCMultistepScheduler,
+)
+
+from .preview_decoder import PREVIEW_DECODERS
+from .reference_selection import REFERENCE_POLICIES, select_references
+
+SCHEDULE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "schedules")
+
+# noise schedulers a pass may ask for; each is built from the pipeline's own scheduler config
+SCHEDULERS = {
+    "ddim": DDIMScheduler,
+    "dpmpp_2m": DPMSolverMultistepScheduler,
+    "euler": EulerDiscreteScheduler,
+    "euler_a": EulerAncestralDiscreteScheduler,
+    "unipc": UniPCMultistepScheduler,
+}
+
+# rough A100 cost of one SDXL denoising step for one 1024x1024 frame with CFG, VAE decode amortized in;
+# the server replaces it with the rate its GenerationEngine actually measures
+GPU_SECONDS_PER_MEGAPIXEL_STEP = 0.17
+
+
+@dataclass
+class PassConfig:
+    scale: float
+    steps: int = 20
+    resolution: int = 1024
+    guidance_scale: float = 5.0
+    scheduler: str = "ddim"
+    strength: Optional[float] = None  # warm start from the previous pass's frames at this noise level; None = from noise
+    preview_steps: Optional[int] = None  # stop after this many steps and use the predicted x0 as thumbnails
+    preview_decoder: Optional[str] = None  # decode thumbnails with this fast decoder (see PREVIEW_DECODERS)
+    cfg_cutoff: Optional[float] = None  # fraction of the steps after which only the conditional branch runs
+
+    def __post_init__(self):
+        if self.steps < 1:
+            raise ValueError(f"steps must be positive, got {self.steps}")
+        if self.strength is not None and not 0 < self.strength <= 1:
+            raise ValueError(f"strength must be in (0, 1], got {self.strength}")
+        if self.preview_steps is not None and not 0 < self.preview_steps <= self.steps:
+            raise ValueError(f"preview_steps must be in [1, steps], got {self.preview_steps}")
+        if self.cfg_cutoff is not None and not 0 < self.cfg_cutoff <= 1:
+            raise ValueError(f"cfg_cutoff must be in (0, 1], got {self.cfg_cutoff}")
+        if self.preview_decoder is not None and self.preview_decoder not in PREVIEW_DECODERS:
+            raise ValueError(f"unknown preview decoder {self.preview_decoder!r}, expected one of {sorted(PREVIEW_DECODERS)}")
+        if self.resolution % 8:
+            raise ValueError(f"resolution must be a multiple of 8, got {self.resolution}")
+        if self.scheduler not in SCHEDULERS:
+            raise ValueError(f"unknown scheduler {self.scheduler!r}, expected one of {sorted(SCHEDULERS)}")
+
+    def steps_run(self):
+        """Denoising steps this pass actually runs per frame (a warm start skips the first ones)."""
+        steps = self.steps * (self.strength or 1)
+        return min(steps, self.preview_steps) if self.preview_steps is not None else steps
+
+
+@dataclass
+class StoryIterSchedule:
+    passes: List[PassConfig]
+    name: str = "custom"
+    seed: Optional[int] = 42
+    thumbnail_size: int = 256
+    description: str = ""
+    convergence_threshold: Optional[float] = None  # per-frame CLIP drift below which refinement stops; None = off
+    reference_policy: str = "all"  # which previous-pass thumbnails each frame attends to, see REFERENCE_POLICIES
+    max_references: int = 8  # references per frame for every policy but "all"
+
+    def __post_init__(self):
+        if not self.passes:
+            raise ValueError("a Story-Iter schedule needs at least one pass")
+        if self.passes[0].strength is not None:
+            raise ValueError("pass 0 has no previous frames to warm-start from; leave its strength unset")
+        if self.passes[-1].preview_steps is not None or self.passes[-1].preview_decoder is not None:
+            raise ValueError("the last pass produces the output frames; it cannot be a preview pass")
+        if self.convergence_threshold is not None and not 0 <= self.convergence_threshold <= 2:
+            raise ValueError(f"convergence_threshold must be in [0, 2], got {self.convergence_threshold}")
+        if self.reference_policy not in REFERENCE_POLICIES:
+            raise ValueError(f"unknown reference policy {self.reference_policy!r}, expected one of {REFERENCE_POLICIES}")
+        if self.max_references < 1:
+            raise ValueError(f"max_references must be positive, got {self.max_references}")
+
+    @classmethod
+    def from_dict(cls, data):
+        known = {f.name for f in fields(cls)}
+        unknown = set(data) - known
+        if unknown:
+            raise ValueError(f"unknown schedule keys {sorted(unknown)}")
+        pass_keys = {f.name for f in fields(PassConfig)}
+        passes = []
+        for i, entry in enumerate(data.get("passes", [])):
+            if set(entry) - pass_keys:
+                raise ValueError(f"pass {i}: unknown keys {sorted(set(entry) - pass_keys)}")
+            passes.append(PassConfig(**entry))
+        return cls(**{**data, "passes": passes})
+
+    def to_dict(self):
+        return asdict(self)
+
+    def megapixel_steps(self, num_frames):
+        """Denoising work of running this schedule on `num_frames` frames, in 1024x1024-frame steps."""
+        return num_frames * sum(p.steps_run() * p.resolution ** 2 / 1024 ** 2 for p in self.passes)
+
+    def estimate_gpu_seconds(self, num_frames, seconds_per_megapixel_step=None):
+        """Predicted GPU time of one story; pass a measured `seconds_per_megapixel_step` when there is one."""
+        rate = seconds_per_megapixel_step or GPU_SECONDS_PER_MEGAPIXEL_STEP
+        return self.megapixel_steps(num_frames) * rate
+
+    @classmethod
+    def load(cls, name_or_path):
+        """Load a schedule from a `.json` / `.yaml` / `.yml` file, or by name from `SCHEDULE_DIR`."""
+        path = name_or_path
+        if not os.path.exists(path):
+            for ext in (".yaml", ".yml", ".json"):
+                candidate = os.path.join(SCHEDULE_DIR, name_or_path + ext)
+                if os.path.exists(candidate):
+                    path = candidate
+                    break
+            else:
+                raise FileNotFoundError(f"no Story-Iter schedule named {name_or_path!r} in {SCHEDULE_DIR}")
+
+        with open(path, "r", encoding="utf-8") as f:
+            if path.endswith((".yaml", ".yml")):
+                import yaml  # PyYAML ships with diffusers' huggingface_hub dependency
+
+                data = yaml.safe_load(f)
+            else:
+                data = json.load(f)
+        data.setdefault("name", os.path.splitext(os.path.basename(path))[0])
+        return cls.from_dict(data)
+
+    @classmethod
+    def available(cls):
+        """Names of the schedules shipped in `SCHEDULE_DIR`."""
+        return sorted(
+            os.path.splitext(name)[0]
+            for name in os.listdir(SCHEDULE_DIR)
+            if name.endswith((".yaml", ".yml", ".json"))
+        )
+
+
+def clip_drift(previous, current):
+    """Per-frame 1 - cosine similarity between two (num_frames, dim) batches of CLIP image embeddings."""
+    previous = torch.nn.functional.normalize(previous.float(), dim=-1)
+    current = torch.nn.functional.normalize(current.float(), dim=-1)
+    return (1 - (previous * current).sum(dim=-1)).tolist()
+
+
+def run_story_iter(
+    adapter,
+    prompts,
+    schedule,
+    style="storybook",
+    character_image=None,
+    generate_batch=None,
+    on_pass=None,
+    convergence_threshold=None,
+    return_stats=False,
+    **kwargs,
+):
+    """
+    Run the passes of `schedule` over `prompts` and return the last pass's images.
+
+    `generate_batch` defaults to `adapter.generate_batch`; the server passes its cross-request
+    `GenerationEngine.generate_batch` instead. `on_pass(pass_idx, pass_config, images)` is called after
+    each pass that ran (e.g. to save intermediate frames), and `kwargs` go to every `generate_batch` call.
+    `convergence_threshold` overrides the schedule's. With `return_stats=True` the result is
+    `(images, stats)`, where `stats` holds `passes_run`, `frames_per_pass` and `max_drift_per_pass`.
+    """
+    generate_batch = generate_batch or adapter.generate_batch
+    thumbnail = (schedule.thumbnail_size, schedule.thumbnail_size)
+    threshold = schedule.convergence_threshold if convergence_threshold is None else convergence_threshold
+    last = len(schedule.passes) - 1
+    stats = {"passes_run": 0, "frames_per_pass": [], "max_drift_per_pass": []}
+
+    # pass 0 is seeded by the character image if there is one, otherwise it is text-only
+    reference = adapter.get_reference_embeds([character_image]) if character_image is not None else None
+    frame_references = reference
+    images = [None] * len(prompts)
+    drifting = list(range(len(prompts)))
+    previous_embeds = None
+    stale = False  # images changed since `reference` was built
+    for pass_idx, config in enumerate(schedule.passes):
+        if stale:
+            reference = adapter.get_reference_embeds([image.resize(thumbnail) for image in images])
+            stale = False
+            if threshold is not None and previous_embeds is not None:
+                drift = clip_drift(previous_embeds, reference.clip_image_embeds)
+                drifting = [i for i in drifting if drift[i] > threshold]
+                stats["max_drift_per_pass"].append(round(max(drift), 4))
+                print(f"[Pass {pass_idx - 1}] max CLIP drift {max(drift):.4f}, {len(drifting)} frames above {threshold}")
+            previous_embeds = reference.clip_image_embeds
+            frame_references = select_references(adapter, reference, schedule.reference_policy, schedule.max_references)
+        if pass_idx == last:
+            drifting = list(range(len(prompts)))
+        elif not drifting:
+            continue
+
+        print(f"[Pass {pass_idx}/{last}] scale={config.scale:.2f}, {config.steps} steps, "
+              f"{config.resolution}px, {config.scheduler}, {len(drifting)} frames"
+              + (f", warm start at strength {config.strength}" if config.strength is not None else "")
+              + (f", x0 preview after {config.preview_steps} steps" if config.preview_steps is not None else "")
+              + (f", {config.preview_decoder} thumbnails" if config.preview_decoder is not None else ""))
+        pass_kwargs = {"cfg_cutoff": config.cfg_cutoff} if config.cfg_cutoff is not None else {}
+        if config.strength is not None:
+            pass_kwargs.update(init_images=[images[i] for i in drifting], strength=config.strength)
+        if config.preview_steps is not None or config.preview_decoder is not None:
+            pass_kwargs.update(preview_steps=config.preview_steps, preview_decoder=config.preview_decoder,
+                              preview_size=schedule.thumbnail_size)
+        regenerated = generate_batch(
+            [prompts[i] for i in drifting],
+            reference_embeds=(
+                [frame_references[i] for i in drifting] if isinstance(frame_references, list) else frame_references
+            ),
+            scale=config.scale,
+            seeds=schedule.seed,
+            guidance_scale=config.guidance_scale,
+            num_inference_steps=config.steps,
+            scheduler=config.scheduler,
+            style=[style[i] for i in drifting] if isinstance(style, list) else style,
+            height=config.resolution,
+            width=config.resolution,
+            **pass_kwargs,
+            **kwargs,
+        )
+        images = list(images)
+        for i, image in zip(drifting, regenerated):
+            images[i] = image
+        stale = True
+        stats["passes_run"] += 1
+        stats["frames_per_pass"].append(len(drifting))
+        if on_pass is not None:
+            on_pass(pass_idx, config, images)
+    return (images, stats) if return_stats else images
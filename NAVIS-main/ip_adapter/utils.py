@@ -1,39 +1,108 @@
+import functools
+import math
+
 import torch
 import torch.nn.functional as F
 import numpy as np
 from PIL import Image
 
 attn_maps = {}
-def hook_fn(name):
-    def forward_hook(module, input, output):
-        if hasattr(module.processor, "attn_map"):
-            attn_maps[name] = module.processor.attn_map
-            del module.processor.attn_map
+_attn_hook_handles = {}
+_attn_step_index = {}  # layer name -> denoising step of that layer's next call in the current generation
+_generation_hook_handles = {}  # id(unet) -> handle of the hook that spots a new generation
+
+
+def downsample_attn_map(attn_map, map_size=16, aspect_ratio=1.0):
+    """
+    Shrink a head-averaged image-token attention map for storage.
+
+    `attn_map` is `(batch, query_tokens, ip_tokens)` with the query tokens laid out on a latent
+    grid of height/width `aspect_ratio`. Returns `(batch, ip_tokens, h, w)` with `max(h, w) <= map_size`.
+    """
+    batch, query_len, ip_len = attn_map.shape
+    width = max(1, round(math.sqrt(query_len / aspect_ratio)))
+    height = query_len // width
+    attn_map = attn_map.permute(0, 2, 1).reshape(batch, ip_len, height, width)
+    if max(height, width) > map_size:
+        size = (max(1, round(map_size * height / max(height, width))), max(1, round(map_size * width / max(height, width))))
+        attn_map = F.adaptive_avg_pool2d(attn_map.float(), size)
+    return attn_map
 
-    return forward_hook
 
-def register_cross_attention_hook(unet):
+def hook_fn(name, steps=None):
+    _attn_step_index[name] = 0
+
+    def forward_pre_hook(module, input):
+        module.processor.record_attn_map = steps is None or _attn_step_index[name] in steps
+
+    def forward_hook(module, input, output):
+        if getattr(module.processor, "attn_map", None) is not None:
+            attn_maps[(name, _attn_step_index[name])] = module.processor.attn_map
+            module.processor.attn_map = None
+        module.processor.record_attn_map = False
+        _attn_step_index[name] += 1
+
+    return forward_pre_hook, forward_hook
+
+
+def generation_hook_fn():
+    """UNet pre-hook restarting the step count when a new generation begins (its timestep stops falling)."""
+    last = {"timestep": None}
+
+    def forward_pre_hook(module, args, kwargs):
+        timestep = kwargs["timestep"] if "timestep" in kwargs else args[1]
+        timestep = float(timestep.flatten()[0]) if torch.is_tensor(timestep) else float(timestep)
+        if last["timestep"] is not None and timestep >= last["timestep"]:
+            attn_maps.clear()
+            for name in _attn_step_index:
+                _attn_step_index[name] = 0
+        last["timestep"] = timestep
+
+    return forward_pre_hook
+
+
+def register_cross_attention_hook(unet, layers=None, steps=None, map_size=16, image_size=(1024, 1024)):
+    """
+    Turn on attention-map recording for the IP-Adapter cross-attention layers.
+
+    Recording is off unless this is called. `layers` selects module names containing any of the given
+    substrings (e.g. ["up_blocks.0"]), `steps` selects denoising steps, counted from 0 in every generation.
+    Recorded maps are head-averaged, downsampled to `map_size` and moved to CPU; they collect in
+    `attn_maps` keyed by `(layer_name, step)` and hold the latest generation only. Call
+    `unregister_cross_attention_hook` to stop.
+    """
+    unregister_cross_attention_hook(unet)
+    attn_maps.clear()
+    _generation_hook_handles[id(unet)] = unet.register_forward_pre_hook(generation_hook_fn(), with_kwargs=True)
+    steps = set(steps) if steps is not None else None
     for name, module in unet.named_modules():
-        if name.split('.')[-1].startswith('attn2'):
-            module.register_forward_hook(hook_fn(name))
+        if not name.split('.')[-1].startswith('attn2'):
+            continue
+        if layers is not None and not any(layer in name for layer in layers):
+            continue
+        module.processor.attn_map_size = map_size
+        module.processor.attn_map_aspect = image_size[0] / image_size[1]
+        pre_hook, hook = hook_fn(name, steps)
+        _attn_hook_handles[name] = (module.register_forward_pre_hook(pre_hook), module.register_forward_hook(hook))
 
     return unet
 
-def upscale(attn_map, target_size):
-    attn_map = torch.mean(attn_map, dim=0)
-    attn_map = attn_map.permute(1,0)
-    temp_size = None
-
-    for i in range(0,5):
-        scale = 2 ** i
-        if ( target_size[0] // scale ) * ( target_size[1] // scale) == attn_map.shape[1]*64:
-            temp_size = (target_size[0]//(scale*8), target_size[1]//(scale*8))
-            break
 
-    assert temp_size is not None, "temp_size cannot is None"
+def unregister_cross_attention_hook(unet):
+    handle = _generation_hook_handles.pop(id(unet), None)
+    if handle is not None:
+        handle.remove()
+    for name, module in unet.named_modules():
+        handles = _attn_hook_handles.pop(name, None)
+        if handles is not None:
+            for handle in handles:
+                handle.remove()
+            module.processor.record_attn_map = False
+            _attn_step_index.pop(name, None)
+    return unet
 
-    attn_map = attn_map.view(attn_map.shape[0], *temp_size)
 
+def upscale(attn_map, target_size):
     attn_map = F.interpolate(
         attn_map.unsqueeze(0).to(dtype=torch.float32),
         size=target_size,
@@ -50,7 +119,7 @@ def get_net_attn_map(image_size, batch_size=2, instance_or_negative=False, detac
 
     for name, attn_map in attn_maps.items():
         attn_map = attn_map.cpu() if detach else attn_map
-        attn_map = torch.chunk(attn_map, batch_size)[idx].squeeze()
+        attn_map = torch.chunk(attn_map, batch_size)[idx].mean(dim=0)
         attn_map = upscale(attn_map, image_size) 
         net_attn_maps.append(attn_map) 
 
@@ -90,4 +159,38 @@ def get_generator(seed, device):
     else:
         generator = None
 
-    return generator
\ No newline at end of file
+    return generator
+
+class PredictedX0Recorder:
+    """
+    Stand-in for a pipeline's noise scheduler that keeps the predicted clean latent of the last step.
+
+    Every call is forwarded to the wrapped scheduler; after each `step` the prediction is in
+    `pred_original_sample`. Schedulers whose step output has no `pred_original_sample`
+    (DPM-Solver, UniPC) get it from the model output and `alphas_cumprod`.
+    """
+
+    def __init__(self, scheduler):
+        self.scheduler = scheduler
+        self.pred_original_sample = None
+        # the pipeline inspects step()'s signature to decide whether to pass eta / generator
+        @functools.wraps(scheduler.step)
+        def step(*args, **kwargs):
+            return self._step(*args, **kwargs)
+
+        self.step = step
+
+    def __getattr__(self, name):
+        return getattr(self.scheduler, name)
+
+    def _step(self, model_output, timestep, sample, *args, return_dict=True, **kwargs):
+        output = self.scheduler.step(model_output, timestep, sample, *args, return_dict=True, **kwargs)
+        x0 = getattr(output, "pred_original_sample", None)
+        if x0 is None:
+            alpha_prod = self.scheduler.alphas_cumprod.to(sample.device)[int(timestep)].to(sample.dtype)
+            if self.scheduler.config.prediction_type == "v_prediction":
+                x0 = alpha_prod ** 0.5 * sample - (1 - alpha_prod) ** 0.5 * model_output
+            else:
+                x0 = (sample - (1 - alpha_prod) ** 0.5 * model_output) / alpha_prod ** 0.5
+        self.pred_original_sample = x0
+        return output if return_dict else (output.prev_sample,)
@@ -0,0 +1,22 @@
+from .cache import NarrationCache, file_digest
+from .engines import (
+    NARRATION_ENGINES,
+    GTTSEngine,
+    NarrationEngine,
+    NarrationResult,
+    SineEngine,
+    XTTSEngine,
+    make_narration_engine,
+)
+
+__all__ = [
+    "NarrationCache",
+    "file_digest",
+    "NARRATION_ENGINES",
+    "NarrationEngine",
+    "NarrationResult",
+    "GTTSEngine",
+    "XTTSEngine",
+    "SineEngine",
+    "make_narration_engine",
+]
@@ -0,0 +1,206 @@
+"""
+Content-addressed, disk-backed cache of synthesized narration clips.
+
+Narrations mostly come from fixed templates (the server's `STORY_BEATS`, re-read story JSON), so the same
+sentence is synthesized over and over. Clips are stored under `sha256(engine, voice, language, text)` in one
+directory, so a warm cache turns synthesis into a file lookup, survives restarts, and can be shared by the
+server, `video_gen.py` and the TTS demos. The oldest-used clips are evicted once the directory exceeds
+`max_bytes`.
+
+    cache = NarrationCache()
+    path = cache.get_or_create(text, voice="default", engine="gtts", language="en",
+                               synthesize=lambda path: gTTS(text=text, lang="en").save(path),
+                               output_path="generated_videos/narration_1234.mp3")
+
+`get_or_create` hard-links (or copies) the clip to `output_path` when one is given, so a caller that reads
+the file later is not affected by eviction. `get_or_create_batch` does the same for many clips with one
+`synthesize_batch(texts, paths)` call for the misses. Concurrent requests for the same clip synthesize it once.
+"""
+import contextlib
+import hashlib
+import json
+import os
+import shutil
+import threading
+import uuid
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+NARRATION_CACHE_DIR = os.getenv("NARRATION_CACHE_DIR", "narration_cache")
+NARRATION_CACHE_MB = float(os.getenv("NARRATION_CACHE_MB", "512"))
+
+
+def file_digest(path: str) -> str:
+    """Short content hash of a file, e.g. to key a cloned voice by its speaker reference clip."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()[:16]
+
+
+class NarrationCache:
+    def __init__(self, directory: Optional[str] = None, max_bytes: Optional[int] = None):
+        self.directory = directory or NARRATION_CACHE_DIR
+        self.max_bytes = int(max_bytes if max_bytes is not None else NARRATION_CACHE_MB * 2**20)
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, int]" = OrderedDict()  # file name -> size, least recently used first
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._pending: Dict[str, threading.Lock] = {}
+        os.makedirs(self.directory, exist_ok=True)
+        # resume from what is on disk, oldest access first
+        files = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and not entry.name.startswith("."):
+                stat = entry.stat()
+                files.append((stat.st_mtime, entry.name, stat.st_size))
+        for _, name, size in sorted(files):
+            self._entries[name] = size
+            self._bytes += size
+        with self._lock:
+            self._evict()
+
+    @staticmethod
+    def key(text: str, voice: str, engine: str, language: str) -> str:
+        return hashlib.sha256(json.dumps([engine, voice, language, text]).encode("utf-8")).hexdigest()
+
+    def _name(self, text, voice, engine, language, ext):
+        return f"{self.key(text, voice, engine, language)}.{ext.lstrip('.')}"
+
+    def get(self, text: str, voice: str, engine: str, language: str, ext: str = "mp3") -> Optional[str]:
+        """Path of the cached clip, or None."""
+        name = self._name(text, voice, engine, language, ext)
+        with self._lock:
+            if name not in self._entries:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(name)
+            self.hits += 1
+        path = os.path.join(self.directory, name)
+        try:
+            os.utime(path)  # keep the on-disk order in step for the next restart
+        except FileNotFoundError:  # removed behind our back
+            with self._lock:
+                self._bytes -= self._entries.pop(name, 0)
+                self.hits -= 1
+                self.misses += 1
+            return None
+        return path
+
+    def put(self, text: str, voice: str, engine: str, language: str, source_path: str, ext: str = "mp3") -> str:
+        """Move `source_path` into the cache; returns the cached path."""
+        name = self._name(text, voice, engine, language, ext)
+        path = os.path.join(self.directory, name)
+        os.replace(source_path, path)
+        size = os.path.getsize(path)
+        with self._lock:
+            self._bytes += size - self._entries.pop(name, 0)
+            self._entries[name] = size
+            self._evict()
+        return path
+
+    def get_or_create(
+        self,
+        text: str,
+        voice: str,
+        engine: str,
+        language: str,
+        synthesize: Callable[[str], None],
+        ext: str = "mp3",
+        output_path: Optional[str] = None,
+    ) -> str:
+        """
+        The cached clip for this (text, voice, engine, language), created with `synthesize(path)` on a miss.
+        With `output_path`, the clip is linked or copied there and `output_path` is returned.
+        """
+        [(path, _)] = self.get_or_create_batch(
+            [text], voice, engine, language, lambda texts, paths: synthesize(paths[0]), ext,
+            None if output_path is None else [output_path],
+        )
+        return path
+
+    def get_or_create_batch(
+        self,
+        texts: Sequence[str],
+        voice: str,
+        engine: str,
+        language: str,
+        synthesize_batch: Callable[[List[str], List[str]], None],
+        ext: str = "mp3",
+        output_paths: Optional[Sequence[str]] = None,
+    ) -> List[Tuple[str, bool]]:
+        """
+        `get_or_create` for many clips: the distinct texts that miss are created by one
+        `synthesize_batch(texts, paths)` call. Returns `(path, cached)` per text, `cached` being False for the
+        clips this call synthesized (repeated texts included).
+        """
+        names = {text: self._name(text, voice, engine, language, ext) for text in texts}
+        with self._lock:
+            # sorted, so two batches sharing clips take their locks in the same order
+            pending = [self._pending.setdefault(name, threading.Lock()) for name in sorted(set(names.values()))]
+        try:
+            with contextlib.ExitStack() as stack:
+                for lock in pending:
+                    stack.enter_context(lock)
+                paths = {text: self.get(text, voice, engine, language, ext) for text in names}
+                created = [text for text, path in paths.items() if path is None]
+                if created:
+                    paths.update(self._create(created, voice, engine, language, synthesize_batch, ext))
+                results = []
+                for i, text in enumerate(texts):
+                    path = paths[text]
+                    if output_paths is not None:
+                        try:
+                            path = self.export(path, output_paths[i])
+                        except FileNotFoundError:  # evicted since the lookup: synthesize it again
+                            paths.update(self._create([text], voice, engine, language, synthesize_batch, ext))
+                            created.append(text)
+                            path = self.export(paths[text], output_paths[i])
+                    results.append((path, text not in created))
+        finally:
+            with self._lock:
+                for name in names.values():
+                    self._pending.pop(name, None)
+        return results
+
+    def _create(self, texts, voice, engine, language, synthesize_batch, ext) -> Dict[str, str]:
+        tmp_paths = [os.path.join(self.directory, f".{uuid.uuid4().hex}.{ext.lstrip('.')}") for _ in texts]
+        try:
+            synthesize_batch(list(texts), tmp_paths)
+            return {text: self.put(text, voice, engine, language, tmp_path, ext)
+                    for text, tmp_path in zip(texts, tmp_paths)}
+        finally:
+            for tmp_path in tmp_paths:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+
+    @staticmethod
+    def export(path: str, output_path: str) -> str:
+        """Hard-link (or copy) a clip to `output_path`, so eviction can't remove the caller's file."""
+        if os.path.exists(output_path):
+            os.remove(output_path)
+        try:
+            os.link(path, output_path)
+        except OSError:  # other filesystem, or no hard links
+            shutil.copyfile(path, output_path)
+        return output_path
+
+    def _evict(self):
+        while self._bytes > self.max_bytes and len(self._entries) > 1:
+            name, size = self._entries.popitem(last=False)
+            self._bytes -= size
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
+
+    def stats(self):
+        return {
+            "size": len(self._entries),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
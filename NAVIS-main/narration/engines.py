@@ -0,0 +1,198 @@
+"""
+Interchangeable text-to-speech backends behind one batched interface.
+
+`NarrationEngine.narrate(texts, output_paths, cache)` synthesizes every sentence of a story in one call:
+repeated sentences are synthesized once, `NarrationCache` hits are linked instead of synthesized, and the
+misses go to the engine's `synthesize_batch`. Each sentence comes back as a `NarrationResult` with its own
+synthesis latency (0 for cache hits).
+
+  * `GTTSEngine`  — Google Translate TTS: needs network, one HTTP call per sentence; a batch runs those
+                    calls concurrently.
+  * `XTTSEngine`  — local Coqui XTTS v2 voice clone (the model `video_gen.py` uses): fully offline; a batch
+                    computes the speaker conditioning once and reuses it for every sentence.
+  * `SineEngine`  — deterministic local stand-in: a tone (or silence) whose length follows the text, for
+                    tests and for running the server without any TTS model or network.
+
+`NARRATION_ENGINES` maps the names accepted by `make_narration_engine` (and the server's
+`NARRATION_ENGINE`) to the classes.
+"""
+import hashlib
+import threading
+import time
+import wave
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import List, Optional
+
+import numpy as np
+
+from .cache import NarrationCache, file_digest
+
+
+@dataclass
+class NarrationResult:
+    text: str
+    audio_path: str
+    seconds: float  # synthesis latency of this sentence; 0 when it came from the cache or an earlier duplicate
+    cached: bool
+
+
+def write_wav(path: str, samples: np.ndarray, sample_rate: int) -> None:
+    """Mono float samples in [-1, 1] -> 16-bit PCM WAV."""
+    pcm = (np.clip(np.asarray(samples, dtype=np.float32), -1, 1) * 32767).astype("<i2")
+    with wave.open(path, "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(sample_rate)
+        f.writeframes(pcm.tobytes())
+
+
+class NarrationEngine:
+    """Base class: subclasses set `name` / `ext` / `voice` / `language` and implement `synthesize_to_file`."""
+
+    name = "base"
+    ext = "wav"
+
+    def __init__(self, voice: str = "default", language: str = "en"):
+        self.voice = voice
+        self.language = language
+
+    def synthesize_to_file(self, text: str, path: str) -> None:
+        raise NotImplementedError
+
+    def synthesize_batch(self, texts: List[str], paths: List[str]) -> List[float]:
+        """Write `texts[i]` to `paths[i]`; returns the seconds spent on each sentence."""
+        latencies = []
+        for text, path in zip(texts, paths):
+            start = time.perf_counter()
+            self.synthesize_to_file(text, path)
+            latencies.append(time.perf_counter() - start)
+        return latencies
+
+    def narrate(self, texts: List[str], output_paths: List[str],
+                cache: Optional[NarrationCache] = None) -> List[NarrationResult]:
+        """Synthesize `texts` to `output_paths` (which should end in `.{self.ext}`) in one batch."""
+        latencies = {}
+
+        def synthesize(batch, paths):
+            latencies.update(zip(batch, self.synthesize_batch(batch, paths)))
+
+        if cache is not None:
+            # the cache holds each missed clip's pending lock, so concurrent jobs never synthesize it twice
+            entries = cache.get_or_create_batch(texts, self.voice, self.name, self.language, synthesize, self.ext,
+                                                output_paths)
+        else:
+            first = {}  # text -> the output path it is synthesized to
+            for text, output_path in zip(texts, output_paths):
+                first.setdefault(text, output_path)
+            synthesize(list(first), list(first.values()))
+            entries = [(output_path if first[text] == output_path else NarrationCache.export(first[text], output_path),
+                        False) for text, output_path in zip(texts, output_paths)]
+
+        results, seen = [], set()
+        for text, (audio_path, cached) in zip(texts, entries):
+            seconds = 0.0 if cached or text in seen else latencies.get(text, 0.0)
+            seen.add(text)
+            results.append(NarrationResult(text, audio_path, seconds, cached))
+        return results
+
+
+class GTTSEngine(NarrationEngine):
+    name = "gtts"
+    ext = "mp3"
+
+    def __init__(self, language: str = "en", tld: str = "com", workers: int = 8):
+        super().__init__(voice=tld, language=language)
+        self.tld = tld
+        self.workers = workers
+
+    def synthesize_to_file(self, text, path):
+        from gtts import gTTS
+
+        gTTS(text=text, lang=self.language, tld=self.tld).save(path)
+
+    def synthesize_batch(self, texts, paths):
+        # gTTS has no batch endpoint: overlap the per-sentence HTTP round trips instead
+        def timed(text, path):
+            start = time.perf_counter()
+            self.synthesize_to_file(text, path)
+            return time.perf_counter() - start
+
+        with ThreadPoolExecutor(max_workers=max(1, min(self.workers, len(texts)))) as pool:
+            return list(pool.map(timed, texts, paths))
+
+
+class XTTSEngine(NarrationEngine):
+    name = "xtts_v2"
+    ext = "wav"
+    sample_rate = 24000
+
+    def __init__(self, speaker_wav: str, language: str = "en",
+                 model_name: str = "tts_models/multilingual/multi-dataset/xtts_v2", device: Optional[str] = None):
+        super().__init__(voice=f"xtts_v2:{file_digest(speaker_wav)}", language=language)
+        self.speaker_wav = speaker_wav
+        self.model_name = model_name
+        self.device = device
+        self._tts = None
+        self._conditioning = None
+        self._lock = threading.Lock()  # one model instance, one sentence at a time
+
+    def _load(self):
+        if self._tts is None:
+            import torch
+            from TTS.api import TTS
+
+            device = self.device or ("cuda" if torch.cuda.is_available() else "cpu")
+            self._tts = TTS(self.model_name).to(device)
+            model = self._tts.synthesizer.tts_model
+            self._conditioning = model.get_conditioning_latents(audio_path=[self.speaker_wav])
+        return self._tts.synthesizer.tts_model
+
+    def synthesize_to_file(self, text, path):
+        self.synthesize_batch([text], [path])
+
+    def synthesize_batch(self, texts, paths):
+        latencies = []
+        with self._lock:
+            model = self._load()
+            gpt_cond_latent, speaker_embedding = self._conditioning  # computed once per speaker, not per sentence
+            for text, path in zip(texts, paths):
+                start = time.perf_counter()
+                wav = model.inference(text, self.language, gpt_cond_latent, speaker_embedding)["wav"]
+                write_wav(path, wav.cpu().numpy() if hasattr(wav, "cpu") else wav, self.sample_rate)
+                latencies.append(time.perf_counter() - start)
+        return latencies
+
+
+class SineEngine(NarrationEngine):
+    """A tone per sentence, `seconds_per_char` long per character (at least `min_seconds`); the same text
+    always gives the same file. `amplitude=0` gives silence of the same length."""
+
+    name = "sine"
+    ext = "wav"
+
+    def __init__(self, seconds_per_char: float = 0.06, min_seconds: float = 0.5, amplitude: float = 0.2,
+                 sample_rate: int = 24000):
+        super().__init__(voice=f"sine:{seconds_per_char}:{amplitude}", language="any")
+        self.seconds_per_char = seconds_per_char
+        self.min_seconds = min_seconds
+        self.amplitude = amplitude
+        self.sample_rate = sample_rate
+
+    def duration(self, text: str) -> float:
+        return max(self.min_seconds, self.seconds_per_char * len(text))
+
+    def synthesize_to_file(self, text, path):
+        # pitch from the text, so different sentences are audibly different but reruns are bit-identical
+        frequency = 220 + int(hashlib.sha256(text.encode("utf-8")).hexdigest()[:4], 16) % 440
+        t = np.arange(int(self.duration(text) * self.sample_rate)) / self.sample_rate
+        write_wav(path, self.amplitude * np.sin(2 * np.pi * frequency * t), self.sample_rate)
+
+
+NARRATION_ENGINES = {"gtts": GTTSEngine, "xtts": XTTSEngine, "sine": SineEngine}
+
+
+def make_narration_engine(name: str, **kwargs) -> NarrationEngine:
+    if name not in NARRATION_ENGINES:
+        raise ValueError(f"unknown narration engine {name!r}, expected one of {sorted(NARRATION_ENGINES)}")
+    return NARRATION_ENGINES[name](**kwargs)
@@ -15,6 +15,7 @@
 
 
 import os
+import sys
 import argparse
 import torch
 import soundfile as sf
@@ -24,6 +25,9 @@ import platform
 
 from cli.SparkTTS import SparkTTS
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from narration import NarrationCache, file_digest
+
 model_dir = "/data1/lxl_data/sparkTTS"
 prompt_text = "它是一只可爱的小兔子，眼睛大大的，耳朵长长的，但是它有一个小小的烦恼，它非常胆小，特别是在课堂上"
 prompt_speech_path = "sample_speech/sample 2.wav"
@@ -48,6 +52,8 @@ else:
 
 # Initialize the model
 model = SparkTTS(model_dir, device)
+narration_cache = NarrationCache()
+voice = f"sparktts:{file_digest(prompt_speech_path)}:{prompt_text}"
 
 # Generate unique filename using timestamp
 # timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
@@ -139,16 +145,21 @@ for id, story in enumerate(stories):
             #     file_path=out_path
             # )
             print(f"Input text: {subtitle}")
-            with torch.no_grad():
-                wav = model.inference(
-                    subtitle,
-                    prompt_speech_path,
-                    prompt_text=prompt_text
-                    # gender=args.gender,
-                    # pitch=args.pitch,
-                    # speed=args.speed,
-                )
-                sf.write(out_path, wav, samplerate=16000)
+
+            def synthesize(path):
+                with torch.no_grad():
+                    wav = model.inference(
+                        subtitle,
+                        prompt_speech_path,
+                        prompt_text=prompt_text
+                        # gender=args.gender,
+                        # pitch=args.pitch,
+                        # speed=args.speed,
+                    )
+                    sf.write(path, wav, samplerate=16000, format="WAV")
+
+            narration_cache.get_or_create(subtitle, voice=voice, engine="sparktts", language="auto", ext="wav",
+                                          output_path=out_path, synthesize=synthesize)
             print(f"Generated: {out_path}")
         item['subtitle_wav'] = subtitle_wav
 
@@ -3,8 +3,12 @@ import torch
 import os
 import json
 import re
+import sys
 from TTS.api import TTS
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from narration import NarrationCache, file_digest
+
 os.environ["TTS_CACHE_PATH"] = "/data1/lxl_data/story-ad/tts"
 
 from bark import SAMPLE_RATE, generate_audio, preload_models
@@ -19,6 +23,9 @@ device = "cuda" if torch.cuda.is_available() else "cpu"
 print(TTS().list_models())
 # Init TTS 并移动到目标 device
 tts = TTS("tts_models/multilingual/multi-dataset/xtts_v2").to(device)
+speaker_wav = "/home/user/lxl/story-adapter/sample_speech/sample0.wav"
+narration_cache = NarrationCache()
+voice = f"xtts_v2:{file_digest(speaker_wav)}"
 
 
 def split_sentences(text):
@@ -72,11 +79,14 @@ for id, story in enumerate(sorted(os.listdir(story_json))):
             # write_wav(out_path, SAMPLE_RATE, audio_array)
             ############bark###############################
             subtitle_wav.append(out_path)
-            tts.tts_to_file(
-                text=subtitle,
-                speaker_wav="/home/user/lxl/story-adapter/sample_speech/sample0.wav",
-                language="en",
-                file_path=out_path
+            narration_cache.get_or_create(
+                subtitle, voice=voice, engine="xtts_v2", language="en", ext="wav", output_path=out_path,
+                synthesize=lambda path: tts.tts_to_file(
+                    text=subtitle,
+                    speaker_wav=speaker_wav,
+                    language="en",
+                    file_path=path
+                ),
             )
             print(f"Generated: {out_path}")
         item['subtitle_wav'] = subtitle_wav
@@ -3,7 +3,7 @@ from diffusers import StableDiffusionXLPipeline, StableDiffusionImg2ImgPipeline,
     DDIMScheduler, AutoencoderKL
 from PIL import Image
 import numpy as np
-from ip_adapter import StoryAdapterXL
+from ip_adapter import StoryAdapterXL, StoryIterSchedule, run_story_iter
 from ip_adapter import IPAdapter
 import os
 import json
@@ -16,6 +16,14 @@ parser.add_argument('--image_encoder_path', type=str, default=r"ckpt/ipa/sdxl_mo
 parser.add_argument('--ip_ckpt', default=r"ckpt/ip-adapter_sdxl.bin", type=str)
 parser.add_argument('--style', type=str, default='storybook', choices=["comic","film","realistic"])
 parser.add_argument('--device', default="cuda", type=str)
+parser.add_argument('--memory_budget_gb', default=24, type=float, help="activation memory per batched denoising call")
+parser.add_argument('--schedule', default="story_vis", type=str,
+                    help="Story-Iter schedule: a name from schedules/ or a .json/.yaml file")
+parser.add_argument('--convergence_threshold', default=None, type=float,
+                    help="stop refining frames whose CLIP drift between passes is below this (overrides the schedule)")
+parser.add_argument('--reference_policy', default=None, choices=["all", "topk", "window", "pooled"],
+                    help="previous-pass thumbnails each frame attends to (overrides the schedule)")
+parser.add_argument('--max_references', default=None, type=int, help="references per frame for topk / window / pooled")
 
 args = parser.parse_args()
 
@@ -60,7 +68,12 @@ pipe = StableDiffusionXLPipeline.from_pretrained(
 storyadapter = StoryAdapterXL(pipe, image_encoder_path, ip_ckpt, device)
 out_dir = 'subtitles_story'
 os.makedirs(out_dir, exist_ok=True)
-seed = 42
+schedule = StoryIterSchedule.load(args.schedule)
+if args.reference_policy is not None:
+    schedule.reference_policy = args.reference_policy
+if args.max_references is not None:
+    schedule.max_references = args.max_references
+seed = schedule.seed
 def apply_character_prompts(description: str, character_dict: dict) -> str:
     """
     替换描述中的角色名为他们的完整 prompt
@@ -84,41 +97,27 @@ with open("story_json/story_1.json", 'r', encoding='utf-8') as f:
     os.makedirs(f'./story_test/story_1_{seed}', exist_ok=True)
     os.makedirs(f'./story_test/story_1_{seed}/results_xl', exist_ok=True)
 
-    # 第一次生成
     for i, text in enumerate(prompts):
         print(f"[{seed}] prompt {i+1}: {text}")
-        images = storyadapter.generate(pil_image=None, num_samples=1, num_inference_steps=50, seed=seed,
-                                       prompt=text, scale=0.3, use_image=False, style=styles)
-        grid = image_grid(images, 1, 1)
-        grid.save(f'./story_test/story_1_{seed}/results_xl/img_{i}.png')
-
-    # 后续 scale 细化生成
-    images = []
-    for y in range(len(prompts)):
-        image = Image.open(f'./story_test/story_1_{seed}/results_xl/img_{y}.png')
-        image = image.resize((256, 256))
-        images.append(image)
-
-    scales = np.linspace(0.3, 0.5, 5)
-    for i, scale in enumerate(scales):
-        new_images = []
-        metadata = []
-        os.makedirs(f'./story_test/story_1_{seed}/results_xl{i+1}', exist_ok=True)
-        for y, text in enumerate(prompts):
-            print(f"Epoch {i+1}, image {y}")
-            image = storyadapter.generate(pil_image=images, num_samples=1, num_inference_steps=50, seed=seed,
-                                          prompt=text, scale=scale, use_image=True, style=styles)
-            new_images.append(image[0].resize((256, 256)))
-            grid = image_grid(image, 1, 1)
-            save_path = f'./story_test/story_1_{seed}/results_xl{i+1}/img_{y}.png'
-            if int(i) == 4:
+
+    # 第一次生成 (pass 0) 存到 results_xl，后续 scale 细化生成存到 results_xl{i}
+    metadata = []
+
+    def save_pass(pass_idx, config, results):
+        pass_dir = f'./story_test/story_1_{seed}/results_xl' + (str(pass_idx) if pass_idx else '')
+        os.makedirs(pass_dir, exist_ok=True)
+        for y, (text, image) in enumerate(zip(prompts, results)):
+            save_path = f'{pass_dir}/img_{y}.png'
+            image_grid([image], 1, 1).save(save_path)
+            if pass_idx == len(schedule.passes) - 1:
                 metadata.append({
                     "scene_number": y+1,
                     "prompt": text,
                     "image_path": save_path
                 })
-            grid.save(save_path)
-        images = new_images
+
+    run_story_iter(storyadapter, prompts, schedule, style=styles, on_pass=save_pass,
+                   convergence_threshold=args.convergence_threshold, memory_budget_gb=args.memory_budget_gb)
 
     with open(os.path.join(out_dir, f"story_1_{seed}.json"), "w") as f:
         json.dump(metadata, f, indent=2)
@@ -0,0 +1,38 @@
+import os
+import sys
+
+import pytest
+import torch
+
+# as in benchmarks/: the repo root for `ip_adapter` / `narration`, ip_adapter/ for its bundled `sd_embed`
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, "ip_adapter")]
+
+from diffusers import UNet2DConditionModel  # noqa: E402
+from ip_adapter.attention_processor import set_story_attn_processors  # noqa: E402
+
+CONTEXT_DIM, TEXT_DIM, NUM_TOKENS = 32, 32, 4
+
+
+@pytest.fixture
+def tiny_unet():
+    """A reduced SDXL-shaped UNet: same block layout and text-time conditioning, 32/64 channels, random weights."""
+    torch.manual_seed(0)
+    return UNet2DConditionModel(
+        block_out_channels=(32, 64),
+        layers_per_block=1,
+        down_block_types=("DownBlock2D", "CrossAttnDownBlock2D"),
+        up_block_types=("CrossAttnUpBlock2D", "UpBlock2D"),
+        attention_head_dim=(2, 4),
+        cross_attention_dim=CONTEXT_DIM,
+        addition_embed_type="text_time",
+        addition_time_embed_dim=8,
+        projection_class_embeddings_input_dim=TEXT_DIM + 6 * 8,
+        sample_size=16,
+    ).eval()
+
+
+@pytest.fixture
+def story_unet(tiny_unet):
+    """`tiny_unet` with the Story IP processors for one reference of `NUM_TOKENS` image tokens."""
+    return set_story_attn_processors(tiny_unet, num_ref=1, scale=0.5, num_tokens=NUM_TOKENS)
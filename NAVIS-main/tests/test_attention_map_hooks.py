@@ -0,0 +1,50 @@
+import torch
+from diffusers import DDIMScheduler
+
+from conftest import CONTEXT_DIM, NUM_TOKENS, TEXT_DIM
+from ip_adapter.utils import attn_maps, register_cross_attention_hook, unregister_cross_attention_hook
+
+
+def denoise(unet, steps=4):
+    scheduler = DDIMScheduler(beta_schedule="scaled_linear", beta_start=0.00085, beta_end=0.012, clip_sample=False)
+    scheduler.set_timesteps(steps)
+    latents = torch.randn(1, 4, 8, 8)
+    encoder_hidden_states = torch.randn(1, 77 + NUM_TOKENS, CONTEXT_DIM)
+    added_cond_kwargs = {"text_embeds": torch.randn(1, TEXT_DIM), "time_ids": torch.tensor([[64.0, 64, 0, 0, 64, 64]])}
+    with torch.no_grad():
+        for t in scheduler.timesteps:
+            noise_pred = unet(latents, t, encoder_hidden_states=encoder_hidden_states,
+                              added_cond_kwargs=added_cond_kwargs).sample
+            latents = scheduler.step(noise_pred, t, latents).prev_sample
+
+
+def recorded_steps():
+    return sorted({step for _, step in attn_maps})
+
+
+def test_step_filter_applies_to_every_generation(story_unet):
+    unet = story_unet
+    register_cross_attention_hook(unet, steps=[1, 3])
+    try:
+        denoise(unet)
+        first = dict(attn_maps)
+        denoise(unet)
+        assert recorded_steps() == [1, 3]
+        assert set(attn_maps) == set(first)
+        assert all(not torch.equal(attn_maps[key], first[key]) for key in first)  # the second run's maps
+    finally:
+        unregister_cross_attention_hook(unet)
+
+
+def test_re_register_starts_counting_again(story_unet):
+    unet = story_unet
+    register_cross_attention_hook(unet, steps=[0])
+    denoise(unet, steps=2)
+    unregister_cross_attention_hook(unet)
+    denoise(unet, steps=3)  # not recorded
+    register_cross_attention_hook(unet, steps=[0])
+    try:
+        denoise(unet, steps=2)
+        assert recorded_steps() == [0]
+    finally:
+        unregister_cross_attention_hook(unet)
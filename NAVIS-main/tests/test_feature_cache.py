@@ -0,0 +1,24 @@
+"""`UNetFeatureCache` step selection: which calls run the full UNet and which reuse the cached features."""
+import torch
+
+from conftest import CONTEXT_DIM, TEXT_DIM
+from ip_adapter.feature_cache import UNetFeatureCache
+
+
+def test_tensor_ip_scale_keys_the_cache(tiny_unet):
+    cache = UNetFeatureCache(tiny_unet, interval=10)
+    latents = torch.randn(2, 4, 8, 8)
+    encoder_hidden_states = torch.randn(2, 8, CONTEXT_DIM)
+    added_cond_kwargs = {"text_embeds": torch.randn(2, TEXT_DIM),
+                         "time_ids": torch.tensor([[64.0, 64, 0, 0, 64, 64]] * 2)}
+
+    def step(t, ip_scale):
+        with torch.no_grad():
+            cache(latents, t, encoder_hidden_states, added_cond_kwargs, {"ip_scale": ip_scale})
+
+    step(900, torch.tensor([0.4, 0.6]))
+    step(800, torch.tensor([0.4, 0.6]))  # an equal per-sample scale reuses the features
+    step(700, torch.tensor([0.4, 0.0]))
+    step(600, 0.5)
+    step(500, 0.5)
+    assert (cache.full_steps, cache.cached_steps) == (3, 2)
@@ -0,0 +1,70 @@
+import os
+import threading
+import time
+from collections import Counter
+
+from narration.cache import NarrationCache
+
+
+def write_clip(path, text):
+    with open(path, "w") as f:
+        f.write(text)
+
+
+def test_concurrent_requests_synthesize_each_clip_once(tmp_path):
+    cache = NarrationCache(str(tmp_path / "cache"), max_bytes=2**20)
+    calls = Counter()
+    calls_lock = threading.Lock()
+
+    def synthesize_batch(texts, paths):
+        with calls_lock:
+            calls.update(texts)
+        time.sleep(0.05)  # keep the other threads waiting on the same clips
+        for text, path in zip(texts, paths):
+            write_clip(path, text)
+
+    texts = ["Once upon a time.", "The end.", "Once upon a time.", "A dragon appeared."]
+    results = {}
+
+    def job(n):
+        outputs = [str(tmp_path / f"job{n}_{i}.mp3") for i in range(len(texts))]
+        order = texts if n % 2 else texts[::-1]  # overlapping batches in both orders must not deadlock
+        results[n] = cache.get_or_create_batch(order, "default", "test", "en", synthesize_batch,
+                                               output_paths=outputs)
+
+    threads = [threading.Thread(target=job, args=(n,)) for n in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=10)
+
+    assert not any(thread.is_alive() for thread in threads)
+    assert calls == Counter(set(texts))
+    assert sum(not cached for result in results.values() for _, cached in result) == len(texts)  # the first job
+    for result in results.values():
+        for path, _ in result:
+            assert os.path.exists(path)
+
+
+def test_clip_evicted_before_export_is_recreated(tmp_path):
+    cache = NarrationCache(str(tmp_path / "cache"), max_bytes=2**20)
+    synthesized = []
+
+    def synthesize(path):
+        synthesized.append(path)
+        write_clip(path, "hello")
+
+    cache.get_or_create("hello", "default", "test", "en", synthesize)
+    get = cache.get
+
+    def get_then_evict(*args, **kwargs):
+        path = get(*args, **kwargs)
+        os.remove(path)  # what a concurrent put's eviction can do between the lookup and the export
+        return path
+
+    cache.get = get_then_evict
+    output_path = str(tmp_path / "out.mp3")
+    assert cache.get_or_create("hello", "default", "test", "en", synthesize, output_path=output_path) == output_path
+    assert len(synthesized) == 2
+    with open(output_path) as f:
+        assert f.read() == "hello"
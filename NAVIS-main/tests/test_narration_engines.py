@@ -0,0 +1,50 @@
+import threading
+import time
+from collections import Counter
+
+from narration.cache import NarrationCache
+from narration.engines import SineEngine
+
+
+class CountingSineEngine(SineEngine):
+    def __init__(self):
+        super().__init__()
+        self.calls = Counter()
+        self._calls_lock = threading.Lock()
+
+    def synthesize_to_file(self, text, path):
+        with self._calls_lock:
+            self.calls[text] += 1
+        time.sleep(0.02)
+        super().synthesize_to_file(text, path)
+
+
+def test_concurrent_narrations_share_one_synthesis_per_sentence(tmp_path):
+    engine = CountingSineEngine()
+    cache = NarrationCache(str(tmp_path / "cache"), max_bytes=2**24)
+    texts = ["Once upon a time.", "The end.", "Once upon a time.", "A dragon appeared."]
+    results = {}
+
+    def job(n):
+        outputs = [str(tmp_path / f"job{n}_{i}.wav") for i in range(len(texts))]
+        results[n] = engine.narrate(texts, outputs, cache)
+
+    threads = [threading.Thread(target=job, args=(n,)) for n in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=10)
+
+    assert not any(thread.is_alive() for thread in threads)
+    assert engine.calls == Counter(set(texts))
+    synthesized = [r for result in results.values() for r in result if r.seconds > 0]
+    assert sorted(r.text for r in synthesized) == sorted(set(texts))  # latency counted once per sentence
+
+
+def test_narrate_without_cache_synthesizes_repeats_once(tmp_path):
+    engine = CountingSineEngine()
+    texts = ["Hello.", "Hello.", "Bye."]
+    results = engine.narrate(texts, [str(tmp_path / f"{i}.wav") for i in range(3)])
+    assert engine.calls == Counter({"Hello.": 1, "Bye.": 1})
+    assert [r.cached for r in results] == [False, False, False]
+    assert results[1].seconds == 0.0 and results[0].seconds > 0
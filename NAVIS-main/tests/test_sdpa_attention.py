@@ -0,0 +1,28 @@
+"""The SDPA Story processor (`StoryAttnProcessor2_0`) against the bmm `IPAttnProcessor` it replaces."""
+import pytest
+import torch
+from diffusers.models.attention_processor import Attention
+
+from ip_adapter.attention_processor import IPAttnProcessor, StoryAttnProcessor2_0
+
+HIDDEN_SIZE, HEADS, CONTEXT_DIM, NUM_TOKENS, NUM_REF = 64, 4, 32, 4, 3
+
+
+@pytest.mark.parametrize("context_len", [77, 77 + NUM_TOKENS * NUM_REF], ids=["text", "text+ip"])
+def test_sdpa_matches_bmm(context_len):
+    torch.manual_seed(0)
+    attn = Attention(query_dim=HIDDEN_SIZE, cross_attention_dim=CONTEXT_DIM, heads=HEADS,
+                     dim_head=HIDDEN_SIZE // HEADS).eval()
+    bmm = IPAttnProcessor(HIDDEN_SIZE, CONTEXT_DIM, num_ref=NUM_REF, scale=0.5, num_tokens=NUM_TOKENS)
+    sdpa = StoryAttnProcessor2_0(HIDDEN_SIZE, CONTEXT_DIM, num_ref=NUM_REF, scale=0.5, num_tokens=NUM_TOKENS)
+    sdpa.load_state_dict(bmm.state_dict())
+
+    hidden_states = torch.randn(2, 16, HIDDEN_SIZE)
+    encoder_hidden_states = torch.randn(2, context_len, CONTEXT_DIM)
+    with torch.no_grad():
+        attn.set_processor(bmm)
+        expected = attn(hidden_states, encoder_hidden_states)
+        attn.set_processor(sdpa)
+        actual = attn(hidden_states, encoder_hidden_states)
+
+    torch.testing.assert_close(actual, expected)
@@ -0,0 +1,76 @@
+"""x0 previews and progress images through `callback_on_step_end`, on both SDXL pipelines StoryAdapterXL drives."""
+import pytest
+import torch
+from diffusers import AutoencoderKL, DDIMScheduler, StableDiffusionXLPipeline
+
+from conftest import CONTEXT_DIM, TEXT_DIM
+from ip_adapter.custom_pipelines import StableDiffusionXLCustomPipeline
+from ip_adapter.ip_adapter import StoryAdapterXL
+from ip_adapter.utils import PredictedX0Recorder
+
+STEPS = 6
+
+
+def tiny_pipe(pipeline_class, unet):
+    vae = AutoencoderKL(block_out_channels=(32, 64), down_block_types=("DownEncoderBlock2D",) * 2,
+                        up_block_types=("UpDecoderBlock2D",) * 2, latent_channels=4).eval()
+    scheduler = DDIMScheduler(beta_schedule="scaled_linear", beta_start=0.00085, beta_end=0.012, clip_sample=False)
+    return pipeline_class(vae=vae, text_encoder=None, text_encoder_2=None, tokenizer=None, tokenizer_2=None,
+                          unet=unet, scheduler=scheduler, add_watermarker=False)
+
+
+@pytest.mark.parametrize("pipeline_class", [StableDiffusionXLPipeline, StableDiffusionXLCustomPipeline])
+def test_previews_and_early_stop(pipeline_class, tiny_unet):
+    pipe = tiny_pipe(pipeline_class, tiny_unet)
+    adapter = StoryAdapterXL.__new__(StoryAdapterXL)  # the callback only needs the pipeline
+    adapter.pipe = pipe
+    recorder = PredictedX0Recorder(pipe.scheduler)
+    pipe.scheduler = recorder
+    progress, steps = [], []
+    callback = adapter._step_end_callback(recorder, stop_after=4, on_progress=lambda *args: progress.append(args),
+                                          progress_every=2, progress_decoder="latent_rgb", preview_size=32)
+
+    def counting_callback(pipe, step_index, timestep, callback_kwargs):
+        steps.append(step_index)
+        return callback(pipe, step_index, timestep, callback_kwargs)
+
+    batch = 2
+    latents = pipe(
+        prompt_embeds=torch.randn(batch, 8, CONTEXT_DIM),
+        negative_prompt_embeds=torch.randn(batch, 8, CONTEXT_DIM),
+        pooled_prompt_embeds=torch.randn(batch, TEXT_DIM),
+        negative_pooled_prompt_embeds=torch.randn(batch, TEXT_DIM),
+        num_inference_steps=STEPS,
+        output_type="latent",
+        callback_on_step_end=counting_callback,
+        callback_on_step_end_tensor_inputs=["latents", "prompt_embeds", "add_text_embeds", "add_time_ids"],
+    ).images
+
+    assert steps == [0, 1, 2, 3]  # interrupted after stop_after steps
+    assert [(step, indices) for step, indices, _ in progress] == [(1, [0, 1]), (3, [0, 1])]
+    assert all(len(images) == batch for _, _, images in progress)
+    assert recorder.pred_original_sample.shape == latents.shape
+
+
+def test_custom_pipeline_callback_can_drop_guidance(tiny_unet):
+    pipe = tiny_pipe(StableDiffusionXLCustomPipeline, tiny_unet)
+    adapter = StoryAdapterXL.__new__(StoryAdapterXL)
+    adapter.pipe = pipe
+    seen = []
+    cutoff = adapter._step_end_callback(cfg_cutoff=0.5)
+
+    def callback(pipe, step_index, timestep, callback_kwargs):
+        seen.append(callback_kwargs["prompt_embeds"].shape[0])
+        return cutoff(pipe, step_index, timestep, callback_kwargs)
+
+    pipe(
+        prompt_embeds=torch.randn(1, 8, CONTEXT_DIM),
+        negative_prompt_embeds=torch.randn(1, 8, CONTEXT_DIM),
+        pooled_prompt_embeds=torch.randn(1, TEXT_DIM),
+        negative_pooled_prompt_embeds=torch.randn(1, TEXT_DIM),
+        num_inference_steps=STEPS,
+        output_type="latent",
+        callback_on_step_end=callback,
+        callback_on_step_end_tensor_inputs=["prompt_embeds", "add_text_embeds", "add_time_ids"],
+    )
+    assert seen == [2, 2, 2, 1, 1, 1]
@@ -4,6 +4,7 @@ import os
 import json
 import re
 from TTS.api import TTS
+from narration import NarrationCache, XTTSEngine
 
 from scipy.io.wavfile import write as write_wav
 from IPython.display import Audio
@@ -14,8 +15,10 @@ from IPython.display import Audio
 # Get device
 device = "cuda" if torch.cuda.is_available() else "cpu"
 print(TTS().list_models())
-# Init TTS 并移动到目标 device
-tts = TTS("tts_models/multilingual/multi-dataset/xtts_v2").to(device)
+# XTTS v2 voice clone; the speaker conditioning is computed once and reused for every sentence
+narration_engine = XTTSEngine(speaker_wav="sample_speech/sample.wav", language="en", device=device)
+# sentences repeat across stories and reruns: synthesize each (sentence, voice) once
+narration_cache = NarrationCache()
 
 
 def split_sentences(text):
@@ -75,13 +78,9 @@ for id, story in enumerate(sorted(os.listdir(story_json))):
             # write_wav(out_path, SAMPLE_RATE, audio_array)
             ############bark###############################
             subtitle_wav.append(out_path)
-            tts.tts_to_file(
-                text=subtitle,
-                speaker_wav="sample_speech/sample.wav",
-                language="en",
-                file_path=out_path
-            )
-            print(f"Generated: {out_path}")
+        # all sentences of the scene in one batched call
+        for clip in narration_engine.narrate(subtitles, subtitle_wav, narration_cache):
+            print(f"Generated: {clip.audio_path} ({'cached' if clip.cached else f'{clip.seconds:.2f}s'})")
         item['subtitle_wav'] = subtitle_wav
 
     # 加入元素
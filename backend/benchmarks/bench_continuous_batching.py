@@ -0,0 +1,164 @@
+"""
+Throughput of concurrent Story-Iter jobs with and without cross-request batching.
+
+For 1, 2, 4 and 8 concurrent jobs it compares
+  * sequential — jobs run one after another, each pass batched on its own (one JobScheduler worker), and
+  * merged     — jobs run side by side and GenerationEngine packs compatible frames from all of them
+                 into shared UNet batches,
+and reports frames/second and the mean UNet batch size.
+
+By default the GPU is replaced by a linear cost model that sleeps (a batch of n frames costs
+`steps * (step_ms + n * frame_step_ms)`; tune both to your GPU), so the scheduling effect can be
+checked on any machine — those numbers restate the model, they do not measure a GPU, and the table says
+so. `--real` times the actual StoryAdapterXL on CUDA, loaded from the server's checkpoints
+(`BASE_MODEL_PATH` / `IMAGE_ENCODER_PATH` / `IP_CKPT`, or the flags below):
+
+    python benchmarks/bench_continuous_batching.py --frames 4
+    python benchmarks/bench_continuous_batching.py --real --frames 4 --passes 2 --concurrency 1 2 4
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+from collections import namedtuple
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND)
+
+from generation_engine import GenerationEngine  # noqa: E402
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--concurrency', default=[1, 2, 4, 8], type=int, nargs="+")
+parser.add_argument('--frames', default=15, type=int, help="frames per story (frameCount)")
+parser.add_argument('--passes', default=5, type=int, help="Story-Iter passes per story, including pass 0")
+parser.add_argument('--steps', default=20, type=int)
+parser.add_argument('--resolution', default=1024, type=int)
+parser.add_argument('--memory_budget_gb', default=24.0, type=float)
+parser.add_argument('--step_ms', default=25.0, type=float, help="cost model: fixed cost of one UNet step")
+parser.add_argument('--frame_step_ms', default=45.0, type=float, help="cost model: cost per frame per UNet step")
+parser.add_argument('--real', action="store_true", help="time the real StoryAdapterXL instead of the cost model")
+parser.add_argument('--base_model', default=os.getenv("BASE_MODEL_PATH", "ckpt/story-ad/RealVisXL_V4"), type=str)
+parser.add_argument('--image_encoder', default=os.getenv("IMAGE_ENCODER_PATH", "ckpt/ipa/sdxl_models/image_encoder"),
+                    type=str)
+parser.add_argument('--ip_ckpt', default=os.getenv("IP_CKPT", "ckpt/ipa/sdxl_models/ip-adapter_sdxl.bin"), type=str)
+args = parser.parse_args()
+
+FakeReference = namedtuple("FakeReference", ["num_ref"])
+
+
+class CostModelAdapter:
+    """Stands in for StoryAdapterXL: sleeps for as long as the modelled GPU batch would take."""
+
+    sample_memory_gb = 3.0
+
+    def __init__(self):
+        self.batches = 0
+        self.frames = 0
+        self._gpu = threading.Lock()
+
+    def micro_batch_size(self, height=1024, width=1024, max_batch_size=None, memory_budget_gb=None):
+        per_sample_gb = self.sample_memory_gb * (height * width) / (1024 * 1024)
+        fits = max(1, int(memory_budget_gb // per_sample_gb)) if memory_budget_gb is not None else None
+        return fits if max_batch_size is None else min(max_batch_size, fits or max_batch_size)
+
+    def generate_batch(self, prompts, num_inference_steps=30, height=1024, width=1024,
+                       max_batch_size=None, memory_budget_gb=None, **kwargs):
+        batch_size = self.micro_batch_size(height, width, max_batch_size, memory_budget_gb) or len(prompts)
+        pixels = height * width / (1024 * 1024)
+        for start in range(0, len(prompts), batch_size):
+            n = len(prompts[start:start + batch_size])
+            with self._gpu:
+                time.sleep(num_inference_steps * (args.step_ms + n * pixels * args.frame_step_ms) / 1000)
+                self.batches += 1
+                self.frames += n
+        return [None] * len(prompts)
+
+    def get_reference_embeds(self, images):
+        return FakeReference(num_ref=len(images))
+
+
+def load_adapter():
+    if not args.real:
+        return CostModelAdapter()
+
+    import torch
+    from diffusers import DDIMScheduler, StableDiffusionXLPipeline
+
+    sys.path[:0] = [os.path.join(os.path.dirname(BACKEND), "NAVIS-main")]
+    from ip_adapter import StoryAdapterXL
+
+    scheduler = DDIMScheduler(num_train_timesteps=1000, beta_start=0.00085, beta_end=0.012,
+                              beta_schedule="scaled_linear", clip_sample=False, set_alpha_to_one=False,
+                              steps_offset=1)
+    pipe = StableDiffusionXLPipeline.from_pretrained(args.base_model, torch_dtype=torch.float16,
+                                                     scheduler=scheduler, feature_extractor=None,
+                                                     safety_checker=None)
+    pipe.set_progress_bar_config(disable=True)
+    adapter = StoryAdapterXL(pipe, args.image_encoder, args.ip_ckpt, "cuda")
+    # count UNet batches the same way the cost model does (one call per step, CFG doubles the rows)
+    adapter.batches = adapter.frames = 0
+
+    def count_unet_call(module, inputs):
+        adapter.batches += 1 / args.steps
+        adapter.frames += inputs[0].shape[0] / 2 / args.steps
+
+    pipe.unet.register_forward_pre_hook(count_unet_call)
+    return adapter
+
+
+def run_story(generate_batch, adapter, job_idx):
+    prompts = [f"story {job_idx} frame {i}" for i in range(args.frames)]
+    reference = None
+    for pass_idx in range(args.passes):
+        images = generate_batch(
+            prompts,
+            reference_embeds=reference,
+            scale=0.3 + 0.2 * pass_idx / max(1, args.passes - 1),
+            seeds=42 + job_idx,
+            num_inference_steps=args.steps,
+            style="storybook",
+            height=args.resolution,
+            width=args.resolution,
+        )
+        reference = adapter.get_reference_embeds(images)
+
+
+def measure(adapter, concurrency, merged):
+    adapter.batches = adapter.frames = 0
+    if merged:
+        engine = GenerationEngine(adapter, memory_budget_gb=args.memory_budget_gb).start()
+        generate_batch = engine.generate_batch
+    else:
+        def generate_batch(prompts, **kwargs):
+            return adapter.generate_batch(prompts, memory_budget_gb=args.memory_budget_gb, **kwargs)
+
+    start = time.perf_counter()
+    if merged:
+        jobs = [threading.Thread(target=run_story, args=(generate_batch, adapter, i)) for i in range(concurrency)]
+        for job in jobs:
+            job.start()
+        for job in jobs:
+            job.join()
+        engine.shutdown()
+    else:
+        for i in range(concurrency):
+            run_story(generate_batch, adapter, i)
+    seconds = time.perf_counter() - start
+    return adapter.frames / seconds, adapter.frames / adapter.batches
+
+
+adapter = load_adapter()
+if args.real:
+    mode = f"measured: StoryAdapterXL ({args.base_model}) on CUDA"
+else:
+    mode = (f"SIMULATED (sleep-based cost model, {args.step_ms} + n * {args.frame_step_ms} ms/step; "
+            "no GPU work, pass --real to measure)")
+print(f"{mode}: {args.frames} frames x {args.passes} passes, {args.steps} steps, "
+      f"{args.resolution}px, budget {args.memory_budget_gb} GB")
+print(f"{'jobs':>5} {'sequential fps':>15} {'batch':>6} {'merged fps':>11} {'batch':>6} {'speedup':>8}")
+for concurrency in args.concurrency:
+    sequential_fps, sequential_batch = measure(adapter, concurrency, merged=False)
+    merged_fps, merged_batch = measure(adapter, concurrency, merged=True)
+    print(f"{concurrency:>5} {sequential_fps:>15.3f} {sequential_batch:>6.1f} {merged_fps:>11.3f} "
+          f"{merged_batch:>6.1f} {merged_fps / sequential_fps:>7.2f}x")
@@ -0,0 +1,66 @@
+"""
+Per-sentence latency of the narration engines on a story's 15 narrations, cold and warm.
+
+Synthesizes the narrations of the server's `STORY_BEATS` (copied here so the benchmark does not load the
+server's models) with each engine in `--engines` as one `NarrationEngine.narrate` batch, first with an empty
+`NarrationCache` and then again with the now-warm one, and reports the batch wall time and the per-sentence
+latency. "sine" runs anywhere; "gtts" needs network and "xtts" the Coqui TTS package and a speaker clip:
+
+    python benchmarks/bench_narration.py --engines sine gtts xtts --speaker_wav ../NAVIS-main/sample_speech/sample0.wav
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [BACKEND, os.path.join(os.path.dirname(BACKEND), "NAVIS-main")]
+
+from narration import NarrationCache, make_narration_engine  # noqa: E402
+from story_video import audio_duration  # noqa: E402
+
+NARRATIONS = [
+    "Our story begins with {prompt}, where a grand adventure awaits.",
+    "With bags packed and eyes on the horizon, the journey officially began.",
+    "But the path was not easy. A sudden, massive obstacle blocked the way!",
+    "Through the chaos, a mysterious, uncharted territory appeared.",
+    "Venturing deeper into the unknown, strange sights and wonders were everywhere.",
+    "Along the way, an unexpected but welcome ally joined the cause.",
+    "Unbeknownst to them, a dark presence was watching from the shadows.",
+    "Without warning, a fierce ambush struck!",
+    "The enemies were overwhelmingly strong, pushing our hero to their absolute limits.",
+    "But giving up wasn't an option. A fierce new resolve ignited within!",
+    "With a mighty roar, the counterattack began, shaking the very ground.",
+    "In a flash of brilliant light, the final, decisive blow was struck!",
+    "As the dust finally settled, victory was secured.",
+    "The night was filled with joyous celebration, food, and laughter.",
+    "And so, with one chapter closed, eyes turned toward the next great adventure.",
+]
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--engines', default=["sine"], nargs="+", choices=["gtts", "xtts", "sine"])
+parser.add_argument('--prompt', default="a brave fox", type=str)
+parser.add_argument('--speaker_wav', default=None, type=str, help="voice to clone for xtts")
+parser.add_argument('--tts_workers', default=8, type=int, help="concurrent requests for gtts")
+args = parser.parse_args()
+
+texts = [text.format(prompt=args.prompt) for text in NARRATIONS]
+print(f"{len(texts)} narrations")
+print("| engine | cache | batch wall s | mean s / sentence | max s / sentence | audio s | cached |")
+print("|---|---|---:|---:|---:|---:|---:|")
+for name in args.engines:
+    kwargs = {"gtts": {"workers": args.tts_workers}, "xtts": {"speaker_wav": args.speaker_wav}}.get(name, {})
+    engine = make_narration_engine(name, **kwargs)
+    with tempfile.TemporaryDirectory() as directory:
+        cache = NarrationCache(os.path.join(directory, "cache"))
+        for label in ("cold", "warm"):
+            paths = [os.path.join(directory, f"{label}_{i}.{engine.ext}") for i in range(len(texts))]
+            start = time.perf_counter()
+            clips = engine.narrate(texts, paths, cache)
+            wall = time.perf_counter() - start
+            latencies = [clip.seconds for clip in clips]
+            audio = sum(audio_duration(clip.audio_path) for clip in clips)
+            print(f"| {name} | {label} | {wall:.2f} | {statistics.mean(latencies):.3f} | {max(latencies):.3f} | "
+                  f"{audio:.1f} | {sum(clip.cached for clip in clips)}/{len(clips)} |")
@@ -0,0 +1,83 @@
+"""
+Encode cost of the story video: MoviePy per-frame compositing vs. frames streamed straight into ffmpeg,
+in one process or as per-scene segments encoded in parallel and concatenated without re-encoding.
+
+Builds `--scenes` synthetic scenes (a detailed `--resolution` px still each, plus a sine-tone narration of
+`--seconds` s, like one gTTS beat) and renders them with each renderer from `story_video.py`. For each it
+reports wall time and seconds of encode per second of video. As a check that the zoom curve and timing
+match, it also reports the output durations and the PSNR of every other video's frames against the first
+renderer's at a few timestamps:
+
+    python benchmarks/bench_video_render.py --scenes 15 --seconds 4 --workers 8
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+from PIL import Image
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND)
+
+from story_video import RENDERERS, audio_duration, ffmpeg_binary, scene_for  # noqa: E402
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--scenes', default=15, type=int)
+parser.add_argument('--seconds', default=4.0, type=float, help="narration length per scene")
+parser.add_argument('--resolution', default=1024, type=int)
+parser.add_argument('--renderers', default=["moviepy", "ffmpeg", "parallel"], nargs="+", choices=sorted(RENDERERS))
+parser.add_argument('--workers', default=None, type=int, help="scenes encoded at once by the parallel renderer (default: all cores)")
+args = parser.parse_args()
+
+
+def make_scene(directory, i):
+    rng = np.random.RandomState(i)
+    y, x = np.mgrid[0:args.resolution, 0:args.resolution] / args.resolution
+    base = np.stack([np.sin(12 * x + i), np.cos(9 * y - i), np.sin(7 * (x + y))], axis=-1)
+    pixels = (base + 1) * 100 + rng.randint(0, 55, base.shape)
+    image_path = os.path.join(directory, f"frame_{i}.png")
+    Image.fromarray(pixels.astype(np.uint8)).save(image_path)
+    audio_path = os.path.join(directory, f"frame_{i}.mp3")
+    subprocess.run([ffmpeg_binary(), "-y", "-loglevel", "error", "-f", "lavfi",
+                    "-i", f"sine=frequency={220 + 40 * i}:duration={args.seconds}", "-ar", "24000", audio_path],
+                   check=True)
+    return scene_for(image_path, audio_path)
+
+
+def frame_at(path, t):
+    result = subprocess.run([ffmpeg_binary(), "-loglevel", "error", "-ss", f"{t:.3f}", "-i", path, "-frames:v", "1",
+                             "-f", "rawvideo", "-pix_fmt", "rgb24", "-"], capture_output=True, check=True)
+    return np.frombuffer(result.stdout, np.uint8).astype(np.float64)
+
+
+with tempfile.TemporaryDirectory() as directory:
+    scenes = [make_scene(directory, i) for i in range(args.scenes)]
+    video_seconds = sum(scene.duration for scene in scenes)
+    rows, outputs = [], {}
+    for name in args.renderers:
+        output_path = os.path.join(directory, f"{name}.mp4")
+        start = time.perf_counter()
+        RENDERERS[name](scenes, output_path, **({"workers": args.workers} if name == "parallel" else {}))
+        seconds = time.perf_counter() - start
+        outputs[name] = output_path
+        rows.append((name, seconds, seconds / video_seconds, audio_duration(output_path)))
+
+    print(f"{args.scenes} scenes x {scenes[0].duration:.2f} s at {args.resolution}px = {video_seconds:.1f} s of video, "
+          f"{os.cpu_count()} cores")
+    print("| renderer | wall s | encode s / video s | speedup | output duration s |")
+    print("|---|---:|---:|---:|---:|")
+    for name, seconds, per_second, duration in rows:
+        print(f"| {name} | {seconds:.1f} | {per_second:.3f} | {rows[0][1] / seconds:.2f}x | {duration:.2f} |")
+
+    if len(outputs) > 1:
+        reference, *others = args.renderers
+        for name in others:
+            psnrs = []
+            for t in np.linspace(0.5, video_seconds - 0.5, 5):
+                mse = np.mean((frame_at(outputs[reference], t) - frame_at(outputs[name], t)) ** 2)
+                psnrs.append(float("inf") if mse == 0 else 10 * np.log10(255 ** 2 / mse))
+            print(f"PSNR {name} vs. {reference} at 5 timestamps: " + ", ".join(f"{p:.1f}" for p in psnrs) + " dB")
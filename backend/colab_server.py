@@ -16,10 +16,10 @@ import sys
 import io
 import uuid
 import base64
+import time
 import requests
-import threading
-import numpy as np
-from typing import List, Optional, Dict, Any
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import List, Optional, Dict, Any, Tuple
 from datetime import timedelta
 from dotenv import load_dotenv
 from PIL import Image
@@ -28,13 +28,15 @@ from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 import uvicorn
-from moviepy.editor import ImageClip, CompositeVideoClip, AudioFileClip, concatenate_videoclips
-from gtts import gTTS
 import firebase_admin
 from firebase_admin import credentials, storage
+from job_scheduler import JobScheduler, add_queue_full_handler
+from generation_engine import GenerationEngine
+from story_video import RENDERERS, scene_for
 
 # Story-Iter imports — path is set by the Colab notebook before starting this server
-from ip_adapter import StoryAdapterXL
+from ip_adapter import StoryAdapterXL, StoryIterSchedule, run_story_iter
+from narration import NarrationCache, NarrationResult, make_narration_engine
 from diffusers import StableDiffusionXLPipeline, DDIMScheduler
 import torch
 
@@ -48,6 +50,27 @@ BASE_MODEL_PATH    = os.getenv("BASE_MODEL_PATH",    "ckpt/story-ad/RealVisXL_V4
 IMAGE_ENCODER_PATH = os.getenv("IMAGE_ENCODER_PATH", "ckpt/ipa/sdxl_models/image_encoder")
 IP_CKPT            = os.getenv("IP_CKPT",            "ckpt/ipa/sdxl_models/ip-adapter_sdxl.bin")
 DEVICE             = "cuda" if torch.cuda.is_available() else "cpu"
+# Activation memory (GB) a single Story-Iter micro-batch may use; leaves headroom for the ~10 GB of weights
+MEMORY_BUDGET_GB   = float(os.getenv("MEMORY_BUDGET_GB", "24"))
+# Story-Iter pass schedule (steps / IP scale / resolution / guidance / scheduler per pass): a name from
+# NAVIS-main/schedules/ or a path to a .json/.yaml file. Requests may pick any shipped schedule by name.
+STORY_ITER_SCHEDULE = os.getenv("STORY_ITER_SCHEDULE", "default")
+# Per-frame CLIP drift (1 - cosine) under which refinement passes stop early; unset = the schedule's own setting
+CONVERGENCE_THRESHOLD = float(os.environ["CONVERGENCE_THRESHOLD"]) if os.getenv("CONVERGENCE_THRESHOLD") else None
+# Jobs in flight at once, and jobs allowed to wait before /generate-story answers 429. Above 1, in-flight jobs
+# share UNet batches, but the queue's ETAs still assume each job runs as if it had the GPU to itself.
+GPU_WORKERS        = int(os.getenv("GPU_WORKERS", "1"))
+MAX_QUEUED_JOBS    = int(os.getenv("MAX_QUEUED_JOBS", "8"))
+# "parallel" encodes each scene in its own ffmpeg (on a thread pool) and concatenates the segments without re-encoding;
+# "ffmpeg" streams all Ken Burns frames into one ffmpeg; "moviepy" is the old per-frame MoviePy compositor
+VIDEO_RENDERER     = os.getenv("VIDEO_RENDERER", "parallel")
+# Scenes the "parallel" renderer encodes at once; unset = one per CPU core
+VIDEO_WORKERS      = int(os.environ["VIDEO_WORKERS"]) if os.getenv("VIDEO_WORKERS") else None
+# Narration backend: "gtts" (network), "xtts" (local XTTS v2 voice clone, offline) or "sine" (offline stand-in tone)
+NARRATION_ENGINE   = os.getenv("NARRATION_ENGINE", "gtts")
+NARRATION_SPEAKER_WAV = os.getenv("NARRATION_SPEAKER_WAV", "../NAVIS-main/sample_speech/sample0.wav")  # voice for "xtts"
+# gTTS requests in flight per story (one HTTP call per clip)
+TTS_WORKERS        = int(os.getenv("TTS_WORKERS", "8"))
 
 print(f"🔧 Device: {DEVICE}")
 print(f"🔧 Base model: {BASE_MODEL_PATH}")
@@ -81,6 +104,13 @@ pipe = StableDiffusionXLPipeline.from_pretrained(
 )
 
 storyadapter = StoryAdapterXL(pipe, IMAGE_ENCODER_PATH, IP_CKPT, DEVICE)
+schedules = {name: StoryIterSchedule.load(name) for name in StoryIterSchedule.available()}
+default_schedule = StoryIterSchedule.load(STORY_ITER_SCHEDULE)
+print(f"🔧 Story-Iter schedule: {default_schedule.name} ({len(default_schedule.passes)} passes)")
+# Quality tiers the app can offer: a fast preview, the server default, and the slow full-resolution schedule
+QUALITY_TIERS = {"draft": schedules["draft"], "standard": default_schedule, "high": schedules["final"]}
+# Single GPU thread that merges compatible frames from concurrent jobs into one UNet batch
+engine = GenerationEngine(storyadapter, memory_budget_gb=MEMORY_BUDGET_GB).start()
 print("✅ Story-Iter models loaded.")
 
 # ============================================================================
@@ -119,6 +149,14 @@ STORY_BEATS = [
      "And so, with one chapter closed, eyes turned toward the next great adventure."),
 ]
 
+
+def format_story_beats(prompt: str, frame_count: int) -> Tuple[List[str], List[str]]:
+    """Image prompts and narration texts of the first `frame_count` beats."""
+    beats = STORY_BEATS[:frame_count]
+    prompts    = [b[0].format(prompt=prompt) for b in beats]
+    narrations = [b[1].format(prompt=prompt.split(',')[0]) for b in beats]
+    return prompts, narrations
+
 # ============================================================================
 # DATA MODELS (identical to server.py)
 # ============================================================================
@@ -128,6 +166,8 @@ class GenerateStoryRequest(BaseModel):
     style: Optional[str] = "storybook"
     frameCount: int = 15
     referenceImage: Optional[str] = None  # base64 encoded PNG/JPEG
+    quality: Optional[str] = "standard"  # "draft" | "standard" | "high", see QUALITY_TIERS
+    schedule: Optional[str] = None  # name of a shipped Story-Iter schedule, e.g. "draft" / "final"; overrides quality
 
 class Frame(BaseModel):
     index: int
@@ -154,9 +194,10 @@ def upload_to_firebase(local_file_path: str, storage_path: str) -> str:
 # IMAGE GENERATION via Story-Iter (StoryAdapterXL)
 #
 # Pipeline:
-#   Pass 0  — text-only generation (or character-seeded if referenceImage provided)
-#   Pass 1-3 — iterative refinement using accumulated thumbnail context
-#   Pass 4  — final full-resolution output to disk
+#   Pass 0   — text-only generation (or character-seeded if referenceImage provided)
+#   Pass 1…n — iterative refinement using accumulated thumbnail context
+#   Last     — final full-resolution output to disk
+#   Steps, IP scale, resolution, guidance and scheduler of every pass come from a StoryIterSchedule.
 #
 # Professor's requirement: character image is OPTIONAL.
 #   Without referenceImage: pure text-driven story generation
@@ -167,14 +208,14 @@ def generate_images_via_story_iter(
     frame_count: int,
     style: str,
     ref_image_b64: Optional[str] = None,
-) -> List[tuple]:
+    schedule: Optional[StoryIterSchedule] = None,
+) -> Tuple[List[tuple], Dict[str, Any]]:
     """
-    Returns a list of (local_image_path, narration_text) tuples.
+    Returns a list of (local_image_path, narration_text) tuples, plus the Story-Iter run stats
+    (passes actually run, frames per pass, CLIP drift per checked pass).
     Uses StoryAdapterXL iterative refinement for semantic consistency.
     """
-    beats = STORY_BEATS[:frame_count]
-    prompts    = [b[0].format(prompt=prompt) for b in beats]
-    narrations = [b[1].format(prompt=prompt.split(',')[0]) for b in beats]
+    prompts, narrations = format_story_beats(prompt, frame_count)
 
     # Decode optional character reference image
     character_image = None
@@ -185,121 +226,81 @@ def generate_images_via_story_iter(
     else:
         print(f"📝 No reference image — generating from text prompts only.")
 
-    print(f"🎨 Story-Iter: {frame_count} frames, style='{style}', device={DEVICE}")
+    schedule = schedule or default_schedule
+    print(f"🎨 Story-Iter: {frame_count} frames, style='{style}', schedule='{schedule.name}', device={DEVICE}")
 
     # ------------------------------------------------------------------
-    # Pass 0: Initial generation
-    #   - With character image → use it as the IP-Adapter reference
-    #   - Without             → text-only (use_image=False)
+    # Pass 0 is seeded by the character image (text-only without one); every later pass
+    # uses ALL previous-pass thumbnails as visual context with the schedule's IP scale.
+    # This is the core of Story-Iter: GRCA cross-attention across frames.
+    # Frames are denoised together (and with other jobs' frames) by the GenerationEngine.
     # ------------------------------------------------------------------
-    print(f"[Pass 0] Initial generation ({frame_count} frames)...")
-    thumbnails = []
-    use_character = character_image is not None
-
-    for i, text in enumerate(prompts):
-        print(f"   Frame {i+1}/{frame_count}")
-        result = storyadapter.generate(
-            pil_image=[character_image] if use_character else None,
-            use_image=use_character,
-            prompt=text,
-            scale=0.3,
-            num_samples=1,
-            num_inference_steps=20,
-            seed=42,
-            style=style,
-        )
-        thumbnails.append(result[0].resize((256, 256)))
+    images, stats = run_story_iter(
+        storyadapter,
+        prompts,
+        schedule,
+        style=style,
+        character_image=character_image,
+        generate_batch=engine.generate_batch,
+        convergence_threshold=CONVERGENCE_THRESHOLD,
+        return_stats=True,
+    )
 
     # ------------------------------------------------------------------
-    # Passes 1-3: Iterative refinement
-    #   Each pass uses ALL previous-iteration thumbnails as visual context,
-    #   progressively increasing the IP-Adapter scale (0.3 → 0.5).
-    #   This is the core of Story-Iter: GRCA cross-attention across frames.
+    # Final pass output saved to disk
     # ------------------------------------------------------------------
-    scales = np.linspace(0.3, 0.5, 3)
-    for pass_idx, scale in enumerate(scales):
-        print(f"[Pass {pass_idx+1}] Refinement (scale={scale:.2f})...")
-        new_thumbnails = []
-        for i, text in enumerate(prompts):
-            print(f"   Frame {i+1}/{frame_count}")
-            result = storyadapter.generate(
-                pil_image=thumbnails,
-                use_image=True,
-                prompt=text,
-                scale=scale,
-                num_samples=1,
-                num_inference_steps=20,
-                seed=42,
-                style=style,
-            )
-            new_thumbnails.append(result[0].resize((256, 256)))
-        thumbnails = new_thumbnails
-
-    # ------------------------------------------------------------------
-    # Final pass: full-resolution output saved to disk
-    # ------------------------------------------------------------------
-    print(f"[Final Pass] Generating full-resolution output...")
     results = []
-    for i, text in enumerate(prompts):
-        print(f"   Frame {i+1}/{frame_count}")
-        result = storyadapter.generate(
-            pil_image=thumbnails,
-            use_image=True,
-            prompt=text,
-            scale=0.5,
-            num_samples=1,
-            num_inference_steps=20,
-            seed=42,
-            style=style,
-        )
+    for i, image in enumerate(images):
         img_filename = f"frame_{uuid.uuid4().hex[:8]}.png"
         img_path = os.path.join("generated_videos", img_filename)
-        result[0].save(img_path)
+        image.save(img_path)
         results.append((img_path, narrations[i]))
         print(f"   Saved → {img_filename}")
 
-    print(f"✅ Story-Iter complete: {len(results)} frames generated.")
-    return results
+    print(f"✅ Story-Iter complete: {len(results)} frames generated in {stats['passes_run']}/{len(schedule.passes)} passes.")
+    return results, stats
 
 # ============================================================================
-# VIDEO COMPILER (unchanged from server.py)
+# NARRATION — all clips are known when the job starts, so they are synthesized alongside image generation
 # ============================================================================
-def create_full_story_video(frame_tuples: List[tuple], output_path: str) -> bool:
-    try:
-        clips = []
-
-        for i, (image_path, narration) in enumerate(frame_tuples):
-            print(f"   ... Rendering clip {i+1}/{len(frame_tuples)}")
-
-            audio_path = image_path.replace(".png", ".mp3")
-            tts = gTTS(text=narration, lang='en')
-            tts.save(audio_path)
-
-            audio_clip = AudioFileClip(audio_path)
-            duration = audio_clip.duration + 0.5
-
-            clip = ImageClip(image_path).set_duration(duration)
-            w, h = clip.size
-            zoomed = clip.resize(lambda t: 1 + 0.025 * t).set_position(('center', 'center'))
-            composite = CompositeVideoClip([zoomed], size=(w, h)).set_audio(audio_clip)
-            clips.append(composite)
-
-        print(f"   ... Concatenating {len(clips)} clips into final video")
-        final_video = concatenate_videoclips(clips, method="compose")
-        final_video.write_videofile(
-            output_path,
-            fps=24,
-            codec="libx264",
-            preset="ultrafast",
-            audio_codec="aac",
-        )
-
-        for clip in clips:
-            try:
-                clip.close()
-            except Exception:
-                pass
+# one batched narration call per story in flight, overlapping that story's image generation
+tts_pool = ThreadPoolExecutor(max_workers=GPU_WORKERS, thread_name_prefix="tts")
+narration_engine = make_narration_engine(NARRATION_ENGINE, **{
+    "gtts": {"workers": TTS_WORKERS},
+    "xtts": {"speaker_wav": NARRATION_SPEAKER_WAV},
+}.get(NARRATION_ENGINE, {}))
+# most beats don't interpolate the prompt, so their clips are shared by every request (NARRATION_CACHE_DIR / _MB)
+narration_cache = NarrationCache()
+
+
+def start_narration(narrations: List[str]) -> Future:
+    """Synthesize every clip of a story in one batched call on the TTS pool; resolves to NarrationResults."""
+    audio_paths = [
+        os.path.join("generated_videos", f"narration_{uuid.uuid4().hex[:8]}.{narration_engine.ext}") for _ in narrations
+    ]
+    return tts_pool.submit(narration_engine.narrate, narrations, audio_paths, narration_cache)
 
+# ============================================================================
+# VIDEO COMPILER — Ken Burns zoom per scene, narration audio, streamed into ffmpeg (see story_video.py)
+# ============================================================================
+def create_full_story_video(frame_tuples: List[tuple], output_path: str,
+                            narration: Optional[Future] = None) -> bool:
+    """`narration` is the batch started by `start_narration`; without it the clips are synthesized now."""
+    try:
+        if narration is None:
+            narration = start_narration([text for _, text in frame_tuples])
+
+        wait_start = time.perf_counter()
+        clips: List[NarrationResult] = narration.result()
+        synthesized = [clip.seconds for clip in clips if not clip.cached]
+        print(f"   ... Narration ready for {len(clips)} clips (waited {time.perf_counter() - wait_start:.1f}s; "
+              f"{NARRATION_ENGINE}: {len(synthesized)} synthesized in {sum(synthesized):.1f}s, "
+              f"{len(clips) - len(synthesized)} cached)")
+        scenes = [scene_for(image_path, clip.audio_path) for (image_path, _), clip in zip(frame_tuples, clips)]
+
+        print(f"   ... Rendering {len(scenes)} clips into final video ({VIDEO_RENDERER})")
+        renderer_kwargs = {"workers": VIDEO_WORKERS} if VIDEO_RENDERER == "parallel" else {}
+        RENDERERS[VIDEO_RENDERER](scenes, output_path, **renderer_kwargs)
         return True
 
     except Exception as e:
@@ -317,73 +318,108 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+add_queue_full_handler(app)
 os.makedirs("generated_videos", exist_ok=True)
 app.mount("/videos", StaticFiles(directory="generated_videos"), name="videos")
 
 
-# In-memory job store: jobId -> {"status": "processing"|"done"|"error", ...}
-jobs: Dict[str, Any] = {}
+def _resolve_schedule(request: GenerateStoryRequest) -> StoryIterSchedule:
+    """An explicit schedule wins over the quality tier."""
+    if request.schedule:
+        return schedules[request.schedule]
+    return QUALITY_TIERS[request.quality or "standard"]
+
+
+def _run_generation(job_id: str, request: GenerateStoryRequest, set_state) -> Dict[str, Any]:
+    story_id = f"{request.userId}_{uuid.uuid4().hex[:8]}"
+    # narration text does not depend on the images: synthesize it while the GPU works
+    narration_batch = start_narration(format_story_beats(request.prompt, request.frameCount)[1])
+
+    frame_tuples, iter_stats = generate_images_via_story_iter(
+        request.prompt,
+        request.frameCount,
+        request.style,
+        request.referenceImage,
+        _resolve_schedule(request),
+    )
+
+    set_state("encoding")
+    video_name = f"story_{uuid.uuid4().hex[:8]}.mp4"
+    video_path = os.path.join("generated_videos", video_name)
+    success = create_full_story_video(frame_tuples, video_path, narration_batch)
+    if not success:
+        raise Exception("Video compilation failed")
+
+    set_state("uploading")
+    video_url = upload_to_firebase(video_path, f"videos/{video_name}")
+    print(f"✅ Story video ready: {video_url}")
+
+    frames = []
+    for i, (img_path, narration) in enumerate(frame_tuples):
+        img_filename = os.path.basename(img_path)
+        img_url = upload_to_firebase(img_path, f"images/{img_filename}")
+        frames.append({"index": i, "narration": narration, "imageUrl": img_url})
+
+    return {
+        "storyId": story_id,
+        "frames": frames,
+        "videoUrl": video_url,
+        "passesRun": iter_stats["passes_run"],
+        "framesPerPass": iter_stats["frames_per_pass"],
+        "maxDriftPerPass": iter_stats["max_drift_per_pass"],
+        "narrationSeconds": [round(clip.seconds, 2) for clip in narration_batch.result()],
+    }
+
+
+# Bounded job queue drained by GPU_WORKERS threads; jobId -> queued|running|encoding|uploading|done|error
+scheduler = JobScheduler(_run_generation, num_workers=GPU_WORKERS, max_queue=MAX_QUEUED_JOBS).start()
 
 
 @app.get("/health")
 def health():
-    return {"status": "ok", "engine": "story-iter", "device": DEVICE}
+    return {
+        "status": "ok",
+        "engine": "story-iter",
+        "device": DEVICE,
+        "promptCache": storyadapter.prompt_cache.stats(),
+        "narration": {"engine": NARRATION_ENGINE, "cache": narration_cache.stats()},
+        "queue": scheduler.stats(),
+        "batching": engine.stats(),
+        "schedules": {"default": default_schedule.name, "available": sorted(schedules)},
+        "qualityTiers": {
+            tier: {"schedule": schedule.name, "predictedGpuSecondsPerFrame": round(
+                schedule.estimate_gpu_seconds(1, engine.seconds_per_megapixel_step()), 1)}
+            for tier, schedule in QUALITY_TIERS.items()
+        },
+    }
 
 
 @app.get("/job/{job_id}")
 def get_job(job_id: str):
-    if job_id not in jobs:
+    job = scheduler.get(job_id)
+    if job is None:
         raise HTTPException(status_code=404, detail="Job not found")
-    return jobs[job_id]
-
-
-def _run_generation(job_id: str, request: GenerateStoryRequest):
-    try:
-        story_id = f"{request.userId}_{uuid.uuid4().hex[:8]}"
-
-        frame_tuples = generate_images_via_story_iter(
-            request.prompt,
-            request.frameCount,
-            request.style,
-            request.referenceImage,
-        )
-
-        video_name = f"story_{uuid.uuid4().hex[:8]}.mp4"
-        video_path = os.path.join("generated_videos", video_name)
-        success = create_full_story_video(frame_tuples, video_path)
-        if not success:
-            raise Exception("Video compilation failed")
-
-        video_url = upload_to_firebase(video_path, f"videos/{video_name}")
-        print(f"✅ Story video ready: {video_url}")
-
-        frames = []
-        for i, (img_path, narration) in enumerate(frame_tuples):
-            img_filename = os.path.basename(img_path)
-            img_url = upload_to_firebase(img_path, f"images/{img_filename}")
-            frames.append({"index": i, "narration": narration, "imageUrl": img_url})
-
-        jobs[job_id] = {
-            "status": "done",
-            "storyId": story_id,
-            "frames": frames,
-            "videoUrl": video_url,
-        }
-        print(f"✅ Job {job_id} complete.")
-
-    except Exception as e:
-        print(f"❌ Job {job_id} failed: {e}")
-        jobs[job_id] = {"status": "error", "detail": str(e)}
+    return job
 
 
 @app.post("/generate-story")
 async def generate_story(request: GenerateStoryRequest):
-    job_id = uuid.uuid4().hex[:12]
-    jobs[job_id] = {"status": "processing"}
-    thread = threading.Thread(target=_run_generation, args=(job_id, request), daemon=True)
-    thread.start()
-    print(f"🚀 Job {job_id} started in background.")
-    return {"jobId": job_id, "status": "processing"}
+    if request.schedule and request.schedule not in schedules:
+        raise HTTPException(status_code=400, detail=f"Unknown schedule '{request.schedule}', expected one of {sorted(schedules)}")
+    if request.quality and request.quality not in QUALITY_TIERS:
+        raise HTTPException(status_code=400, detail=f"Unknown quality '{request.quality}', expected one of {list(QUALITY_TIERS)}")
+    if not 1 <= request.frameCount <= len(STORY_BEATS):
+        raise HTTPException(status_code=400, detail=f"frameCount must be between 1 and {len(STORY_BEATS)}, got {request.frameCount}")
+    schedule = _resolve_schedule(request)
+    # GPU cost from the schedule's denoising work, at the rate the engine has measured so far
+    predicted = schedule.estimate_gpu_seconds(request.frameCount, engine.seconds_per_megapixel_step())
+    job_id = scheduler.submit(request, fields={  # a full queue answers 429, see add_queue_full_handler
+        "quality": None if request.schedule else request.quality or "standard",  # the tier only if it picked the schedule
+        "schedule": schedule.name,
+        "predictedGpuSeconds": round(predicted),
+    })
+    print(f"🚀 Job {job_id} queued.")
+    return {"jobId": job_id, **scheduler.get(job_id)}
 
 
 if __name__ == "__main__":
@@ -0,0 +1,258 @@
+"""
+Cross-request batching engine for Story-Iter
+============================================
+One GPU thread owns the diffusion pipeline. Jobs hand it whole Story-Iter passes through
+`generate_batch` (same arguments as `StoryAdapterXL.generate_batch`) and block until their frames
+are back. Every frame becomes a work item, and at each batch boundary the engine fills one UNet batch
+with items from *any* job that share resolution, step count, guidance, noise scheduler, number of
+reference images, warm-start strength, preview settings and CFG cutoff. Reference tokens, init image, IP scale, style and seed stay per
+sample, and every frame keeps its own generator, so a job's images do not depend on which other jobs it
+was batched with.
+
+The engine only needs an adapter exposing `generate_batch(...)` and `micro_batch_size(...)`, so it
+imports without torch and can be load-tested with a fake adapter on CPU
+(see `benchmarks/bench_continuous_batching.py`):
+
+    engine = GenerationEngine(storyadapter, memory_budget_gb=24).start()
+    images = engine.generate_batch(prompts, reference_embeds=reference, scale=0.4, seeds=42,
+                                   num_inference_steps=20, style="storybook")
+"""
+
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+
+class _PendingPass:
+    """The frames of one `generate_batch` call; the submitting job waits on `done`."""
+
+    def __init__(self, num_frames: int):
+        self.images: List[Any] = [None] * num_frames
+        self.remaining = num_frames
+        self.error: Optional[BaseException] = None
+        self.done = threading.Event()
+
+
+@dataclass
+class WorkItem:
+    """One frame to denoise, plus where its image goes."""
+
+    prompt: str
+    reference: Any  # ReferenceEmbeds or None
+    scale: float
+    seed: Optional[int]
+    style: str
+    key: tuple  # (height, width, num_inference_steps, guidance_scale, scheduler, num_ref, strength, preview, cfg_cutoff)
+    owner: _PendingPass
+    index: int
+    init_image: Any = None  # warm-start image when the key's strength is set
+
+
+class GenerationEngine:
+    def __init__(self, adapter, memory_budget_gb: Optional[float] = None, max_batch_size: Optional[int] = None):
+        """
+        Args:
+            adapter: a `StoryAdapterXL` (or anything with the same `generate_batch` / `micro_batch_size`).
+            memory_budget_gb: activation memory one UNet batch may use; sets the batch size per resolution.
+            max_batch_size: hard cap on frames per UNet batch, applied on top of the memory budget.
+        """
+        self.adapter = adapter
+        self.memory_budget_gb = memory_budget_gb
+        self.max_batch_size = max_batch_size
+
+        self._pending: List[WorkItem] = []
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stopping = False
+        self._batches = 0
+        self._frames = 0
+        self._busy_seconds = 0.0
+        self._megapixel_steps = 0.0
+
+    # ------------------------------------------------------------------
+    # lifecycle
+    # ------------------------------------------------------------------
+    def start(self):
+        self._thread = threading.Thread(target=self._loop, name="generation-engine", daemon=True)
+        self._thread.start()
+        return self
+
+    def shutdown(self, wait: bool = True):
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        if wait and self._thread is not None:
+            self._thread.join()
+
+    # ------------------------------------------------------------------
+    # public API
+    # ------------------------------------------------------------------
+    def generate_batch(
+        self,
+        prompts,
+        reference_embeds=None,
+        scale=1.0,
+        seeds=None,
+        guidance_scale=5.0,
+        num_inference_steps=30,
+        style="comic",
+        height=1024,
+        width=1024,
+        scheduler=None,
+        init_images=None,
+        strength=None,
+        preview_steps=None,
+        preview_decoder=None,
+        preview_size=256,
+        cfg_cutoff=None,
+    ) -> List[Any]:
+        """Queue one image per prompt and block until all of them are generated; returns them in prompt order."""
+        if isinstance(prompts, str):
+            prompts = [prompts]
+        n = len(prompts)
+        if n == 0:
+            return []  # nothing would ever complete the pass
+        seeds = seeds if isinstance(seeds, (list, tuple)) else [seeds] * n
+        # ReferenceEmbeds is a NamedTuple, so only a list means one reference per prompt
+        references = reference_embeds if isinstance(reference_embeds, list) else [reference_embeds] * n
+        scales = scale if isinstance(scale, (list, tuple)) else [scale] * n
+        styles = style if isinstance(style, (list, tuple)) else [style] * n
+        init_images = init_images if init_images is not None else [None] * n
+        preview = None
+        if preview_steps is not None or preview_decoder is not None:
+            preview = (preview_steps, preview_decoder, preview_size)
+
+        owner = _PendingPass(n)
+        with self._cond:
+            if self._stopping:
+                raise RuntimeError("Generation engine is shut down")
+            for i in range(n):
+                num_ref = None if references[i] is None else references[i].num_ref
+                key = (height, width, num_inference_steps, float(guidance_scale), scheduler, num_ref, strength, preview,
+                       cfg_cutoff)
+                self._pending.append(
+                    WorkItem(prompts[i], references[i], float(scales[i]), seeds[i], styles[i], key, owner, i,
+                             init_images[i])
+                )
+            self._cond.notify()
+
+        owner.done.wait()
+        if owner.error is not None:
+            raise owner.error
+        return owner.images
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                "pendingFrames": len(self._pending),
+                "batches": self._batches,
+                "frames": self._frames,
+                "meanBatchSize": round(self._frames / self._batches, 2) if self._batches else 0.0,
+                "busySeconds": round(self._busy_seconds, 1),
+                "secondsPerMegapixelStep": self.seconds_per_megapixel_step(),
+            }
+
+    def seconds_per_megapixel_step(self) -> Optional[float]:
+        """Measured GPU seconds per denoising step of one 1024x1024 frame (None until a batch has run)."""
+        if not self._megapixel_steps:
+            return None
+        return round(self._busy_seconds / self._megapixel_steps, 4)
+
+    # ------------------------------------------------------------------
+    # internals
+    # ------------------------------------------------------------------
+    def _next_batch(self) -> List[WorkItem]:
+        # the oldest waiting frame picks the batch shape; compatible frames from any job fill it in FIFO order
+        height, width = self._pending[0].key[:2]
+        key = self._pending[0].key
+        limit = self.adapter.micro_batch_size(height, width, self.max_batch_size, self.memory_budget_gb)
+        batch, rest = [], []
+        for item in self._pending:
+            if item.key == key and (limit is None or len(batch) < limit):
+                batch.append(item)
+            else:
+                rest.append(item)
+        self._pending = rest
+        return batch
+
+    def _run(self, batch: List[WorkItem]):
+        height, width, num_inference_steps, guidance_scale, scheduler, _, strength, preview, cfg_cutoff = batch[0].key
+        preview_steps, preview_decoder, preview_size = preview or (None, None, 256)
+        return self.adapter.generate_batch(
+            [item.prompt for item in batch],
+            reference_embeds=[item.reference for item in batch],
+            scale=[item.scale for item in batch],
+            seeds=[item.seed for item in batch],
+            style=[item.style for item in batch],
+            guidance_scale=guidance_scale,
+            num_inference_steps=num_inference_steps,
+            height=height,
+            width=width,
+            scheduler=scheduler,
+            init_images=[item.init_image for item in batch] if strength is not None else None,
+            strength=strength,
+            preview_steps=preview_steps,
+            preview_decoder=preview_decoder,
+            preview_size=preview_size,
+            cfg_cutoff=cfg_cutoff,
+        )
+
+    def _run_isolated(self, batch: List[WorkItem]):
+        """
+        Run `batch`; returns `[(items, images, error)]`. When a batch holding frames of several jobs fails,
+        each job's frames are retried on their own, so only the job whose frames fail gets the error.
+        """
+        try:
+            return [(batch, self._run(batch), None)]
+        except Exception as e:
+            print(f"❌ Batch of {len(batch)} frames failed: {e}")
+            owners = list(dict.fromkeys(item.owner for item in batch))
+            if len(owners) == 1:
+                return [(batch, [None] * len(batch), e)]
+        runs = []
+        for owner in owners:
+            items = [item for item in batch if item.owner is owner]
+            try:
+                runs.append((items, self._run(items), None))
+            except Exception as e:
+                print(f"❌ {len(items)} frames of one job failed on their own: {e}")
+                runs.append((items, [None] * len(items), e))
+        return runs
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._stopping:
+                    self._cond.wait()
+                if self._stopping:
+                    for item in self._pending:
+                        item.owner.error = RuntimeError("Generation engine is shut down")
+                        item.owner.done.set()
+                    return
+                batch = self._next_batch()
+
+            start = time.time()
+            runs = self._run_isolated(batch)
+
+            with self._cond:
+                self._batches += len(runs)
+                self._frames += len(batch)
+                self._busy_seconds += time.time() - start
+                height, width, num_inference_steps, _, _, _, strength, preview, _ = batch[0].key
+                steps_run = num_inference_steps * (strength or 1)
+                steps_run = min(steps_run, preview[0]) if preview is not None and preview[0] else steps_run
+                self._megapixel_steps += len(batch) * steps_run * height * width / 1024 ** 2
+                failed = False
+                for items, images, error in runs:
+                    failed = failed or error is not None
+                    for item, image in zip(items, images):
+                        owner = item.owner
+                        owner.images[item.index] = image
+                        owner.error = owner.error or error
+                        owner.remaining -= 1
+                        if owner.remaining == 0 or error is not None:
+                            owner.done.set()
+                if failed:
+                    # a failed pass releases its job right away; drop its frames that are still queued
+                    self._pending = [item for item in self._pending if item.owner.error is None]
@@ -0,0 +1,186 @@
+"""
+GPU job scheduler for the Cinder backend
+========================================
+A bounded FIFO of story jobs drained by a fixed number of worker threads, so concurrent
+requests no longer interleave on the GPU or overrun its memory.
+
+The scheduler knows nothing about diffusion: it calls `run_job(job_id, payload, set_state)`
+and stores whatever dict it returns. That keeps it importable without torch, so it can be
+driven by a fake engine on CPU:
+
+    def fake_engine(job_id, payload, set_state):
+        time.sleep(0.1)
+        set_state("encoding")
+        return {"storyId": job_id, "frames": [], "videoUrl": None}
+
+    scheduler = JobScheduler(fake_engine, num_workers=1, max_queue=2)
+    job_id = scheduler.submit({"prompt": "a fox"})
+    scheduler.get(job_id)   # {"status": "queued", "position": 0, "etaSeconds": ...}
+
+Job states: queued → running → encoding → uploading → done, or error from any of them.
+"""
+
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from typing import Any, Callable, Dict, Optional
+
+JOB_STATES = ("queued", "running", "encoding", "uploading", "done", "error")
+FINISHED_STATES = ("done", "error")
+
+
+class QueueFullError(Exception):
+    """Raised by `JobScheduler.submit` when the queue is at capacity (served as HTTP 429)."""
+
+
+def add_queue_full_handler(app):
+    """Serve a `QueueFullError` raised by any route of the FastAPI `app` as HTTP 429."""
+    from fastapi.responses import JSONResponse
+
+    async def queue_full(request, exc):
+        return JSONResponse(status_code=429, content={"detail": str(exc)})
+
+    app.add_exception_handler(QueueFullError, queue_full)
+    return app
+
+
+class JobScheduler:
+    def __init__(
+        self,
+        run_job: Callable[[str, Any, Callable[[str], None]], Dict[str, Any]],
+        num_workers: int = 1,
+        max_queue: int = 8,
+        default_job_seconds: float = 600.0,
+        max_finished: int = 1000,
+    ):
+        """
+        Args:
+            run_job: called on a worker thread as `run_job(job_id, payload, set_state)`; returns the
+                result fields merged into the finished job, or raises to mark the job as errored.
+            num_workers: jobs allowed on the GPU at once.
+            max_queue: jobs allowed to wait; `submit` raises `QueueFullError` beyond this.
+            default_job_seconds: duration estimate used for ETAs until a job has finished.
+            max_finished: finished jobs kept for polling before the oldest are dropped.
+        """
+        self.run_job = run_job
+        self.num_workers = num_workers
+        self.max_queue = max_queue
+        self.max_finished = max_finished
+        self.avg_job_seconds = default_job_seconds
+
+        self._jobs: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._queue = deque()
+        self._cond = threading.Condition()
+        self._workers = []
+        self._stopping = False
+
+    # ------------------------------------------------------------------
+    # lifecycle
+    # ------------------------------------------------------------------
+    def start(self):
+        for i in range(self.num_workers):
+            worker = threading.Thread(target=self._worker, name=f"gpu-worker-{i}", daemon=True)
+            worker.start()
+            self._workers.append(worker)
+        return self
+
+    def shutdown(self, wait: bool = True):
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        if wait:
+            for worker in self._workers:
+                worker.join()
+
+    # ------------------------------------------------------------------
+    # public API
+    # ------------------------------------------------------------------
+    def submit(self, payload: Any, job_id: Optional[str] = None, fields: Optional[Dict[str, Any]] = None) -> str:
+        """Queue `payload` for `run_job`; `fields` are reported with the job from the start (e.g. its predicted cost)."""
+        with self._cond:
+            if len(self._queue) >= self.max_queue:
+                raise QueueFullError(f"Job queue is full ({self.max_queue} waiting), try again later")
+            job_id = job_id or uuid.uuid4().hex[:12]
+            self._jobs[job_id] = {**(fields or {}), "status": "queued", "submittedAt": time.time()}
+            self._queue.append((job_id, payload))
+            self._cond.notify()
+        return job_id
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Snapshot of a job for polling, with `position` (0 = next to run) and `etaSeconds` while unfinished."""
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            snapshot = {k: v for k, v in job.items() if not k.endswith("At")}
+            if job["status"] == "queued":
+                position = next(i for i, (queued_id, _) in enumerate(self._queue) if queued_id == job_id)
+                snapshot["position"] = position
+                snapshot["etaSeconds"] = round(self._queued_eta(position))
+            elif job["status"] not in FINISHED_STATES:
+                elapsed = time.time() - job["startedAt"]
+                snapshot["etaSeconds"] = round(max(0.0, self.avg_job_seconds - elapsed))
+            return snapshot
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            running = sum(1 for job in self._jobs.values() if job["status"] not in FINISHED_STATES + ("queued",))
+            return {
+                "queued": len(self._queue),
+                "running": running,
+                "workers": self.num_workers,
+                "maxQueue": self.max_queue,
+                "avgJobSeconds": round(self.avg_job_seconds, 1),
+            }
+
+    # ------------------------------------------------------------------
+    # internals
+    # ------------------------------------------------------------------
+    def _queued_eta(self, position: int) -> float:
+        # time until a worker frees up, then whole jobs for everyone ahead in the queue
+        now = time.time()
+        remaining = sorted(
+            max(0.0, self.avg_job_seconds - (now - job["startedAt"]))
+            for job in self._jobs.values()
+            if job["status"] not in FINISHED_STATES + ("queued",)
+        )
+        free_at = remaining + [0.0] * (self.num_workers - len(remaining))
+        rounds, slot = divmod(position, self.num_workers)
+        return sorted(free_at)[slot] + rounds * self.avg_job_seconds + self.avg_job_seconds
+
+    def _set_state(self, job_id: str, status: str):
+        assert status in JOB_STATES, status
+        with self._cond:
+            self._jobs[job_id]["status"] = status
+
+    def _finish(self, job_id: str, fields: Dict[str, Any]):
+        with self._cond:
+            job = self._jobs[job_id]
+            duration = time.time() - job["startedAt"]
+            if fields["status"] == "done":
+                # exponential moving average of successful job durations drives the ETAs
+                self.avg_job_seconds = 0.7 * self.avg_job_seconds + 0.3 * duration
+            job.update(fields)
+            finished = [k for k, v in self._jobs.items() if v["status"] in FINISHED_STATES]
+            for old_id in finished[: max(0, len(finished) - self.max_finished)]:
+                del self._jobs[old_id]
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                while not self._queue and not self._stopping:
+                    self._cond.wait()
+                if self._stopping:
+                    return
+                job_id, payload = self._queue.popleft()
+                self._jobs[job_id]["status"] = "running"
+                self._jobs[job_id]["startedAt"] = time.time()
+
+            try:
+                result = self.run_job(job_id, payload, lambda status: self._set_state(job_id, status))
+                self._finish(job_id, {"status": "done", **(result or {})})
+                print(f"✅ Job {job_id} complete.")
+            except Exception as e:
+                print(f"❌ Job {job_id} failed: {e}")
+                self._finish(job_id, {"status": "error", "detail": str(e)})
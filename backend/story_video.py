@@ -0,0 +1,215 @@
+"""
+Ken Burns story video renderer that streams raw frames straight into ffmpeg.
+
+The MoviePy path (`render_story_video_moviepy`, the original `create_full_story_video` body) builds every
+scene as `ImageClip(...).resize(lambda t: 1 + 0.025 * t)` inside a `CompositeVideoClip`, so each output
+frame is a full-resolution Python-level resize plus a composite, and `concatenate_videoclips(method="compose")`
+composites everything once more before the encode. `render_story_video` produces the same zoom curve
+(scale `1 + ZOOM_RATE * t`, centred, cropped to the frame) and timing (narration + `TAIL_SECONDS` per scene,
+`FPS` frames per second) with one affine warp per frame — `cv2.warpAffine` when OpenCV is installed, a
+separable NumPy bilinear resample otherwise — piped as rgb24 into a single ffmpeg process that also pads
+and concatenates the narration tracks.
+
+`render_story_video_parallel` encodes every scene as its own segment, with the same codec parameters as
+the single-process path, one ffmpeg process per scene fed by a thread pool, and joins the segments with
+ffmpeg's concat demuxer (`-c copy`, no re-encode), so encode wall time scales with the number of cores.
+
+The ffmpeg binary is `FFMPEG_BINARY` if set (the variable MoviePy reads), else the one bundled with
+imageio-ffmpeg (a MoviePy dependency), else `ffmpeg` on the PATH.
+"""
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Iterator, List, Optional
+
+import numpy as np
+from PIL import Image
+
+try:
+    import cv2
+except ImportError:  # optional: the NumPy resampler is ~5x slower but has no extra dependency
+    cv2 = None
+
+FPS = 24
+ZOOM_RATE = 0.025  # the scale grows by this much per second of a scene
+TAIL_SECONDS = 0.5  # silence held after each narration
+X264_PRESET = "ultrafast"
+
+
+@dataclass
+class Scene:
+    image_path: str
+    audio_path: str
+    duration: float  # seconds of video; the narration is padded with silence up to it
+
+    def num_frames(self, fps: int = FPS) -> int:
+        return max(1, round(self.duration * fps))
+
+
+def ffmpeg_binary() -> str:
+    if os.getenv("FFMPEG_BINARY"):
+        return os.environ["FFMPEG_BINARY"]
+    try:
+        import imageio_ffmpeg
+        return imageio_ffmpeg.get_ffmpeg_exe()
+    except (ImportError, RuntimeError):
+        return shutil.which("ffmpeg") or "ffmpeg"
+
+
+def audio_duration(path: str) -> float:
+    """Duration of an audio file in seconds, from ffmpeg's stream header (no decode)."""
+    result = subprocess.run([ffmpeg_binary(), "-hide_banner", "-i", path], capture_output=True, text=True)
+    match = re.search(r"Duration: (\d+):(\d+):(\d+(?:\.\d+)?)", result.stderr)
+    if match is None:
+        raise RuntimeError(f"ffmpeg could not read the duration of {path}: {result.stderr.strip()[-300:]}")
+    hours, minutes, seconds = match.groups()
+    return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+
+def scene_for(image_path: str, audio_path: str) -> Scene:
+    """A scene lasting its narration plus `TAIL_SECONDS`, as the MoviePy path timed it."""
+    return Scene(image_path, audio_path, audio_duration(audio_path) + TAIL_SECONDS)
+
+
+def _zoom_numpy(image: np.ndarray, scale: float) -> np.ndarray:
+    """Centre crop of `image` magnified by `scale`, bilinear, separable (rows, then columns)."""
+    h, w = image.shape[:2]
+
+    def taps(n):
+        src = np.clip((np.arange(n) + 0.5 - n / 2) / scale + n / 2 - 0.5, 0, n - 1)
+        lo = np.floor(src).astype(np.intp)
+        hi = np.minimum(lo + 1, n - 1)
+        return lo, hi, (src - lo).astype(np.float32)
+
+    y0, y1, wy = taps(h)
+    x0, x1, wx = taps(w)
+    rows = image[y0] * (1 - wy)[:, None, None] + image[y1] * wy[:, None, None]
+    frame = rows[:, x0] * (1 - wx)[None, :, None] + rows[:, x1] * wx[None, :, None]
+    return (frame + 0.5).astype(np.uint8)
+
+
+def zoom_frame(image: np.ndarray, scale: float) -> np.ndarray:
+    """`image` (h, w, 3; uint8, or float32 without OpenCV) scaled by `scale` about its centre, cropped to (h, w)."""
+    if cv2 is None:
+        return _zoom_numpy(image, scale)
+    h, w = image.shape[:2]
+    matrix = np.float32([[scale, 0, (1 - scale) * (w - 1) / 2], [0, scale, (1 - scale) * (h - 1) / 2]])
+    return cv2.warpAffine(image, matrix, (w, h), flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
+
+
+def ken_burns_frames(image_path: str, num_frames: int, fps: int = FPS,
+                     zoom_rate: float = ZOOM_RATE) -> Iterator[np.ndarray]:
+    image = np.asarray(Image.open(image_path).convert("RGB"))
+    if cv2 is None:
+        image = image.astype(np.float32)  # convert once, not per frame
+    for k in range(num_frames):
+        yield zoom_frame(image, 1 + zoom_rate * k / fps)
+
+
+def render_story_video(scenes: List[Scene], output_path: str, fps: int = FPS, zoom_rate: float = ZOOM_RATE,
+                       preset: str = X264_PRESET, threads: Optional[int] = None) -> None:
+    """Encode `scenes` back to back into one H.264/AAC mp4; raises RuntimeError if ffmpeg fails."""
+    width, height = Image.open(scenes[0].image_path).size
+    audio_inputs, audio_filters = [], []
+    for i, scene in enumerate(scenes):
+        audio_inputs += ["-i", scene.audio_path]
+        # resample to a common format so concat accepts any TTS output, then pad to the scene's length
+        audio_filters.append(f"[{i + 1}:a]aformat=sample_rates=44100:channel_layouts=stereo,"
+                             f"apad=whole_dur={scene.num_frames(fps) / fps:.6f}[a{i}]")
+    audio_filters.append("".join(f"[a{i}]" for i in range(len(scenes))) + f"concat=n={len(scenes)}:v=0:a=1[aout]")
+    command = [
+        ffmpeg_binary(), "-y", "-hide_banner", "-loglevel", "error",
+        "-f", "rawvideo", "-pix_fmt", "rgb24", "-s", f"{width}x{height}", "-r", str(fps), "-i", "-",
+        *audio_inputs,
+        "-filter_complex", ";".join(audio_filters),
+        "-map", "0:v", "-map", "[aout]",
+        "-c:v", "libx264", "-preset", preset, "-pix_fmt", "yuv420p",
+        "-c:a", "aac",
+        *(["-threads", str(threads)] if threads else []),
+        output_path,
+    ]
+    process = subprocess.Popen(command, stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+    try:
+        for scene in scenes:
+            for frame in ken_burns_frames(scene.image_path, scene.num_frames(fps), fps, zoom_rate):
+                process.stdin.write(frame.tobytes())
+        process.stdin.close()
+    except BrokenPipeError:
+        pass  # ffmpeg exited early; its stderr says why
+    finally:
+        stderr = process.stderr.read().decode(errors="replace")
+        process.wait()
+    if process.returncode != 0:
+        raise RuntimeError(f"ffmpeg exited with code {process.returncode}: {stderr.strip()[-500:]}")
+
+
+def concat_segments(segment_paths: List[str], output_path: str) -> None:
+    """Join mp4 segments with identical codec parameters via ffmpeg's concat demuxer, without re-encoding."""
+    list_path = output_path + ".segments.txt"
+    with open(list_path, "w") as f:
+        for path in segment_paths:
+            escaped = os.path.abspath(path).replace("'", "'\\''")
+            f.write(f"file '{escaped}'\n")
+    try:
+        result = subprocess.run([ffmpeg_binary(), "-y", "-hide_banner", "-loglevel", "error", "-f", "concat",
+                                 "-safe", "0", "-i", list_path, "-c", "copy", output_path],
+                                capture_output=True, text=True)
+    finally:
+        os.remove(list_path)
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg concat exited with code {result.returncode}: {result.stderr.strip()[-500:]}")
+
+
+def render_story_video_parallel(scenes: List[Scene], output_path: str, fps: int = FPS,
+                                zoom_rate: float = ZOOM_RATE, preset: str = X264_PRESET,
+                                workers: Optional[int] = None) -> None:
+    """`render_story_video` with one segment per scene, `workers` (default: all cores) encoded at a time."""
+    cores = os.cpu_count() or 1
+    workers = min(len(scenes), workers or cores)
+    if workers <= 1:
+        return render_story_video(scenes, output_path, fps, zoom_rate, preset)
+    # threads, not processes: the encode runs in each scene's ffmpeg and the warps release the GIL, while forking
+    # the multithreaded, CUDA-initialized server can deadlock and spawning would re-import it (and its models)
+    threads = max(1, cores // workers)
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(output_path))) as directory:
+        segment_paths = [os.path.join(directory, f"scene_{i:03d}.mp4") for i in range(len(scenes))]
+        with ThreadPoolExecutor(workers, thread_name_prefix="video-segment") as pool:
+            futures = [pool.submit(render_story_video, [scene], path, fps, zoom_rate, preset, threads)
+                       for scene, path in zip(scenes, segment_paths)]
+            for future in futures:
+                future.result()
+        concat_segments(segment_paths, output_path)
+
+
+def render_story_video_moviepy(scenes: List[Scene], output_path: str, fps: int = FPS,
+                               zoom_rate: float = ZOOM_RATE, preset: str = X264_PRESET) -> None:
+    """The original MoviePy renderer, kept as a fallback (`VIDEO_RENDERER=moviepy`) and benchmark baseline."""
+    from moviepy.editor import AudioFileClip, CompositeVideoClip, ImageClip, concatenate_videoclips
+
+    clips = []
+    try:
+        for scene in scenes:
+            audio_clip = AudioFileClip(scene.audio_path)
+            clip = ImageClip(scene.image_path).set_duration(scene.duration)
+            w, h = clip.size
+            zoomed = clip.resize(lambda t: 1 + zoom_rate * t).set_position(('center', 'center'))
+            clips.append(CompositeVideoClip([zoomed], size=(w, h)).set_audio(audio_clip))
+        final_video = concatenate_videoclips(clips, method="compose")
+        final_video.write_videofile(output_path, fps=fps, codec="libx264", preset=preset, audio_codec="aac")
+    finally:
+        for clip in clips:
+            try:
+                clip.close()
+            except Exception:
+                pass
+
+
+RENDERERS = {
+    "parallel": render_story_video_parallel,
+    "ffmpeg": render_story_video,
+    "moviepy": render_story_video_moviepy,
+}
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the backend runs from its own directory (`python colab_server.py`), so its modules import top-level
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
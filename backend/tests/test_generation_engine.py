@@ -0,0 +1,86 @@
+import random
+import threading
+from collections import namedtuple
+
+import pytest
+
+from generation_engine import GenerationEngine
+
+Reference = namedtuple("Reference", ["num_ref"])
+
+
+class FakeAdapter:
+    """Deterministic stand-in for StoryAdapterXL: a frame's "image" depends only on its own prompt, seed and scale."""
+
+    def __init__(self):
+        self.batches = []
+        self.lock = threading.Lock()
+
+    def micro_batch_size(self, height=1024, width=1024, max_batch_size=None, memory_budget_gb=None):
+        return max_batch_size
+
+    def generate_batch(self, prompts, seeds=None, scale=1.0, **kwargs):
+        with self.lock:
+            self.batches.append(list(prompts))
+        if any("broken" in prompt for prompt in prompts):
+            raise RuntimeError("NaN latents")
+        return [(prompt, seed, scale_, random.Random(f"{prompt}/{seed}").random())
+                for prompt, seed, scale_ in zip(prompts, seeds, scale)]
+
+
+def run_jobs(engine, jobs):
+    """Queue every job before the engine thread starts, so they all compete for the first batch."""
+    results = {}
+
+    def job(name, prompts, seed):
+        try:
+            results[name] = engine.generate_batch(prompts, seeds=seed, scale=0.5, num_inference_steps=4)
+        except Exception as e:
+            results[name] = e
+
+    threads = [threading.Thread(target=job, args=(name, *args)) for name, args in jobs.items()]
+    for thread in threads:
+        thread.start()
+    while len(engine._pending) < sum(len(prompts) for prompts, _ in jobs.values()):
+        threading.Event().wait(0.01)
+    engine.start()
+    for thread in threads:
+        thread.join(5)
+    engine.shutdown()
+    return results
+
+
+def test_frames_from_several_jobs_share_a_batch():
+    adapter = FakeAdapter()
+    engine = GenerationEngine(adapter, max_batch_size=8)
+    results = run_jobs(engine, {"a": (["a0", "a1", "a2"], 1), "b": (["b0", "b1"], 2), "c": (["c0"], 3)})
+
+    assert adapter.batches == [["a0", "a1", "a2", "b0", "b1", "c0"]]
+    assert [image[:3] for image in results["b"]] == [("b0", 2, 0.5), ("b1", 2, 0.5)]
+    assert engine.stats()["meanBatchSize"] == 6
+
+
+def test_images_do_not_depend_on_batch_partners():
+    alone = run_jobs(GenerationEngine(FakeAdapter(), max_batch_size=8), {"a": (["x", "y"], 7)})["a"]
+    merged = run_jobs(GenerationEngine(FakeAdapter(), max_batch_size=8),
+                      {"b": (["x", "z"], 8), "a": (["x", "y"], 7)})["a"]
+    assert merged == alone
+    assert run_jobs(GenerationEngine(FakeAdapter(), max_batch_size=8), {"a": (["x", "y"], 8)})["a"] != alone
+
+
+def test_failure_only_fails_the_job_that_caused_it():
+    adapter = FakeAdapter()
+    engine = GenerationEngine(adapter, max_batch_size=8)
+    results = run_jobs(engine, {"good": (["g0", "g1"], 1), "bad": (["broken", "b1"], 2)})
+
+    assert isinstance(results["bad"], RuntimeError)
+    assert [image[0] for image in results["good"]] == ["g0", "g1"]
+    assert adapter.batches == [["g0", "g1", "broken", "b1"], ["g0", "g1"], ["broken", "b1"]]
+
+
+def test_error_propagates_to_a_lone_job():
+    engine = GenerationEngine(FakeAdapter()).start()
+    with pytest.raises(RuntimeError, match="NaN latents"):
+        engine.generate_batch(["broken"], seeds=1)
+    assert engine.generate_batch(["fine"], seeds=1)[0][0] == "fine"  # the engine keeps serving
+    engine.shutdown()
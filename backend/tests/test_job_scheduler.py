@@ -0,0 +1,113 @@
+import threading
+import time
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from job_scheduler import JobScheduler, QueueFullError, add_queue_full_handler
+
+
+class FakeEngine:
+    """`run_job` stand-in: each job blocks until the test releases it, then returns or raises."""
+
+    def __init__(self):
+        self.release = {}
+        self.started = {}
+
+    def __call__(self, job_id, payload, set_state):
+        self.started.setdefault(job_id, threading.Event()).set()
+        self.release.setdefault(job_id, threading.Event()).wait(5)
+        if payload.get("fail"):
+            raise RuntimeError("CUDA out of memory")
+        set_state("encoding")
+        return {"storyId": job_id, "frames": [payload["prompt"]]}
+
+    def wait_started(self, job_id):
+        assert self.started.setdefault(job_id, threading.Event()).wait(5)
+
+    def finish(self, job_id):
+        self.release.setdefault(job_id, threading.Event()).set()
+
+
+def wait_for(scheduler, job_id, status):
+    deadline = time.time() + 5
+    while scheduler.get(job_id)["status"] != status:
+        assert time.time() < deadline, scheduler.get(job_id)
+        time.sleep(0.01)
+    return scheduler.get(job_id)
+
+
+@pytest.fixture
+def engine():
+    return FakeEngine()
+
+
+@pytest.fixture
+def scheduler(engine):
+    scheduler = JobScheduler(engine, num_workers=1, max_queue=2, default_job_seconds=100.0).start()
+    yield scheduler
+    for event in engine.release.values():
+        event.set()
+    scheduler.shutdown(wait=False)
+
+
+def test_job_runs_to_done(scheduler, engine):
+    first = scheduler.submit({"prompt": "a fox"}, fields={"quality": "draft"})
+    engine.wait_started(first)
+    second = scheduler.submit({"prompt": "a hare"})
+
+    assert scheduler.get(first)["status"] == "running"
+    assert scheduler.get(second)["status"] == "queued"
+    engine.finish(first)
+    job = wait_for(scheduler, first, "done")
+    assert job == {"quality": "draft", "status": "done", "storyId": first, "frames": ["a fox"]}
+    engine.wait_started(second)
+    assert scheduler.get(second)["status"] == "running"
+
+
+def test_failed_job_reports_error(scheduler, engine):
+    job_id = scheduler.submit({"prompt": "a fox", "fail": True})
+    engine.wait_started(job_id)
+    engine.finish(job_id)
+    job = wait_for(scheduler, job_id, "error")
+    assert job["detail"] == "CUDA out of memory"
+    assert scheduler.stats()["avgJobSeconds"] == 100.0  # failures don't move the duration estimate
+
+
+def test_queue_position_and_eta(scheduler, engine):
+    running = scheduler.submit({"prompt": "a fox"})
+    engine.wait_started(running)
+    queued = [scheduler.submit({"prompt": f"story {i}"}) for i in range(2)]
+
+    assert 99 <= scheduler.get(running)["etaSeconds"] <= 100
+    first, second = (scheduler.get(job_id) for job_id in queued)
+    assert first["position"] == 0 and second["position"] == 1
+    # the running job's remaining time, then one whole job per job ahead, then its own
+    assert 199 <= first["etaSeconds"] <= 200
+    assert 299 <= second["etaSeconds"] <= 300
+
+
+def test_full_queue_raises(scheduler, engine):
+    engine.wait_started(scheduler.submit({"prompt": "a fox"}))
+    scheduler.submit({"prompt": "a hare"})
+    scheduler.submit({"prompt": "an owl"})
+    with pytest.raises(QueueFullError):
+        scheduler.submit({"prompt": "a wolf"})
+    assert scheduler.stats()["queued"] == 2
+
+
+def test_full_queue_is_served_as_429(scheduler, engine):
+    app = add_queue_full_handler(FastAPI())
+
+    @app.post("/generate-story")
+    def generate_story(payload: dict):
+        return {"jobId": scheduler.submit(payload)}
+
+    client = TestClient(app)
+    engine.wait_started(client.post("/generate-story", json={"prompt": "a fox"}).json()["jobId"])
+    assert client.post("/generate-story", json={"prompt": "a hare"}).status_code == 200
+    assert client.post("/generate-story", json={"prompt": "an owl"}).status_code == 200
+    response = client.post("/generate-story", json={"prompt": "a wolf"})
+    assert response.status_code == 429
+    assert "queue is full" in response.json()["detail"]
@@ -5,7 +5,10 @@ import { auth } from '../firebaseConfig';
 //   Colab (Story-Iter):           paste the ngrok URL from cinder_colab.ipynb Cell 5
 const API_URL = 'https://eruciform-evalyn-nonintrospectively.ngrok-free.dev';
 
-export const generateStory = async (prompt: string, style: string, frameCount: number, refImage: string | null): Promise<any> => {
+// 'draft' is a fast low-resolution preview, 'high' the slow full-resolution schedule
+export type StoryQuality = 'draft' | 'standard' | 'high';
+
+export const generateStory = async (prompt: string, style: string, frameCount: number, refImage: string | null, quality: StoryQuality = 'standard'): Promise<any> => {
   // Step 1: kick off the job
   const startRes = await fetch(`${API_URL}/generate-story`, {
     method: 'POST',
@@ -16,6 +19,7 @@ export const generateStory = async (prompt: string, style: string, frameCount: n
       style,
       frameCount,
       referenceImage: refImage,
+      quality,
     }),
   });
 
@@ -24,7 +28,8 @@ export const generateStory = async (prompt: string, style: string, frameCount: n
     throw new Error(`Server Error: ${errorText}`);
   }
 
-  const { jobId } = await startRes.json();
+  const { jobId, predictedGpuSeconds } = await startRes.json();
+  console.log(`Job ${jobId} queued (${quality}, ~${predictedGpuSeconds}s of GPU time)`);
 
   // Step 2: poll until done
   const POLL_INTERVAL_MS = 5000;
@@ -41,7 +46,7 @@ export const generateStory = async (prompt: string, style: string, frameCount: n
 
     if (job.status === 'done') return job;
     if (job.status === 'error') throw new Error(`Server Error: ${job.detail}`);
-    // status === 'processing' → keep polling
+    // queued / running / encoding / uploading → keep polling
   }
 
   throw new Error('Story generation timed out after 20 minutes');